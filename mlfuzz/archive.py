@@ -0,0 +1,278 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Content-addressed archive of finished trial folders.
+
+The archive is an SQLite database holding the files of many trials. File contents are stored
+once per distinct content, compressed and indexed by their SHA-256 hash, so that the seeds
+shared by all trials of a target, and duplicate inputs found by several trials, take space only
+once. Trials are named by their path relative to the results folder, e.g.,
+`zlib/AFL/trial-0`, and their files can be listed and read without extracting anything.
+"""
+import fnmatch
+import hashlib
+import os
+import sqlite3
+import stat
+import time
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from mlfuzz.logs import _zstandard
+
+# Compressions of the stored contents
+archive_compressions = ["zlib", "zstd"]
+
+
+@dataclass
+class ArchivedFile:
+    """File of an archived trial."""
+
+    path: str  # Relative to the trial folder, with `/` separators
+    digest: Optional[str]  # SHA-256 of the content, `None` for directories
+    size: int
+    mode: int
+    mtime: float
+
+    def is_dir(self) -> bool:
+        return stat.S_ISDIR(self.mode)
+
+
+@dataclass
+class ArchiveStats:
+    """Outcome of archiving one trial."""
+
+    n_files: int
+    n_new_contents: int
+    total_bytes: int  # Size of all files of the trial
+    stored_bytes: int  # Size added to the archive for new contents, after compression
+
+
+class TrialArchive:
+    """
+    SQLite-backed, content-addressed store of trial folders.
+
+    Args:
+        path: Location of the database file. It is created if it does not exist.
+        compression: Compression of the contents added to the archive, one of
+            `archive_compressions`. Archives can mix contents of both compressions.
+        level: Compression level.
+    """
+
+    def __init__(self, path: Path, compression: str = "zlib", level: int = 6) -> None:
+        if compression not in archive_compressions:
+            raise ValueError(f"Unknown archive compression: {compression}.")
+        self.path = path
+        self.compression = compression
+        self.level = level
+        self._compressor = (
+            _zstandard().ZstdCompressor(level=level) if compression == "zstd" else None
+        )
+        self._db = sqlite3.connect(str(path))
+        self._db.execute("PRAGMA journal_mode=WAL")
+        with self._db:
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS contents (
+                    digest TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    compression TEXT NOT NULL,
+                    data BLOB NOT NULL
+                )
+                """
+            )
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS trials (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT UNIQUE NOT NULL,
+                    archived_at REAL NOT NULL
+                )
+                """
+            )
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS files (
+                    trial_id INTEGER NOT NULL REFERENCES trials(id),
+                    path TEXT NOT NULL,
+                    digest TEXT,
+                    size INTEGER NOT NULL,
+                    mode INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    PRIMARY KEY (trial_id, path)
+                )
+                """
+            )
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self) -> "TrialArchive":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def add_trial(self, name: str, folder: Path) -> ArchiveStats:
+        """
+        Archive all files of a trial folder in one transaction.
+
+        Args:
+            name: Name of the trial in the archive, e.g., its path relative to the results folder.
+            folder: Trial folder to archive.
+
+        Returns:
+            The numbers of files and bytes archived.
+        """
+        if self.has_trial(name):
+            raise ValueError(f"Trial {name} is already archived.")
+        stats = ArchiveStats(0, 0, 0, 0)
+        with self._db:
+            trial_id = self._db.execute(
+                "INSERT INTO trials (name, archived_at) VALUES (?, ?)", (name, time.time())
+            ).lastrowid
+            rows: List[Tuple[int, str, Optional[str], int, int, float]] = []
+            for path in sorted(self._walk(folder)):
+                info = path.lstat()
+                relative = path.relative_to(folder).as_posix()
+                if stat.S_ISDIR(info.st_mode):
+                    rows.append((trial_id, relative, None, 0, info.st_mode, info.st_mtime))
+                    continue
+                if stat.S_ISLNK(info.st_mode):
+                    content = os.readlink(path).encode()
+                else:
+                    content = path.read_bytes()
+                digest = hashlib.sha256(content).hexdigest()
+                stored = self._store(digest, content)
+                rows.append((trial_id, relative, digest, len(content), info.st_mode, info.st_mtime))
+                stats.n_files += 1
+                stats.total_bytes += len(content)
+                if stored is not None:
+                    stats.n_new_contents += 1
+                    stats.stored_bytes += stored
+            self._db.executemany(
+                "INSERT INTO files (trial_id, path, digest, size, mode, mtime) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        return stats
+
+    def has_trial(self, name: str) -> bool:
+        return self._trial_id(name) is not None
+
+    def trials(self, pattern: str = "*") -> List[str]:
+        """Names of the archived trials matching a glob pattern, e.g., `zlib/AFL/*`."""
+        names = [row[0] for row in self._db.execute("SELECT name FROM trials ORDER BY name")]
+        return [name for name in names if fnmatch.fnmatchcase(name, pattern)]
+
+    def files(self, trial: str, pattern: str = "*") -> List[ArchivedFile]:
+        """
+        Files of an archived trial matching a glob pattern on their relative path.
+
+        Args:
+            trial: Name of the trial.
+            pattern: Pattern, e.g., `queue/id*` or `*/queue/id*` for AFL++-based fuzzers.
+                Wildcards also match `/`.
+
+        Returns:
+            The matching files and folders, sorted by path.
+        """
+        trial_id = self._trial_id(trial)
+        if trial_id is None:
+            raise KeyError(trial)
+        rows = self._db.execute(
+            "SELECT path, digest, size, mode, mtime FROM files WHERE trial_id = ? ORDER BY path",
+            (trial_id,),
+        )
+        return [ArchivedFile(*row) for row in rows if fnmatch.fnmatchcase(row[0], pattern)]
+
+    def read(self, trial: str, path: str) -> bytes:
+        """Content of a file of an archived trial."""
+        trial_id = self._trial_id(trial)
+        row = self._db.execute(
+            "SELECT digest FROM files WHERE trial_id = ? AND path = ?", (trial_id, path)
+        ).fetchone()
+        if row is None or row[0] is None:
+            raise FileNotFoundError(f"{trial}/{path}")
+        return self.content(row[0])
+
+    def content(self, digest: str) -> bytes:
+        """Stored content with the given SHA-256 hash."""
+        row = self._db.execute(
+            "SELECT compression, data FROM contents WHERE digest = ?", (digest,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(digest)
+        compression, data = row
+        if compression == "zlib":
+            return zlib.decompress(data)
+        if compression == "zstd":
+            return _zstandard().ZstdDecompressor().decompress(data)
+        return bytes(data)
+
+    def iter_contents(self, trial: str, pattern: str = "*") -> Iterator[Tuple[ArchivedFile, bytes]]:
+        """Matching regular files of an archived trial with their contents, sorted by path."""
+        for archived in self.files(trial, pattern):
+            if archived.digest is not None and stat.S_ISREG(archived.mode):
+                yield archived, self.content(archived.digest)
+
+    def extract(self, trial: str, folder: Path) -> None:
+        """Restore an archived trial into a folder, with file modes and times."""
+        entries = self.files(trial)
+        for archived in entries:
+            target = folder / archived.path
+            if archived.is_dir():
+                os.makedirs(target, exist_ok=True)
+                continue
+            os.makedirs(target.parent, exist_ok=True)
+            assert archived.digest is not None
+            content = self.content(archived.digest)
+            if stat.S_ISLNK(archived.mode):
+                os.symlink(content.decode(), target)
+                continue
+            target.write_bytes(content)
+            os.chmod(target, stat.S_IMODE(archived.mode))
+            os.utime(target, (archived.mtime, archived.mtime))
+        # Folder times change while their files are written
+        for archived in reversed(entries):
+            if archived.is_dir():
+                os.utime(folder / archived.path, (archived.mtime, archived.mtime))
+
+    def _trial_id(self, name: str) -> Optional[int]:
+        row = self._db.execute("SELECT id FROM trials WHERE name = ?", (name,)).fetchone()
+        return None if row is None else row[0]
+
+    def _store(self, digest: str, content: bytes) -> Optional[int]:
+        """Store a content unless already present. Return its stored size if it was added."""
+        if self._db.execute("SELECT 1 FROM contents WHERE digest = ?", (digest,)).fetchone():
+            return None
+        if self._compressor is not None:
+            compression, data = "zstd", self._compressor.compress(content)
+        else:
+            compression, data = "zlib", zlib.compress(content, self.level)
+        if len(data) >= len(content):
+            compression, data = "none", content  # Small or incompressible content
+        self._db.execute(
+            "INSERT INTO contents (digest, size, compression, data) VALUES (?, ?, ?, ?)",
+            (digest, len(content), compression, data),
+        )
+        return len(data)
+
+    @staticmethod
+    def _walk(folder: Path) -> Iterator[Path]:
+        for root, subfolders, files in os.walk(folder):
+            for name in subfolders + files:
+                yield Path(root) / name
@@ -0,0 +1,504 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Execution backends starting and tracking the jobs of an experiment.
+
+  - `DockerBackend` runs every job in its own container of the `mlfuzz` image.
+  - `NativeBackend` runs the fuzzer run scripts directly as host processes. The host must
+    provide the same fuzzer installation as the `mlfuzz` image (e.g., `/afl`, `/neuzz`).
+"""
+import asyncio
+import concurrent.futures
+import logging
+import os
+import queue
+import shutil
+import signal
+import subprocess
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from mlfuzz.containers import ContainerMonitor
+from mlfuzz.docker_api import (
+    DockerApiError,
+    DockerClient,
+    EventLoopThread,
+    default_socket_path,
+    socket_path_from_env,
+)
+from mlfuzz.experiment import Fuzzer, JobAssignment
+from mlfuzz.logs import RotatingLogWriter, move_log
+from mlfuzz.memory import container_rss_mb, session_rss_mb
+
+logger = logging.getLogger("neuzzpp")
+
+# Fuzzers whose ML component talks to the fuzzer over a hard-coded local port
+fixed_port_fuzzers = [Fuzzer.NEUZZ.name, Fuzzer.PREFUZZ.name]
+
+
+class ExecutionBackend(ABC):
+    """Interface for starting jobs and learning when they finish."""
+
+    def start(self) -> None:
+        """Prepare the backend before the first job is launched."""
+
+    def stop(self) -> None:
+        """Release the resources of the backend after the last job finished."""
+
+    @abstractmethod
+    def launch(self, assignment: JobAssignment, command: Sequence[str]) -> Optional[str]:
+        """
+        Start a job in the background.
+
+        Args:
+            assignment: Job to start, with the core and GPU it is assigned to.
+            command: Command line running the fuzzer of the job.
+
+        Returns:
+            A handle allowing to re-attach to the job with `adopt`, or `None` if the job could
+            not be started.
+        """
+
+    @abstractmethod
+    def adopt(self, name: str, handle: str) -> bool:
+        """
+        Track a job started by a previous run of the experiment.
+
+        Args:
+            name: Name of the job.
+            handle: Handle returned when the job was launched.
+
+        Returns:
+            Whether the job is still running or left an exit code behind. If `False`, the job
+            is lost and needs to be run again.
+        """
+
+    @abstractmethod
+    def wait(self, timeout: float) -> Dict[str, Optional[int]]:
+        """
+        Block until at least one job finishes or the timeout elapses.
+
+        Args:
+            timeout: Maximum waiting time in seconds.
+
+        Returns:
+            The exit codes of the finished jobs, indexed by job name. The exit code is `None`
+            if it could not be determined.
+        """
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        Measure the memory used by the running jobs.
+
+        Returns:
+            The resident memory in MB of the jobs that could be measured, indexed by job name.
+        """
+        return {}
+
+    @abstractmethod
+    def kill(self, name: str) -> None:
+        """Stop a running job. It is then reported as finished by `wait`."""
+
+    @abstractmethod
+    def save_logs(self, name: str, log_path: Path) -> None:
+        """Write the console output of a finished job to `log_path`."""
+
+    @abstractmethod
+    def cleanup(self, name: str) -> None:
+        """Remove what is left of a successfully finished job."""
+
+
+class DockerBackend(ExecutionBackend):
+    """
+    Run each job in a Docker container pinned to the assigned core.
+
+    The Docker daemon is driven through its Engine API, without spawning `docker` processes.
+    The console output of each container is streamed to `<log_folder>/<job name>/docker.log`
+    while the job runs, rotated into compressed segments, and moved to the results once the job
+    finished.
+
+    Args:
+        image: Name of the Docker image to run.
+        volumes: Host folders mounted at the same location in the containers.
+        use_events: Whether to detect container exits from the Docker event stream.
+        socket_path: Unix socket of the Docker daemon.
+        log_folder: Folder where the logs of running containers are written.
+        log_rotate_mb: Size in MB after which logs are rotated, 0 to disable rotation.
+        log_compression: Compression of rotated log segments, `gzip` or `zstd`.
+        scratch_size_mb: Size in MB of the tmpfs mounted at `/scratch` in the containers, for
+            jobs writing their output to scratch space. No tmpfs is mounted if 0.
+    """
+
+    def __init__(
+        self,
+        image: str,
+        volumes: Sequence[Path],
+        use_events: bool = True,
+        socket_path: str = default_socket_path,
+        log_folder: Path = Path("/tmp/mlfuzz-logs"),
+        log_rotate_mb: int = 64,
+        log_compression: str = "gzip",
+        scratch_size_mb: int = 0,
+    ) -> None:
+        self.image = image
+        self.volumes = volumes
+        self.log_folder = log_folder
+        self.log_rotate_mb = log_rotate_mb
+        self.log_compression = log_compression
+        self.scratch_size_mb = scratch_size_mb
+        self.loop = EventLoopThread()
+        self.client = DockerClient(socket_path)
+        self.monitor = ContainerMonitor(self.client, self.loop, use_events=use_events)
+        self._container_ids: Dict[str, str] = {}
+        self._log_streams: Dict[str, concurrent.futures.Future] = {}
+
+    def start(self) -> None:
+        self.monitor.start()
+
+    def stop(self) -> None:
+        self.monitor.stop()
+        self.loop.run(self.client.close())
+        self.loop.stop()
+
+    def launch(self, assignment: JobAssignment, command: Sequence[str]) -> Optional[str]:
+        name = assignment.job.name()
+        try:
+            container_id = self.loop.run(
+                self.client.run_container(
+                    name,
+                    self.image,
+                    command,
+                    user=f"{os.getuid()}:{os.getgid()}",
+                    binds=[f"{volume}:{volume}" for volume in self.volumes],
+                    cpuset=str(assignment.core_id),
+                    memory_mb=assignment.memory_limit_mb,
+                    gpus=None if assignment.gpu_id is None else [assignment.gpu_id],
+                    tmpfs=(
+                        {"/scratch": f"size={self.scratch_size_mb}m"}
+                        if self.scratch_size_mb > 0
+                        else None
+                    ),
+                )
+            )
+        except (OSError, DockerApiError) as err:
+            logger.warning(f"{name}: cannot run container: {err}")
+            return None
+        self._container_ids[name] = container_id
+        self.monitor.watch(name)
+        self._capture_logs(name)
+        return name
+
+    def adopt(self, name: str, handle: str) -> bool:
+        # The monitor reports containers that exited or disappeared in the meantime
+        self.monitor.watch(handle)
+        self._capture_logs(handle)
+        return True
+
+    def wait(self, timeout: float) -> Dict[str, Optional[int]]:
+        exits = self.monitor.wait(timeout)
+        for name, exitcode in exits.items():
+            if exitcode is None:
+                # The container is gone: its logs are neither saved nor cleaned up, stop
+                # following them and close the log file
+                self._container_ids.pop(name, None)
+                self._stop_log_stream(name)
+        return exits
+
+    def memory_usage(self) -> Dict[str, int]:
+        watched = self.monitor.watched
+        if not watched.issubset(self._container_ids):
+            try:
+                containers = self.loop.run(self.client.list_containers())
+            except (OSError, DockerApiError) as err:
+                logger.warning(f"Failed to query container IDs: {err}")
+                return {}
+            for container in containers:
+                self._container_ids[container.name] = container.id
+
+        # Read the cgroups of the containers directly, without going through the Docker daemon
+        usage: Dict[str, int] = {}
+        for name in watched:
+            if name in self._container_ids:
+                rss = container_rss_mb(self._container_ids[name])
+                if rss is not None:
+                    usage[name] = rss
+        return usage
+
+    def kill(self, name: str) -> None:
+        try:
+            self.loop.run(self.client.kill_container(name))
+        except (OSError, DockerApiError) as err:
+            logger.warning(f"{name}: Docker kill failed: {err}")
+
+    def log_path(self, name: str) -> Path:
+        """Location of the log of a running job."""
+        return self.log_folder / name / "docker.log"
+
+    def save_logs(self, name: str, log_path: Path) -> None:
+        if not self._finish_log_stream(name):
+            self._capture_logs(name, follow=False).result()
+        move_log(self.log_path(name), log_path)
+        shutil.rmtree(self.log_path(name).parent, ignore_errors=True)
+
+    def cleanup(self, name: str) -> None:
+        self._container_ids.pop(name, None)
+        self._stop_log_stream(name)
+        shutil.rmtree(self.log_path(name).parent, ignore_errors=True)
+        try:
+            self.loop.run(self.client.remove_container(name))
+        except DockerApiError as err:
+            if err.status != 404:
+                logger.warning(f"{name}: Docker rm failed: {err}")
+        except OSError as err:
+            logger.warning(f"{name}: Docker rm failed: {err}")
+
+    def _capture_logs(self, name: str, follow: bool = True) -> concurrent.futures.Future:
+        # Start the log from scratch, the stream sends the whole output of the container
+        path = self.log_path(name)
+        shutil.rmtree(path.parent, ignore_errors=True)
+        os.makedirs(path.parent)
+        writer = RotatingLogWriter(path, self.log_rotate_mb * 2**20, self.log_compression)
+        stream = self.loop.submit(self._stream_logs(name, writer, follow))
+        self._log_streams[name] = stream
+        return stream
+
+    def _stop_log_stream(self, name: str) -> None:
+        stream = self._log_streams.pop(name, None)
+        if stream is not None:
+            stream.cancel()
+
+    def _finish_log_stream(self, name: str) -> bool:
+        stream = self._log_streams.pop(name, None)
+        if stream is None:
+            return False
+        try:
+            stream.result(timeout=30)  # The stream ends shortly after the container stopped
+        except concurrent.futures.TimeoutError:
+            stream.cancel()
+            logger.warning(f"{name}: log stream did not end. Reading the logs again.")
+            return False
+        except (OSError, asyncio.IncompleteReadError, DockerApiError) as err:
+            logger.warning(f"{name}: log stream failed ({err}). Reading the logs again.")
+            return False
+        return True
+
+    async def _stream_logs(self, name: str, writer: RotatingLogWriter, follow: bool) -> None:
+        # File writes and compression run in threads, to keep the event loop responsive
+        loop = asyncio.get_event_loop()
+        try:
+            async for data in self.client.stream_logs(name, follow=follow):
+                await loop.run_in_executor(None, writer.write, data)
+        finally:
+            await loop.run_in_executor(None, writer.close)
+
+
+class NativeBackend(ExecutionBackend):
+    """
+    Run each job as a host process pinned to the assigned core with `taskset`.
+
+    Every job runs in its own working directory, like in a fresh container: the ML components
+    of NEUZZ and PreFuzz write their data relative to the current folder. Regular files from
+    `template_folder` (the `WORKDIR` of the `mlfuzz` image, e.g., `/prefuzz`) are linked
+    into each working directory, since the run scripts expect to find them there.
+    Jobs run in their own session and record their exit code in their working directory, so
+    that they survive a restart of the experiment runner and can be adopted afterwards.
+
+    NEUZZ and PreFuzz also connect their fuzzer and ML model over a hard-coded local port.
+    With `isolate_network`, each of their jobs gets a private network namespace, hence its
+    own set of ports, through an unprivileged user namespace (`unshare -rn`).
+    Memory limits of jobs are not enforced by this backend.
+
+    Args:
+        work_folder: Folder where the working directories of the jobs are created.
+        template_folder: Optional folder whose files are linked into each working directory.
+        isolate_network: Whether to run jobs of fuzzers using fixed ports in their own
+            network namespace.
+    """
+
+    def __init__(
+        self,
+        work_folder: Path,
+        template_folder: Optional[Path] = None,
+        isolate_network: bool = True,
+    ) -> None:
+        self.work_folder = work_folder
+        self.template_folder = template_folder
+        self.isolate_network = isolate_network
+        self._procs: Dict[str, subprocess.Popen] = {}
+        self._adopted: Dict[str, int] = {}
+        self._exits: "queue.Queue[str]" = queue.Queue()
+
+    def workdir(self, name: str) -> Path:
+        """Working directory of the job with the given name."""
+        return self.work_folder / name
+
+    def launch(self, assignment: JobAssignment, command: Sequence[str]) -> Optional[str]:
+        name = assignment.job.name()
+        workdir = self.workdir(name)
+        try:
+            if workdir.exists():
+                shutil.rmtree(workdir)
+            os.makedirs(workdir)
+            if self.template_folder is not None:
+                for entry in self.template_folder.iterdir():
+                    if entry.is_file():
+                        os.symlink(entry, workdir / entry.name)
+        except OSError as err:
+            logger.warning(f"{name}: cannot prepare working directory {workdir}: {err}")
+            return None
+
+        cmd: List[str] = ["taskset", "-c", str(assignment.core_id)]
+        cmd += ["sh", "-c", '"$@"; code=$?; echo $code > exit_code; exit $code', "sh"]
+        if self.isolate_network and assignment.job.fuzzer in fixed_port_fuzzers:
+            cmd += ["unshare", "-rn", "sh", "-c", 'ip link set lo up && exec "$@"', "sh"]
+        cmd += command
+
+        # Hide all GPUs from jobs without a GPU assignment, as Docker does
+        env = dict(os.environ)
+        env["CUDA_VISIBLE_DEVICES"] = "" if assignment.gpu_id is None else str(assignment.gpu_id)
+
+        try:
+            with open(workdir / "job.log", "w") as log_file:
+                proc = subprocess.Popen(
+                    cmd,
+                    cwd=workdir,
+                    env=env,
+                    stdout=log_file,
+                    stderr=subprocess.STDOUT,
+                    start_new_session=True,
+                )
+        except OSError as err:
+            logger.warning(f"{name}: {' '.join(cmd)} failed to start: {err}")
+            return None
+        self._procs[name] = proc
+        threading.Thread(target=self._wait_for, args=(name, proc), daemon=True).start()
+        return str(proc.pid)
+
+    def adopt(self, name: str, handle: str) -> bool:
+        if self._is_alive(name, int(handle)) or (self.workdir(name) / "exit_code").exists():
+            self._adopted[name] = int(handle)
+            return True
+        return False
+
+    def wait(self, timeout: float) -> Dict[str, Optional[int]]:
+        finished: Dict[str, Optional[int]] = {}
+        deadline = time.monotonic() + timeout
+        while not finished:
+            # Processes of previous runs are not our children, poll them every second
+            for name, pid in list(self._adopted.items()):
+                if not self._is_alive(name, pid):
+                    del self._adopted[name]
+                    finished[name] = self._read_exit_code(name)
+            if finished:
+                break
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                name = self._exits.get(timeout=min(remaining, 1.0) if self._adopted else remaining)
+            except queue.Empty:
+                continue
+            finished[name] = self._procs.pop(name).returncode
+            # Collect all the other jobs that finished in the meantime
+            while True:
+                try:
+                    name = self._exits.get_nowait()
+                except queue.Empty:
+                    break
+                finished[name] = self._procs.pop(name).returncode
+        return finished
+
+    def memory_usage(self) -> Dict[str, int]:
+        # Each job runs in its own session, led by the process started by the backend
+        sessions = {name: proc.pid for name, proc in self._procs.items()}
+        sessions.update(self._adopted)
+        return session_rss_mb(sessions)
+
+    def kill(self, name: str) -> None:
+        if name in self._procs:
+            pid = self._procs[name].pid
+        elif name in self._adopted and self._is_alive(name, self._adopted[name]):
+            pid = self._adopted[name]
+        else:
+            return
+        # Kill the whole session of the job, including the fuzzer's forkserver and ML model
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except OSError as err:
+            logger.warning(f"{name}: cannot kill process group {pid}: {err}")
+
+    def save_logs(self, name: str, log_path: Path) -> None:
+        shutil.move(str(self.workdir(name) / "job.log"), str(log_path))
+
+    def cleanup(self, name: str) -> None:
+        shutil.rmtree(self.workdir(name), ignore_errors=True)
+
+    def _is_alive(self, name: str, pid: int) -> bool:
+        # Guard against PID reuse by checking that the process runs in the job's folder
+        try:
+            return Path(f"/proc/{pid}/cwd").resolve() == self.workdir(name).resolve()
+        except OSError:
+            return False
+
+    def _read_exit_code(self, name: str) -> Optional[int]:
+        try:
+            return int((self.workdir(name) / "exit_code").read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _wait_for(self, name: str, proc: subprocess.Popen) -> None:
+        proc.wait()
+        self._exits.put(name)
+
+
+def backend_from_config(config: Dict[str, Any]) -> ExecutionBackend:
+    """
+    Create the execution backend selected in an experiment configuration.
+
+    Args:
+        config: Experiment configuration, as read from `experiment_config.yaml`.
+
+    Returns:
+        The configured backend, not started yet.
+    """
+    if config.get("backend", "docker") == "docker":
+        return DockerBackend(
+            config["docker_image"],
+            [
+                Path(config["binaries_folder"]),
+                Path(config["seeds_folder"]),
+                Path(config["results_folder"]),
+            ]
+            + ([Path(config["warmup_cache"])] if config.get("warmup_cache") else [])
+            # SQLite keeps its journal next to the database: mount the whole folder
+            + ([Path(config["coverage_cache"]).parent] if config.get("coverage_cache") else []),
+            use_events=config.get("docker_events", True),
+            socket_path=config.get("docker_socket") or socket_path_from_env(),
+            log_folder=Path(config.get("log_folder") or str(config["results_folder"]) + ".logs"),
+            log_rotate_mb=config.get("log_rotate_mb", 64),
+            log_compression=config.get("log_compression", "gzip"),
+            scratch_size_mb=config.get("scratch_size_mb", 2048) if config.get("scratch") else 0,
+        )
+    if config["backend"] == "native":
+        template_folder = config.get("native_template_folder")
+        return NativeBackend(
+            Path(config.get("native_work_folder", "/tmp/mlfuzz")),
+            template_folder=Path(template_folder) if template_folder is not None else None,
+            isolate_network=config.get("native_isolate_network", True),
+        )
+    raise ValueError(f"Unknown backend: {config['backend']}.")
@@ -0,0 +1,178 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Tracking of the Docker containers running fuzzing experiments.
+
+Container exits are learned from a single stream of Docker events instead of querying every
+container separately. Since events can be missed (e.g., when the stream is not up yet or
+breaks down), the state of all watched containers is also resynchronized periodically with
+one listing of all containers.
+"""
+import asyncio
+import concurrent.futures
+import logging
+import queue
+import time
+from typing import Dict, Optional, Set, Tuple
+
+from mlfuzz.docker_api import DockerApiError, DockerClient, EventLoopThread
+
+logger = logging.getLogger("neuzzpp")
+
+
+class ContainerMonitor:
+    """
+    Watch a set of Docker containers and report the ones that exited.
+
+    Args:
+        client: Docker API client.
+        loop: Event loop running the client.
+        use_events: Whether to listen to Docker events for container exits. If `False`
+            or if the event stream is unavailable, only periodic batched polling is used.
+        resync_interval: Interval in seconds between two batched container listings.
+    """
+
+    def __init__(
+        self,
+        client: DockerClient,
+        loop: EventLoopThread,
+        use_events: bool = True,
+        resync_interval: float = 60.0,
+    ) -> None:
+        self.client = client
+        self.loop = loop
+        self.use_events = use_events
+        self.resync_interval = resync_interval
+        self._watched: Set[str] = set()
+        self._events: "queue.Queue[Tuple[str, Optional[int]]]" = queue.Queue()
+        self._events_task: Optional[concurrent.futures.Future] = None
+        self._next_resync = 0.0
+
+    def start(self) -> None:
+        """Start listening to container exit events."""
+        if self.use_events:
+            self._events_task = self.loop.submit(self._read_events())
+
+    def stop(self) -> None:
+        """Stop listening to container exit events."""
+        if self._events_task is not None:
+            self._events_task.cancel()
+            self._events_task = None
+
+    def watch(self, name: str) -> None:
+        """Start tracking the container with the given name."""
+        self._watched.add(name)
+
+    def unwatch(self, name: str) -> None:
+        """Stop tracking the container with the given name."""
+        self._watched.discard(name)
+
+    @property
+    def watched(self) -> Set[str]:
+        """Names of the tracked containers."""
+        return set(self._watched)
+
+    @property
+    def listening(self) -> bool:
+        """Whether the Docker event stream is up."""
+        return self._events_task is not None and not self._events_task.done()
+
+    def poll(self) -> Dict[str, Optional[int]]:
+        """
+        Query the state of all watched containers with a single listing of all containers.
+
+        Returns:
+            The exit codes of the watched containers that are not running anymore, indexed by
+            container name. The exit code is `None` for containers that disappeared.
+        """
+        self._next_resync = time.monotonic() + self.resync_interval
+        if not self._watched:
+            return {}
+        try:
+            containers = self.loop.run(self.client.list_containers())
+            states = {container.name: container.state for container in containers}
+            stopped = [name for name in self._watched if states.get(name) in ("exited", "dead")]
+            # The listing only has human-readable statuses, get the exit codes concurrently
+            inspected = self.loop.run(self.client.inspect_containers(stopped))
+        except (OSError, DockerApiError) as err:
+            logger.warning(f"Failed to query container states: {err}")
+            return {}
+
+        exited: Dict[str, Optional[int]] = {
+            name: None for name in self._watched if name not in states
+        }
+        for name, state in inspected.items():
+            exited[name] = None if state is None or state.status == "dead" else state.exit_code
+        return exited
+
+    def wait(self, timeout: float) -> Dict[str, Optional[int]]:
+        """
+        Block until at least one watched container exits or the timeout elapses.
+
+        Args:
+            timeout: Maximum waiting time in seconds.
+
+        Returns:
+            The exit codes of the watched containers that exited, indexed by container name.
+            The exit code is `None` for containers that disappeared without an exit status.
+            Reported containers are no longer watched.
+        """
+        deadline = time.monotonic() + timeout
+        exited: Dict[str, Optional[int]] = {}
+        while True:
+            now = time.monotonic()
+            if now >= self._next_resync or not self.listening:
+                exited.update(self.poll())
+            exited.update(self._drain_events())
+            if exited or now >= deadline:
+                break
+
+            # Sleep until the next event, resync or the deadline, whichever comes first
+            wake_up = min(deadline, self._next_resync) if self.listening else deadline
+            try:
+                name, code = self._events.get(timeout=max(0.0, wake_up - now))
+            except queue.Empty:
+                continue
+            if name in self._watched:
+                exited[name] = code
+
+        for name in exited:
+            self.unwatch(name)
+        return exited
+
+    def _drain_events(self) -> Dict[str, Optional[int]]:
+        exited: Dict[str, Optional[int]] = {}
+        while True:
+            try:
+                name, code = self._events.get_nowait()
+            except queue.Empty:
+                return exited
+            if name in self._watched:
+                exited[name] = code
+
+    async def _read_events(self) -> None:
+        try:
+            async for event in self.client.events({"type": ["container"], "event": ["die"]}):
+                attributes = (event.get("Actor") or {}).get("Attributes") or {}
+                try:
+                    code: Optional[int] = int(attributes["exitCode"])
+                except (KeyError, ValueError):
+                    code = None
+                self._events.put((attributes.get("name", ""), code))
+        except asyncio.CancelledError:
+            raise
+        except (OSError, asyncio.IncompleteReadError, DockerApiError) as err:
+            logger.warning(f"Docker event stream failed ({err}). Falling back to polling.")
+        else:
+            logger.warning("Docker event stream closed. Falling back to polling.")
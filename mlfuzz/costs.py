@@ -0,0 +1,142 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Expected run times of jobs and the order in which jobs are started.
+
+A job runs for the configured fuzzing duration, plus an overhead that differs between fuzzers
+and targets: start-up of the ML model, and replay of the final corpus, whose time grows with the
+size of the queue. The overhead is estimated from the run times of finished jobs recorded in job
+ledgers. When the heterogeneous jobs are started in creation order, a few long jobs may start
+last and keep the end of an experiment running on a handful of cores.
+"""
+import statistics
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from mlfuzz.experiment import Job
+from mlfuzz.ledger import JobLedger
+
+# Supported orders of the job queue
+job_orders = ["fifo", "lpt", "trial_major"]
+
+
+class CostModel:
+    """
+    Estimate the run time of jobs from the run times of earlier jobs.
+
+    The overhead of a job beyond the fuzzing duration is the median overhead of earlier jobs of
+    the same fuzzer on the same target. Without such jobs, it falls back to the median overhead
+    of the fuzzer, then of the target, then of all earlier jobs, and finally to no overhead.
+
+    Args:
+        duration: Fuzzing duration of the jobs to estimate, in seconds.
+    """
+
+    def __init__(self, duration: float) -> None:
+        self.duration = duration
+        self._overheads: Dict[Tuple[str, str], List[float]] = {}
+
+    def add(self, target: str, fuzzer: str, runtime: float, duration: float) -> None:
+        """
+        Record the run time of a finished job.
+
+        Args:
+            target: File name of the target, e.g., `zlib.afl`.
+            fuzzer: Name of the fuzzer.
+            runtime: Run time of the job in seconds.
+            duration: Fuzzing duration the job was run with, in seconds.
+        """
+        self._overheads.setdefault((target, fuzzer), []).append(max(0.0, runtime - duration))
+
+    def add_ledger(self, ledger: JobLedger, duration: float) -> None:
+        """Record the run times of the finished jobs of a ledger, run with the given duration."""
+        for target, fuzzer, runtime in ledger.runtimes():
+            self.add(target, fuzzer, runtime, duration)
+
+    def overhead(self, job: Job) -> float:
+        """Expected run time of a job beyond the fuzzing duration, in seconds."""
+        target = job.target.name
+        for match in (
+            lambda key: key == (target, job.fuzzer),
+            lambda key: key[1] == job.fuzzer,
+            lambda key: key[0] == target,
+            lambda key: True,
+        ):
+            samples = [
+                overhead
+                for key, overheads in self._overheads.items()
+                if match(key)
+                for overhead in overheads
+            ]
+            if samples:
+                return statistics.median(samples)
+        return 0.0
+
+    def estimate(self, job: Job) -> float:
+        """Expected run time of a job in seconds."""
+        return self.duration + self.overhead(job)
+
+
+def order_jobs(jobs: Iterable[Job], order: str, costs: CostModel) -> List[Job]:
+    """
+    Order the job queue of an experiment.
+
+      - `fifo` keeps the creation order: by fuzzer, then by target, then by trial.
+      - `lpt` starts the longest jobs first, which shortens the tail of the experiment.
+      - `trial_major` runs the first trial of all fuzzers and targets, then the second one,
+        and so on, the longest jobs first within a trial. Interrupted experiments then still
+        compare all fuzzers on the same number of trials.
+
+    Args:
+        jobs: Jobs in creation order.
+        order: One of `job_orders`.
+        costs: Estimates of the run times of the jobs.
+
+    Returns:
+        The ordered jobs. Jobs with the same key keep their relative order.
+    """
+    jobs = list(jobs)
+    if order == "fifo":
+        return jobs
+    if order == "lpt":
+        return sorted(jobs, key=lambda job: -costs.estimate(job))
+    if order == "trial_major":
+        return sorted(jobs, key=lambda job: (job.trial, -costs.estimate(job)))
+    raise ValueError(f"Unknown job order: {order}.")
+
+
+def cost_model_from_config(config: Dict[str, Any], ledger: Optional[JobLedger] = None) -> CostModel:
+    """
+    Create the cost model of an experiment from its configuration.
+
+    Args:
+        config: Experiment configuration, as read from `experiment_config.yaml`.
+        ledger: Ledger of the experiment, whose finished jobs were run with the configured
+            duration.
+
+    Returns:
+        The cost model, trained on `ledger` and on the ledgers listed in `cost_history`.
+    """
+    costs = CostModel(config["duration"])
+    if ledger is not None:
+        costs.add_ledger(ledger, config["duration"])
+    for ledger_file, duration in (config.get("cost_history") or {}).items():
+        if not Path(ledger_file).exists():
+            raise FileNotFoundError(f"Ledger {ledger_file} from `cost_history` not found.")
+        history = JobLedger(Path(ledger_file))
+        try:
+            costs.add_ledger(history, duration)
+        finally:
+            history.close()
+    return costs
@@ -0,0 +1,146 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Persistent cache of the edges covered by seeds.
+
+Replaying a seed on a target always yields the same edges, and the initial seeds as well as
+many queue entries are identical across the trials of an experiment. The cache is an SQLite
+database mapping the key of a replay (the SHA-256 of the target binary, its arguments and the
+execution timeout) and the SHA-256 of a seed to the edges of the seed on the target, so that
+every replay only executes the seeds it has not seen before. Edge sets are
+numpy arrays of sorted edge indices, stored as zlib-compressed arrays of 32-bit integers.
+"""
+import hashlib
+import json
+import sqlite3
+import zlib
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from mlfuzz.warmup import file_digest
+
+
+def encode_edges(edges: np.ndarray) -> bytes:
+    """Compact representation of an edge set."""
+    return zlib.compress(np.unique(edges).astype("<u4").tobytes())
+
+
+def decode_edges(data: bytes) -> np.ndarray:
+    return np.frombuffer(zlib.decompress(data), dtype="<u4")
+
+
+class CoverageCache:
+    """
+    SQLite-backed cache of the edges of seeds on target binaries.
+
+    Args:
+        path: Location of the database file. It is created if it does not exist. Several
+            processes can use the same cache at once, on a local file system.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._db = sqlite3.connect(str(path), timeout=60)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        with self._db:
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS edges (
+                    binary TEXT NOT NULL,
+                    seed TEXT NOT NULL,
+                    edges BLOB NOT NULL,
+                    PRIMARY KEY (binary, seed)
+                )
+                """
+            )
+        self._binary_digests: Dict[Tuple[str, int, int], str] = {}
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self) -> "CoverageCache":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def binary_digest(self, binary: Path) -> str:
+        """SHA-256 of a target binary, computed once per binary version."""
+        info = binary.stat()
+        key = (str(binary.resolve()), info.st_size, info.st_mtime_ns)
+        if key not in self._binary_digests:
+            self._binary_digests[key] = file_digest(binary)
+        return self._binary_digests[key]
+
+    def run_key(self, target: Sequence[str], timeout_ms: int) -> str:
+        """
+        Key of the edges of seeds replayed with the same target command and timeout.
+
+        The arguments of the target decide, e.g., whether inputs are read from a file or from
+        stdin, and the timeout how far slow seeds get.
+
+        Args:
+            target: Target program and arguments.
+            timeout_ms: Timeout of each execution in milliseconds.
+        """
+        run = [self.binary_digest(Path(target[0])), list(target[1:]), timeout_ms]
+        return hashlib.sha256(json.dumps(run).encode()).hexdigest()
+
+    def get(self, binary: str, seeds: Sequence[str]) -> Dict[str, np.ndarray]:
+        """
+        Cached edges of seeds.
+
+        Args:
+            binary: Key of the replay, from `run_key`.
+            seeds: Digests of the seeds.
+
+        Returns:
+            The edges of the seeds found in the cache, by seed digest.
+        """
+        found: Dict[str, np.ndarray] = {}
+        unique = list(dict.fromkeys(seeds))
+        # Stay below the maximum number of SQLite query parameters
+        for first in range(0, len(unique), 500):
+            chunk = unique[first : first + 500]
+            rows = self._db.execute(
+                f"SELECT seed, edges FROM edges WHERE binary = ? "
+                f"AND seed IN ({', '.join('?' * len(chunk))})",
+                [binary, *chunk],
+            )
+            found.update((seed, decode_edges(data)) for seed, data in rows)
+        return found
+
+    def put(self, binary: str, edges: Dict[str, np.ndarray]) -> None:
+        """Store the edges of seeds replayed with a run key, by seed digest, in one transaction."""
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO edges (binary, seed, edges) VALUES (?, ?, ?)",
+                [(binary, seed, encode_edges(seed_edges)) for seed, seed_edges in edges.items()],
+            )
+
+    def size(self) -> int:
+        """Number of cached edge sets."""
+        return self._db.execute("SELECT COUNT(*) FROM edges").fetchone()[0]
+
+
+def seed_digest(seed: Path) -> str:
+    """SHA-256 of the content of a seed."""
+    return hashlib.sha256(seed.read_bytes()).hexdigest()
+
+
+def open_cache(path: Optional[str]) -> Optional[CoverageCache]:
+    """Open the coverage cache at the given location, if any."""
+    return CoverageCache(Path(path)) if path else None
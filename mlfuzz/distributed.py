@@ -0,0 +1,451 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Execution of an experiment on several hosts sharing the same storage.
+
+A `Coordinator` serves the jobs of the experiment and records their states in the job ledger.
+A `Worker` runs on every host and pulls jobs from the coordinator up to its free capacity.
+Results are written by the jobs directly to the shared `results_folder`.
+
+Coordinator and workers exchange JSON messages over TCP, one request per connection. The
+periodic `pull` request of a worker also serves as its heartbeat: when a worker stays silent
+longer than the heartbeat timeout, its jobs are considered lost and queued again.
+"""
+import json
+import logging
+import shutil
+import socket
+import socketserver
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from mlfuzz.experiment import Job, JobAssignment, gpu_fuzzers
+from mlfuzz.ledger import JobLedger, JobState
+from mlfuzz.scheduler import JobScheduler
+
+logger = logging.getLogger("neuzzpp")
+
+Address = Tuple[str, int]
+
+
+def parse_address(address: str) -> Address:
+    """Split an address of the form `host:port`."""
+    host, _, port = address.rpartition(":")
+    return host, int(port)
+
+
+def request(address: Address, message: Dict[str, Any], timeout: float = 30.0) -> Dict[str, Any]:
+    """
+    Send a request to the coordinator and return its answer.
+
+    Raises:
+        OSError: If the coordinator cannot be reached.
+    """
+    with socket.create_connection(address, timeout=timeout) as conn:
+        conn.sendall(json.dumps(message).encode("utf-8") + b"\n")
+        with conn.makefile("r", encoding="utf-8") as answer:
+            line = answer.readline()
+    if not line:
+        raise ConnectionError(f"No answer from {address[0]}:{address[1]}.")
+    return json.loads(line)
+
+
+def job_to_dict(job: Job) -> Dict[str, Any]:
+    return {
+        "target": str(job.target),
+        "fuzzer": job.fuzzer,
+        "trial": job.trial,
+        "rng_seed": job.rng_seed,
+        "pass_by_file": job.pass_by_file,
+    }
+
+
+def job_from_dict(fields: Dict[str, Any]) -> Job:
+    return Job(
+        target=Path(fields["target"]),
+        fuzzer=fields["fuzzer"],
+        trial=fields["trial"],
+        rng_seed=fields["rng_seed"],
+        pass_by_file=fields["pass_by_file"],
+    )
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            answer = self.server.coordinator.handle(json.loads(line))  # type: ignore
+        except (ValueError, KeyError) as err:
+            answer = {"error": f"Invalid request: {err}"}
+        self.wfile.write(json.dumps(answer).encode("utf-8") + b"\n")
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class Coordinator:
+    """
+    Serve the jobs of an experiment to workers and keep the job ledger up to date.
+
+    Jobs recorded as running in the ledger are expected to be claimed by their worker after a
+    restart of the coordinator. They are queued again if no worker claims them within the
+    heartbeat timeout.
+
+    Args:
+        jobs: All jobs of the experiment, already registered in the ledger.
+        ledger: Job ledger of the experiment.
+        results_folder: Results folder of the experiment.
+        command: Function returning the command line running a job.
+        rerun_failed: Whether to run jobs again that failed in a previous run.
+        heartbeat_timeout: Time in seconds after which a silent worker is considered dead.
+    """
+
+    def __init__(
+        self,
+        jobs: List[Job],
+        ledger: JobLedger,
+        results_folder: Path,
+        command: Callable[[Job], Sequence[str]],
+        rerun_failed: bool = False,
+        heartbeat_timeout: float = 300.0,
+    ) -> None:
+        self.ledger = ledger
+        self.results_folder = results_folder
+        self.command = command
+        self.heartbeat_timeout = heartbeat_timeout
+        self._jobs = {job.name(): job for job in jobs}
+        self._queue: List[str] = []
+        self._assigned: Dict[str, str] = {}  # Worker of each assigned job
+        self._orphans: Set[str] = set()  # Jobs running before a restart, not claimed yet
+        self._workers: Dict[str, float] = {}  # Time of the last request of each worker
+        self._released: Set[str] = set()  # Workers told that the experiment is over
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        self.address: Optional[Address] = None  # Served address, once the server is listening
+
+        n_done = 0
+        for name, job in self._jobs.items():
+            entry = ledger.get(name)
+            assert entry is not None
+            if entry.state == JobState.FINISHED:
+                n_done += 1
+            elif entry.state == JobState.FAILED and not rerun_failed:
+                logger.warning(f"{name} failed in a previous run with exit code {entry.exit_code}.")
+                n_done += 1
+            elif entry.state == JobState.RUNNING:
+                self._orphans.add(name)
+            else:
+                if entry.state != JobState.QUEUED:
+                    self._reset(name)
+                self._queue.append(name)
+        logger.info(
+            f"{n_done} jobs done in previous runs, {len(self._orphans)} running, "
+            f"{len(self._queue)} to run."
+        )
+
+    def running_jobs(self) -> List[Job]:
+        """Jobs currently assigned to workers."""
+        with self._lock:
+            return [self._jobs[name] for name in self._assigned]
+
+    def gauges(self) -> Dict[str, float]:
+        """Current state of the coordinator, as metrics indexed by name."""
+        with self._lock:
+            return {
+                "mlfuzz_queued_jobs": float(len(self._queue)),
+                "mlfuzz_running_jobs": float(len(self._assigned)),
+                "mlfuzz_unclaimed_jobs": float(len(self._orphans)),
+                "mlfuzz_workers": float(len(self._workers)),
+            }
+
+    @property
+    def finished(self) -> bool:
+        """Whether all jobs of the experiment are done."""
+        return not self._queue and not self._assigned and not self._orphans
+
+    def run(self, address: Address) -> None:
+        """Serve the jobs on the given address until all jobs are done. Port 0 picks a free port."""
+        server = _Server(address, _RequestHandler)
+        server.coordinator = self  # type: ignore
+        self.address = (address[0], server.server_address[1])
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logger.info(f"Serving {len(self._jobs)} jobs on {self.address[0]}:{self.address[1]}.")
+        try:
+            while True:
+                time.sleep(1.0)
+                with self._lock:
+                    self._reap()
+                    # Linger until all known workers learned that the experiment is over
+                    if self.finished and set(self._workers) <= self._released:
+                        break
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def handle(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Process a request of a worker and return the answer."""
+        with self._lock:
+            worker = message["worker"]
+            self._workers[worker] = time.monotonic()
+            op = message["op"]
+            if op == "attach":
+                return self._attach(worker)
+            if op == "pull":
+                return self._pull(worker, message)
+            if op == "started":
+                return self._job_started(worker, message)
+            if op == "finished":
+                return self._job_finished(worker, message)
+            if op == "skipped":
+                return self._job_skipped(worker, message)
+            if op == "returned":
+                return self._job_returned(worker, message)
+            return {"error": f"Unknown operation: {op}."}
+
+    def _attach(self, worker: str) -> Dict[str, Any]:
+        # Jobs the worker launched before it was restarted, to be adopted by its scheduler
+        jobs = []
+        for entry in self.ledger.entries(JobState.RUNNING):
+            handle_worker, _, handle = (entry.handle or "").partition(":")
+            if handle_worker == worker and entry.name in self._jobs:
+                job = self._jobs[entry.name]
+                jobs.append(
+                    {
+                        "job": job_to_dict(job),
+                        "core_id": entry.core_id,
+                        "gpu_id": entry.gpu_id,
+                        "handle": handle,
+                    }
+                )
+        return {"jobs": jobs}
+
+    def _pull(self, worker: str, message: Dict[str, Any]) -> Dict[str, Any]:
+        running = set(message["running"])
+        for name in running:
+            if not self._claim(worker, name) and self._assigned.get(name) != worker:
+                logger.warning(f"{worker} runs {name}, which is not assigned to it anymore.")
+        for name, owner in list(self._assigned.items()):
+            if owner == worker and name not in running:
+                logger.warning(f"{worker} lost {name}. Running it again.")
+                self._requeue(name)
+
+        # Assign queued jobs up to the capacity of the worker
+        cpus, gpus = message["cpus"], message["gpus"]
+        assigned = []
+        for name in list(self._queue):
+            if cpus == 0:
+                break
+            job = self._jobs[name]
+            if message["use_gpu"] and job.fuzzer in gpu_fuzzers:
+                if gpus == 0:
+                    continue
+                gpus -= 1
+            cpus -= 1
+            self._queue.remove(name)
+            self._assigned[name] = worker
+            assigned.append({"job": job_to_dict(job), "command": list(self.command(job))})
+            logger.info(f"Assigning {name} to {worker}.")
+
+        done = self.finished
+        if done:
+            self._released.add(worker)
+        return {"jobs": assigned, "done": done}
+
+    def _job_started(self, worker: str, message: Dict[str, Any]) -> Dict[str, Any]:
+        name = message["name"]
+        if self._assigned.get(name) == worker:
+            assignment = JobAssignment(self._jobs[name], message["core_id"], message["gpu_id"])
+            self.ledger.mark_running(assignment, f"{worker}:{message['handle']}")
+        return {}
+
+    def _job_finished(self, worker: str, message: Dict[str, Any]) -> Dict[str, Any]:
+        name = message["name"]
+        if not self._claim(worker, name) and self._assigned.get(name) != worker:
+            logger.warning(f"Ignoring result of {name} from {worker}, it was reassigned.")
+            return {}
+        del self._assigned[name]
+        self.ledger.mark_finished(name, message["exit_code"])
+        logger.info(f"{name} finished on {worker} with exit code {message['exit_code']}.")
+        return {}
+
+    def _job_skipped(self, worker: str, message: Dict[str, Any]) -> Dict[str, Any]:
+        # Like in local runs, jobs that cannot be launched are left for a later run
+        name = message["name"]
+        if self._assigned.get(name) == worker:
+            del self._assigned[name]
+            logger.warning(f"{worker} could not launch {name}. Skipping job.")
+        return {}
+
+    def _claim(self, worker: str, name: str) -> bool:
+        # Hand a job running before a restart of the coordinator back to the worker running it
+        if name not in self._orphans:
+            return False
+        entry = self.ledger.get(name)
+        if entry is None or (entry.handle or "").partition(":")[0] != worker:
+            return False
+        logger.info(f"{worker} claimed {name}.")
+        self._orphans.discard(name)
+        self._assigned[name] = worker
+        return True
+
+    def _job_returned(self, worker: str, message: Dict[str, Any]) -> Dict[str, Any]:
+        # The worker could not fit the job after all, e.g., for lack of memory
+        name = message["name"]
+        if self._assigned.get(name) == worker:
+            del self._assigned[name]
+            self._queue.insert(0, name)
+        return {}
+
+    def _reap(self) -> None:
+        now = time.monotonic()
+        for worker, last_seen in list(self._workers.items()):
+            if now - last_seen > self.heartbeat_timeout:
+                logger.warning(f"No heartbeat from {worker} for {now - last_seen:.0f}s.")
+                del self._workers[worker]
+                self._released.discard(worker)
+                for name, owner in list(self._assigned.items()):
+                    if owner == worker:
+                        self._requeue(name)
+        if self._orphans and now - self._started > self.heartbeat_timeout:
+            for name in list(self._orphans):
+                logger.warning(f"{name} was not claimed by any worker. Running it again.")
+                self._requeue(name)
+
+    def _requeue(self, name: str) -> None:
+        self._assigned.pop(name, None)
+        self._orphans.discard(name)
+        self._reset(name)
+        self._queue.insert(0, name)
+
+    def _reset(self, name: str) -> None:
+        # Discard what is left of the previous attempt
+        shutil.rmtree(self._jobs[name].folder(self.results_folder), ignore_errors=True)
+        self.ledger.mark_queued(name)
+
+
+class Worker:
+    """
+    Pull jobs from a coordinator and run them on the local host.
+
+    Args:
+        coordinator: Address of the coordinator.
+        name: Unique name of the worker, typically the host name. It must not contain `:`.
+        scheduler: Scheduler running the jobs on the local cores and GPUs.
+        heartbeat_interval: Maximum time in seconds between two requests to the coordinator.
+    """
+
+    def __init__(
+        self,
+        coordinator: Address,
+        name: str,
+        scheduler: JobScheduler,
+        heartbeat_interval: float = 10.0,
+    ) -> None:
+        self.coordinator = coordinator
+        self.name = name
+        self.scheduler = scheduler
+        self.heartbeat_interval = heartbeat_interval
+        self._outbox: List[Dict[str, Any]] = []
+
+    def run(self) -> None:
+        """Run jobs until the coordinator reports that the experiment is over."""
+        self._adopt()
+        while True:
+            answer = self._pull() if self._flush() else None
+            if answer is not None:
+                if answer["done"] and not self.scheduler.running:
+                    break
+                self._launch(answer["jobs"])
+
+            for assignment, exitcode in self.scheduler.wait(self.heartbeat_interval):
+                self._send({"op": "finished", "name": assignment.job.name(), "exit_code": exitcode})
+        logger.info("Experiment finished. Exiting.")
+
+    def _adopt(self) -> None:
+        # Retry until the coordinator is reachable, it may still be starting up
+        while True:
+            try:
+                answer = request(self.coordinator, {"op": "attach", "worker": self.name})
+                break
+            except OSError as err:
+                logger.warning(f"Cannot reach coordinator: {err}")
+                time.sleep(self.heartbeat_interval)
+        for item in answer["jobs"]:
+            job = job_from_dict(item["job"])
+            if not self.scheduler.adopt(job, item["core_id"], item["gpu_id"], item["handle"]):
+                logger.warning(f"{job.name()} was lost.")
+
+    def _pull(self) -> Optional[Dict[str, Any]]:
+        cpus, gpus = self.scheduler.capacity()
+        message = {
+            "op": "pull",
+            "worker": self.name,
+            "running": list(self.scheduler.running),
+            "cpus": cpus,
+            "gpus": gpus,
+            "use_gpu": self.scheduler.use_gpu,
+        }
+        try:
+            answer = request(self.coordinator, message)
+        except OSError as err:
+            logger.warning(f"Cannot reach coordinator: {err}")
+            return None
+        if "error" in answer:
+            logger.error(f"Coordinator rejected request: {answer['error']}")
+            return None
+        return answer
+
+    def _launch(self, items: List[Dict[str, Any]]) -> None:
+        jobs = [job_from_dict(item["job"]) for item in items]
+        commands = {job.name(): item["command"] for job, item in zip(jobs, items)}
+        deferred = list(jobs)
+        launched = self.scheduler.fill(deferred, lambda job: commands[job.name()])
+        for assignment, handle in launched:
+            message = {
+                "op": "started",
+                "name": assignment.job.name(),
+                "core_id": assignment.core_id,
+                "gpu_id": assignment.gpu_id,
+                "handle": handle,
+            }
+            self._send(message)
+        launched_names = {assignment.job.name() for assignment, _ in launched}
+        deferred_names = {job.name() for job in deferred}
+        for job in jobs:
+            if job.name() in deferred_names:
+                self._send({"op": "returned", "name": job.name()})
+            elif job.name() not in launched_names:
+                self._send({"op": "skipped", "name": job.name()})
+
+    def _send(self, message: Dict[str, Any]) -> None:
+        message["worker"] = self.name
+        self._outbox.append(message)
+        self._flush()
+
+    def _flush(self) -> bool:
+        # Reports are sent in order and kept until the coordinator received them
+        while self._outbox:
+            try:
+                request(self.coordinator, self._outbox[0])
+            except OSError as err:
+                logger.warning(f"Cannot reach coordinator: {err}")
+                return False
+            self._outbox.pop(0)
+        return True
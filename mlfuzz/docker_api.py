@@ -0,0 +1,495 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Asynchronous client of the Docker Engine API over the Unix socket of the Docker daemon.
+
+Requests reuse a small pool of keep-alive connections instead of spawning a `docker` process per
+call, so that many containers can be inspected concurrently. Long-running calls (waiting for a
+container, streaming events) get a dedicated connection and do not block the pool.
+Synchronous code, like the execution backends, runs the client in an `EventLoopThread`.
+"""
+import asyncio
+import concurrent.futures
+import json
+import os
+import struct
+import threading
+from dataclasses import dataclass
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+from urllib.parse import quote, urlencode
+
+T = TypeVar("T")
+
+default_socket_path = "/var/run/docker.sock"
+
+
+def socket_path_from_env() -> str:
+    """Socket of the Docker daemon, from `DOCKER_HOST` if it points to a Unix socket."""
+    docker_host = os.environ.get("DOCKER_HOST", "")
+    if docker_host.startswith("unix://"):
+        return docker_host[len("unix://") :]
+    return default_socket_path
+
+
+class DockerApiError(Exception):
+    """Error response of the Docker daemon."""
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(f"Docker API error {status}: {message}")
+        self.status = status
+        self.message = message
+
+
+@dataclass
+class ContainerState:
+    """State of a container, as reported by the inspect endpoint."""
+
+    id: str
+    name: str
+    status: str  # created, running, paused, restarting, removing, exited or dead
+    exit_code: Optional[int]
+    oom_killed: bool
+    started_at: str
+    finished_at: str
+
+    @property
+    def running(self) -> bool:
+        return self.status in ("running", "paused", "restarting")
+
+
+@dataclass
+class ContainerSummary:
+    """Container, as reported by the list endpoint."""
+
+    id: str
+    name: str
+    state: str  # created, running, paused, restarting, removing, exited or dead
+    status: str  # Human-readable status, e.g., "Exited (0) 2 minutes ago"
+
+
+class _Connection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class DockerClient:
+    """
+    Docker Engine API client with a pool of keep-alive connections.
+
+    All coroutines must run on the same event loop.
+
+    Args:
+        socket_path: Unix socket of the Docker daemon.
+        max_connections: Maximum number of pooled connections.
+    """
+
+    def __init__(self, socket_path: str = default_socket_path, max_connections: int = 4) -> None:
+        self.socket_path = socket_path
+        self.max_connections = max_connections
+        self._idle: List[_Connection] = []
+        self._slots: Optional[asyncio.Semaphore] = None  # Bound to the loop on first use
+
+    async def close(self) -> None:
+        """Close the idle connections of the pool."""
+        while self._idle:
+            self._idle.pop().close()
+
+    async def ping(self) -> bool:
+        """Check that the daemon answers."""
+        try:
+            status, _, _ = await self._request("GET", "/_ping")
+        except OSError:
+            return False
+        return status == 200
+
+    async def run_container(
+        self,
+        name: str,
+        image: str,
+        command: Sequence[str],
+        user: Optional[str] = None,
+        binds: Iterable[str] = (),
+        cpuset: Optional[str] = None,
+        memory_mb: Optional[int] = None,
+        gpus: Optional[Sequence[int]] = None,
+        tmpfs: Optional[Dict[str, str]] = None,
+    ) -> str:
+        """
+        Create and start a detached container, like `docker run -d`.
+
+        Args:
+            name: Name of the container.
+            image: Image to run. It must be available locally.
+            command: Command to run in the container.
+            user: User, as `uid:gid`, running the command.
+            binds: Volumes, as `host_path:container_path`.
+            cpuset: CPUs the container may use, e.g., `0-3`.
+            memory_mb: Memory limit in MB.
+            gpus: IDs of the GPUs available to the container.
+            tmpfs: tmpfs mounts, as mount options indexed by container path, e.g.,
+                `{"/scratch": "size=1024m"}`.
+
+        Returns:
+            The ID of the started container.
+        """
+        host_config: Dict[str, Any] = {"Binds": list(binds)}
+        if cpuset is not None:
+            host_config["CpusetCpus"] = cpuset
+        if memory_mb is not None:
+            host_config["Memory"] = memory_mb * 2**20
+        if gpus is not None:
+            host_config["DeviceRequests"] = [
+                {"Driver": "", "DeviceIDs": [str(gpu) for gpu in gpus], "Capabilities": [["gpu"]]}
+            ]
+        if tmpfs:
+            host_config["Tmpfs"] = dict(tmpfs)
+        spec: Dict[str, Any] = {"Image": image, "Cmd": list(command), "HostConfig": host_config}
+        if user is not None:
+            spec["User"] = user
+        created = await self._call("POST", "/containers/create", {"name": name}, spec)
+        try:
+            await self._call("POST", f"/containers/{quote(created['Id'])}/start")
+        except DockerApiError:
+            await self.remove_container(created["Id"], force=True)
+            raise
+        return created["Id"]
+
+    async def inspect_container(self, name: str) -> ContainerState:
+        """State of a container. Raises `DockerApiError` with status 404 if it does not exist."""
+        info = await self._call("GET", f"/containers/{quote(name)}/json")
+        state = info.get("State") or {}
+        return ContainerState(
+            id=info["Id"],
+            name=info.get("Name", "").lstrip("/"),
+            status=state.get("Status", ""),
+            exit_code=state.get("ExitCode"),
+            oom_killed=bool(state.get("OOMKilled", False)),
+            started_at=state.get("StartedAt", ""),
+            finished_at=state.get("FinishedAt", ""),
+        )
+
+    async def inspect_containers(self, names: Iterable[str]) -> Dict[str, Optional[ContainerState]]:
+        """
+        Inspect several containers concurrently.
+
+        Returns:
+            The state of each container, indexed by name, or `None` if it does not exist.
+        """
+        names = list(names)
+        results = await asyncio.gather(
+            *(self.inspect_container(name) for name in names), return_exceptions=True
+        )
+        states: Dict[str, Optional[ContainerState]] = {}
+        for name, result in zip(names, results):
+            if isinstance(result, DockerApiError) and result.status == 404:
+                states[name] = None
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                states[name] = result
+        return states
+
+    async def list_containers(self, all: bool = True) -> List[ContainerSummary]:
+        """List the containers, including stopped ones if `all` is set."""
+        containers = await self._call("GET", "/containers/json", {"all": int(all)})
+        return [
+            ContainerSummary(
+                id=container["Id"],
+                name=(container.get("Names") or [""])[0].lstrip("/"),
+                state=container.get("State", ""),
+                status=container.get("Status", ""),
+            )
+            for container in containers
+        ]
+
+    async def wait_container(self, name: str) -> int:
+        """Block until a container stops, then return its exit code."""
+        result = await self._call(
+            "POST", f"/containers/{quote(name)}/wait", {"condition": "not-running"}, dedicated=True
+        )
+        return int(result["StatusCode"])
+
+    async def kill_container(self, name: str, signal: str = "SIGKILL") -> None:
+        await self._call("POST", f"/containers/{quote(name)}/kill", {"signal": signal})
+
+    async def remove_container(self, name: str, force: bool = False) -> None:
+        await self._call("DELETE", f"/containers/{quote(name)}", {"force": int(force)})
+
+    async def stream_logs(self, name: str, follow: bool = True) -> AsyncIterator[bytes]:
+        """
+        Stream the console output (stdout and stderr) of a container on a dedicated connection.
+
+        Args:
+            name: Name or ID of the container.
+            follow: Whether to keep streaming new output until the container stops.
+        """
+        connection = await self._connect()
+        try:
+            params = {"stdout": 1, "stderr": 1, "follow": int(follow)}
+            await self._send(connection, "GET", f"/containers/{quote(name)}/logs", params)
+            status, headers = await self._read_head(connection)
+            if status >= 400:
+                body = await self._read_body(connection, status, headers)
+                raise DockerApiError(status, _error_message(body))
+            demuxer = LogDemuxer()
+            async for chunk in self._iter_body(connection, headers):
+                data = demuxer.feed(chunk)
+                if data:
+                    yield data
+        finally:
+            connection.close()
+
+    async def events(self, filters: Dict[str, List[str]]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream the events of the daemon on a dedicated connection.
+
+        Args:
+            filters: Event filters, e.g., `{"type": ["container"], "event": ["die"]}`.
+        """
+        connection = await self._connect()
+        try:
+            await self._send(connection, "GET", "/events", {"filters": json.dumps(filters)})
+            status, headers = await self._read_head(connection)
+            if status != 200:
+                body = await self._read_body(connection, status, headers)
+                raise DockerApiError(status, _error_message(body))
+            buffer = b""
+            async for chunk in self._iter_body(connection, headers):
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    if line.strip():
+                        yield json.loads(line)
+        finally:
+            connection.close()
+
+    async def _call(
+        self,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        body: Optional[Any] = None,
+        dedicated: bool = False,
+    ) -> Any:
+        _, headers, data = await self._checked(method, path, params, body, dedicated)
+        if data and headers.get("content-type", "").startswith("application/json"):
+            return json.loads(data)
+        return None
+
+    async def _checked(
+        self,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        body: Optional[Any] = None,
+        dedicated: bool = False,
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        status, headers, data = await self._request(method, path, params, body, dedicated)
+        if status >= 400:
+            raise DockerApiError(status, _error_message(data))
+        return status, headers, data
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        body: Optional[Any] = None,
+        dedicated: bool = False,
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        if dedicated:
+            connection = await self._connect()
+            try:
+                return await self._exchange(connection, method, path, params, body)
+            finally:
+                connection.close()
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_connections)
+        async with self._slots:
+            while True:
+                reused = bool(self._idle)
+                connection = self._idle.pop() if reused else await self._connect()
+                try:
+                    status, headers, data = await self._exchange(
+                        connection, method, path, params, body
+                    )
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    connection.close()
+                    if reused:
+                        continue  # The daemon closed the idle connection, retry on a new one
+                    raise
+                except BaseException:
+                    connection.close()
+                    raise
+                if headers.get("connection", "").lower() == "close":
+                    connection.close()
+                else:
+                    self._idle.append(connection)
+                return status, headers, data
+
+    async def _connect(self) -> _Connection:
+        reader, writer = await asyncio.open_unix_connection(self.socket_path)
+        return _Connection(reader, writer)
+
+    async def _exchange(
+        self,
+        connection: _Connection,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]],
+        body: Optional[Any],
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        await self._send(connection, method, path, params, body)
+        status, headers = await self._read_head(connection)
+        return status, headers, await self._read_body(connection, status, headers)
+
+    @staticmethod
+    async def _send(
+        connection: _Connection,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        body: Optional[Any] = None,
+    ) -> None:
+        target = path + ("?" + urlencode(params) if params else "")
+        data = b"" if body is None else json.dumps(body).encode("utf-8")
+        head = f"{method} {target} HTTP/1.1\r\nHost: docker\r\nContent-Length: {len(data)}\r\n"
+        if body is not None:
+            head += "Content-Type: application/json\r\n"
+        connection.writer.write(head.encode("ascii") + b"\r\n" + data)
+        await connection.writer.drain()
+
+    @staticmethod
+    async def _read_head(connection: _Connection) -> Tuple[int, Dict[str, str]]:
+        head = await connection.reader.readuntil(b"\r\n\r\n")
+        status_line, *header_lines = head.decode("latin-1").split("\r\n")
+        status = int(status_line.split()[1])
+        headers = {}
+        for line in header_lines:
+            key, sep, value = line.partition(":")
+            if sep:
+                headers[key.strip().lower()] = value.strip()
+        return status, headers
+
+    async def _read_body(
+        self, connection: _Connection, status: int, headers: Dict[str, str]
+    ) -> bytes:
+        if status in (204, 304) or 100 <= status < 200:
+            return b""
+        return b"".join([chunk async for chunk in self._iter_body(connection, headers)])
+
+    @staticmethod
+    async def _iter_body(connection: _Connection, headers: Dict[str, str]) -> AsyncIterator[bytes]:
+        reader = connection.reader
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    # Skip the trailer up to the final empty line
+                    while (await reader.readline()).strip():
+                        pass
+                    return
+                yield await reader.readexactly(size)
+                await reader.readexactly(2)
+        elif "content-length" in headers:
+            length = int(headers["content-length"])
+            if length > 0:
+                yield await reader.readexactly(length)
+        else:
+            headers["connection"] = "close"  # The body ends with the connection
+            yield await reader.read()
+
+
+class LogDemuxer:
+    """
+    Incremental merger of the stdout and stderr frames of a log stream.
+
+    Containers without TTY send their output as frames with an 8-byte header: stream type,
+    three zero bytes and the big-endian frame size. Containers with TTY send raw output.
+    """
+
+    def __init__(self) -> None:
+        self._framed: Optional[bool] = None
+        self._buffer = b""
+
+    def feed(self, data: bytes) -> bytes:
+        """Add received bytes and return the output they complete."""
+        if self._framed is None:
+            self._buffer += data
+            if len(self._buffer) < 4:
+                return b""
+            self._framed = self._buffer[0] in (0, 1, 2) and self._buffer[1:4] == b"\x00\x00\x00"
+            data, self._buffer = self._buffer, b""
+        if not self._framed:
+            return data
+
+        self._buffer += data
+        output = []
+        offset = 0
+        while offset + 8 <= len(self._buffer):
+            (size,) = struct.unpack(">I", self._buffer[offset + 4 : offset + 8])
+            if offset + 8 + size > len(self._buffer):
+                break
+            output.append(self._buffer[offset + 8 : offset + 8 + size])
+            offset += 8 + size
+        self._buffer = self._buffer[offset:]
+        return b"".join(output)
+
+
+def _error_message(data: bytes) -> str:
+    try:
+        return str(json.loads(data)["message"])
+    except (ValueError, KeyError, TypeError):
+        return data.decode("utf-8", errors="replace").strip()
+
+
+class EventLoopThread:
+    """Event loop running in a background thread, for calling coroutines from synchronous code."""
+
+    def __init__(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def run(self, coroutine: Awaitable[T], timeout: Optional[float] = None) -> T:
+        """Run a coroutine on the loop and wait for its result."""
+        return self.submit(coroutine).result(timeout)
+
+    def submit(self, coroutine: Awaitable[T]) -> "concurrent.futures.Future[T]":
+        """Schedule a coroutine on the loop without waiting for it."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)  # type: ignore[arg-type]
+
+    def stop(self) -> None:
+        """Stop the loop and its thread."""
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
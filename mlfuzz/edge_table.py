@@ -0,0 +1,267 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Per-seed edge sets of a replayed corpus.
+
+The replay of a trial writes `replayed_edges` next to `replayed_plot_data`: a table with one
+row per seed, in replay order, holding the edges covered by the seed as a packed bit array
+(bit `i` of a row is set if the seed covers edge `i`). Analyses read the edges of the seeds
+from the memory-mapped table instead of executing the seeds again.
+
+File layout:
+  * a 64-byte header: magic number and row size in bytes,
+  * the rows, as `numpy.packbits` of the edge bitmaps with little bit order,
+  * a JSON index with the seed names, the seeds whose replay failed (all-zero rows), the
+    SHA-256 of the replayed binary and the arguments it was replayed with,
+  * the size of the JSON index and a second magic number, in 16 bytes.
+
+While a replay runs, the file only has the header and the rows, so that appending seeds and
+dropping rows written after a checkpoint are both plain file operations. The index is added
+once the replay is complete.
+"""
+import json
+import os
+import struct
+from pathlib import Path
+from typing import Any, Collection, Dict, Iterator, List, Optional, Sequence, Set, Union
+
+import numpy as np
+
+from mlfuzz.warmup import file_digest
+
+# Name of the table written into the output folder of a trial
+edges_file_name = "replayed_edges"
+
+_header = struct.Struct("<8sI52x")
+_trailer = struct.Struct("<Q8s")
+_magic = b"MLFZEDGE"
+_index_magic = b"MLFZIDX1"
+
+# Smallest row, in bits: the default size of the AFL coverage map
+min_row_bits = 1 << 16
+
+# Number of bits set in each byte value
+_popcount = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint16)
+
+
+def row_bits_for(max_edge: int) -> int:
+    """Row size in bits fitting an edge index: a power of two, at least `min_row_bits`."""
+    bits = min_row_bits
+    while bits <= max_edge:
+        bits *= 2
+    return bits
+
+
+def pack_edges(edges: np.ndarray, row_bytes: int) -> np.ndarray:
+    """Packed bit array of an edge set, given as an array of edge indices."""
+    bitmap = np.zeros(row_bytes * 8, dtype=bool)
+    bitmap[np.asarray(edges, dtype=np.int64)] = True
+    return np.packbits(bitmap, bitorder="little")
+
+
+def unpack_edges(row: np.ndarray) -> np.ndarray:
+    """Sorted edge indices of a packed row."""
+    return np.flatnonzero(np.unpackbits(row, bitorder="little"))
+
+
+def popcount(rows: np.ndarray) -> np.ndarray:
+    """Number of edges of each packed row of a 2D array."""
+    return _popcount[rows].sum(axis=-1)
+
+
+class EdgeTableWriter:
+    """
+    Append-only writer of the rows of an edge table.
+
+    Args:
+        path: File to write.
+        resume_rows: Number of rows to keep from an existing table, e.g., the partial table
+            of an interrupted replay. What follows them, rows written after a checkpoint or
+            the index of a complete table, is dropped. With 0, the file is created anew.
+        row_bits: Initial row size in bits. Rows are widened if an edge does not fit.
+    """
+
+    def __init__(self, path: Path, resume_rows: int = 0, row_bits: int = min_row_bits) -> None:
+        self.path = path
+        if resume_rows:
+            with open(path, "rb") as in_file:
+                magic, self.row_bytes = _header.unpack(in_file.read(_header.size))
+            if magic != _magic:
+                raise ValueError(f"{path} is not an edge table.")
+            if os.path.getsize(path) < _header.size + resume_rows * self.row_bytes:
+                raise ValueError(f"{path} has less than {resume_rows} rows.")
+            os.truncate(path, _header.size + resume_rows * self.row_bytes)
+        else:
+            self.row_bytes = row_bits // 8
+            with open(path, "wb") as out_file:
+                out_file.write(_header.pack(_magic, self.row_bytes))
+        self.n_rows = resume_rows
+        self._file = open(path, "ab")
+
+    def append(self, edges: Optional[np.ndarray]) -> None:
+        """Add the row of the next seed, all-zero if its replay failed (`None`)."""
+        if edges is None:
+            edges = np.zeros(0, dtype=np.int64)
+        if edges.size and edges.max() >= self.row_bytes * 8:
+            self._widen(row_bits_for(int(edges.max())))
+        self._file.write(pack_edges(edges, self.row_bytes).tobytes())
+        self.n_rows += 1
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(
+        self,
+        seeds: Sequence[str],
+        failed: Collection[int],
+        binary: str,
+        target_args: Sequence[str] = (),
+    ) -> None:
+        """
+        Complete the table with its index.
+
+        Args:
+            seeds: Names of the seeds of the rows.
+            failed: Rows of the seeds whose replay failed.
+            binary: SHA-256 of the replayed binary.
+            target_args: Arguments of the replayed binary, e.g., `@@`.
+        """
+        if len(seeds) != self.n_rows:
+            raise ValueError(f"{len(seeds)} seed names for {self.n_rows} rows.")
+        index = json.dumps(
+            {
+                "seeds": list(seeds),
+                "failed": sorted(failed),
+                "binary": binary,
+                "target_args": list(target_args),
+            }
+        )
+        self._file.write(index.encode())
+        self._file.write(_trailer.pack(len(index.encode()), _index_magic))
+        self._file.close()
+
+    def _widen(self, row_bits: int) -> None:
+        """Rewrite the rows with a larger row size."""
+        self._file.close()
+        rows = np.fromfile(self.path, dtype=np.uint8, offset=_header.size)
+        rows = rows.reshape(self.n_rows, self.row_bytes)
+        wide = np.zeros((self.n_rows, row_bits // 8), dtype=np.uint8)
+        wide[:, : self.row_bytes] = rows
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "wb") as out_file:
+            out_file.write(_header.pack(_magic, row_bits // 8))
+            wide.tofile(out_file)
+        os.replace(tmp_path, self.path)
+        self.row_bytes = row_bits // 8
+        self._file = open(self.path, "ab")
+
+
+class EdgeTable:
+    """
+    Read-only, memory-mapped edge table of a replayed corpus.
+
+    Args:
+        path: Complete table, as written by `EdgeTableWriter`.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        size = os.path.getsize(path)
+        with open(path, "rb") as in_file:
+            magic, self.row_bytes = _header.unpack(in_file.read(_header.size))
+            if magic != _magic or size < _header.size + _trailer.size:
+                raise ValueError(f"{path} is not an edge table.")
+            in_file.seek(size - _trailer.size)
+            index_size, index_magic = _trailer.unpack(in_file.read(_trailer.size))
+            if index_magic != _index_magic:
+                raise ValueError(f"{path} is incomplete.")
+            in_file.seek(size - _trailer.size - index_size)
+            index: Dict[str, Any] = json.loads(in_file.read(index_size))
+        self.seeds: List[str] = index["seeds"]
+        self.failed: Set[int] = set(index["failed"])
+        self.binary: str = index["binary"]
+        # Unknown for tables written before the arguments were recorded
+        self.target_args: Optional[List[str]] = index.get("target_args")
+        self._rows = {name: row for row, name in enumerate(self.seeds)}
+        shape = (len(self.seeds), self.row_bytes)
+        # An empty table cannot be mapped
+        self.rows: np.ndarray = (
+            np.memmap(path, dtype=np.uint8, mode="r", offset=_header.size, shape=shape)
+            if self.seeds
+            else np.zeros(shape, dtype=np.uint8)
+        )
+
+    def __len__(self) -> int:
+        return len(self.seeds)
+
+    def replayed_with(self, target: Sequence[str]) -> bool:
+        """Whether the seeds were replayed with a target program and arguments."""
+        return self.target_args == list(target[1:]) and self.binary == file_digest(Path(target[0]))
+
+    def __contains__(self, seed: str) -> bool:
+        return seed in self._rows
+
+    def row(self, seed: str) -> int:
+        """Row of a seed, by name."""
+        return self._rows[seed]
+
+    def edges(self, seed: Union[str, int]) -> np.ndarray:
+        """Sorted edges covered by a seed, given by name or row."""
+        return unpack_edges(self.rows[self.row(seed) if isinstance(seed, str) else seed])
+
+    def covers(self, seed: Union[str, int], edge: int) -> bool:
+        """Whether a seed, given by name or row, covers an edge."""
+        row = self.row(seed) if isinstance(seed, str) else seed
+        if edge >= self.row_bytes * 8:
+            return False
+        return bool(self.rows[row, edge // 8] >> (edge % 8) & 1)
+
+    def chunks(self, chunk_rows: int = 4096) -> Iterator[np.ndarray]:
+        """Consecutive blocks of packed rows, to process large tables in bounded memory."""
+        for first in range(0, len(self), chunk_rows):
+            yield np.asarray(self.rows[first : first + chunk_rows])
+
+    def union(self) -> np.ndarray:
+        """Packed row of the edges covered by any seed."""
+        union = np.zeros(self.row_bytes, dtype=np.uint8)
+        for chunk in self.chunks():
+            union |= np.bitwise_or.reduce(chunk, axis=0)
+        return union
+
+    def all_edges(self) -> np.ndarray:
+        """Sorted edges covered by any seed."""
+        return unpack_edges(self.union())
+
+    def new_edges(self) -> np.ndarray:
+        """Number of edges covered by each seed and by none of the seeds before it."""
+        counts = np.zeros(len(self), dtype=np.int64)
+        seen = np.zeros(self.row_bytes, dtype=np.uint8)
+        first = 0
+        for chunk in self.chunks():
+            covered = np.bitwise_or.accumulate(chunk, axis=0)
+            covered |= seen
+            totals = popcount(covered).astype(np.int64)
+            previous = np.concatenate(([popcount(seen[None])[0]], totals[:-1]))
+            counts[first : first + len(chunk)] = totals - previous
+            seen = covered[-1]
+            first += len(chunk)
+        return counts
+
+
+def load_edge_table(path: Path) -> Optional[EdgeTable]:
+    """Edge table at a location, or `None` if there is no complete one."""
+    try:
+        return EdgeTable(path)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,231 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Definition of the fuzzing jobs making up an experiment."""
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+# Define supported fuzzers
+Fuzzer = Enum("Fuzzer", "AFL AFLPP HAVOC NEUZZ NEUZZPP PREFUZZ DARWIN MOPT MOPTPP")
+
+# Fuzzers with a machine learning component, the only ones allowed to use GPUs
+gpu_fuzzers = [Fuzzer.NEUZZ.name, Fuzzer.NEUZZPP.name, Fuzzer.PREFUZZ.name]
+
+# Fuzzers starting with an AFL warmup, which can be shared between them (see `mlfuzz.warmup`)
+warmup_fuzzers = [Fuzzer.NEUZZ.name, Fuzzer.PREFUZZ.name]
+
+# Location of the run script of each fuzzer, as installed in the `mlfuzz` Docker image
+runner_scripts = {
+    Fuzzer.AFL.name: "/afl/run_afl.py",
+    Fuzzer.AFLPP.name: "/aflpp/run_aflpp.py",
+    Fuzzer.HAVOC.name: "/havoc/run_havoc.py",
+    Fuzzer.NEUZZ.name: "/neuzz/run_neuzz.py",
+    Fuzzer.NEUZZPP.name: "/neuzzpp/run_neuzzpp.py",
+    Fuzzer.PREFUZZ.name: "/prefuzz/run_prefuzz.py",
+    Fuzzer.DARWIN.name: "/darwin/run_darwin.py",
+    Fuzzer.MOPT.name: "/mopt/run_mopt.py",
+    Fuzzer.MOPTPP.name: "/moptpp/run_moptpp.py",
+}
+
+# Fuzzers based on AFL++, fuzzing the `.aflpp` build of the targets instead of the `.afl` one
+aflpp_fuzzers = [Fuzzer.AFLPP.name, Fuzzer.NEUZZPP.name, Fuzzer.MOPTPP.name]
+
+# Location of the script running the post-processing stages of trials in the `mlfuzz` image
+stage_script = "/mlfuzz/scripts/run_stage.py"
+
+
+@dataclass
+class Job:
+    """Class keeping track of jobs / experiments to launch."""
+
+    target: Path
+    fuzzer: str
+    trial: int
+    rng_seed: int
+    pass_by_file: bool
+    stage: str = "fuzz"  # Processing stage of the trial run by the job (see `mlfuzz.stages`)
+
+    def name(self) -> str:
+        suffix = "" if self.stage == "fuzz" else f"_{self.stage}"
+        if self.pass_by_file:
+            return f"{self.target.name}_{self.fuzzer}_slow_trial-{self.trial}{suffix}"
+
+        return f"{self.target.name}_{self.fuzzer}_trial-{self.trial}{suffix}"
+
+    def folder(self, results_folder: Path) -> Path:
+        """Output folder of the job inside the results folder of the experiment."""
+        return results_folder / self.target.stem / self.fuzzer / f"trial-{self.trial}"
+
+    def command(
+        self,
+        seeds_folder: Path,
+        results_folder: Path,
+        duration: int,
+        skip_replay: bool = False,
+        warmup_cache: Optional[Path] = None,
+        coverage_cache: Optional[Path] = None,
+        live_replay: float = 0,
+    ) -> List[str]:
+        """
+        Build the command line running the fuzzer of the job on its target, or the
+        post-processing stage of the job on the output of the trial.
+
+        Args:
+            seeds_folder: Folder containing the seed corpus of each target.
+            results_folder: Results folder of the experiment.
+            duration: Fuzzing time in seconds.
+            skip_replay: Whether the fuzzer should skip the replay of its corpus, left to a
+                separate post-processing job.
+            warmup_cache: Cache of the AFL warmups of NEUZZ and PreFuzz (see `mlfuzz.warmup`).
+                Required for `warmup` jobs, which only fill the cache.
+            coverage_cache: Cache of the edges of seeds used by corpus replays (see
+                `mlfuzz.coverage_cache`).
+            live_replay: Interval in seconds at which fuzzers without ML stage replay their
+                corpus while fuzzing, 0 to only replay it at the end.
+
+        Returns:
+            The command calling the run script of the fuzzer or of the stage.
+        """
+        if self.fuzzer not in runner_scripts:
+            raise ValueError(f"Unknown fuzzer: {self.fuzzer}.")
+        if self.stage == "warmup":
+            if warmup_cache is None:
+                raise ValueError(f"{self.name()}: warmup jobs require a warmup cache.")
+            # The warmup runs in a work folder of the cache, removed once it is stored
+            output = warmup_cache / f".work-{self.name()}"
+        elif self.stage != "fuzz":
+            cmd = [
+                "python",
+                stage_script,
+                self.stage,
+                str(self.folder(results_folder)),
+                str(self.target),
+            ]
+            if coverage_cache is not None and self.stage == "replay":
+                cmd += ["--coverage_cache", str(coverage_cache)]
+            return cmd
+        else:
+            output = self.folder(results_folder)
+        cmd = [
+            "python",
+            runner_scripts[self.fuzzer],
+            str(seeds_folder / self.target.stem),
+            str(output),
+            str(self.target),
+            "-d",
+            str(duration),
+            "-s",
+            str(self.rng_seed),
+        ]
+        if self.pass_by_file:
+            cmd.append("--pass_by_file")
+        if skip_replay:
+            cmd.append("--skip_replay")
+        elif self.stage == "fuzz":
+            if coverage_cache is not None:
+                cmd += ["--coverage_cache", str(coverage_cache)]
+            if live_replay and self.fuzzer not in warmup_fuzzers:
+                cmd += ["--live_replay", str(live_replay)]
+        if warmup_cache is not None and self.fuzzer in warmup_fuzzers:
+            cmd += ["--warmup_cache", str(warmup_cache)]
+        if self.stage == "warmup":
+            cmd.append("--warmup_only")
+
+        return cmd
+
+
+@dataclass
+class JobAssignment:
+    """Class keeping track of assignment of jobs to CPUs/GPUs."""
+
+    job: Job
+    core_id: int
+    gpu_id: Optional[int]
+    memory_limit_mb: Optional[int] = None
+
+
+def binary_name(target: str, fuzzer: str) -> str:
+    """File name of the build of a target fuzzed by the given fuzzer."""
+    return target + (".aflpp" if fuzzer.upper() in aflpp_fuzzers else ".afl")
+
+
+def get_targets(
+    path: Path, targets: List[str], fuzzers: List[Fuzzer]
+) -> Tuple[Optional[List[Path]], Optional[List[Path]]]:
+    """
+    Read the list of targets for fuzzing from a given folder, then split them according to
+    their compilation options (detected via target extension).
+
+    Args:
+        path: Folder containing the compiled binaries to fuzz.
+        targets: List of target names without extension.
+        fuzzers: List of fuzzers specified for the current experiment.
+
+    Returns:
+        Two lists of targets, one with targets built for AFL, the other for AFL++.
+        If any of the two types of targets are not required for the experiment, the corresponding
+        list will be `None`.
+    """
+    targets_afl, targets_aflpp = None, None
+    if (
+        Fuzzer.AFL in fuzzers
+        or Fuzzer.NEUZZ in fuzzers
+        or Fuzzer.PREFUZZ in fuzzers
+        or Fuzzer.HAVOC in fuzzers
+        or Fuzzer.DARWIN in fuzzers
+        or Fuzzer.MOPT in fuzzers
+    ):
+        targets_afl = [path / (target + ".afl") for target in targets]
+
+    if any(fuzzer.name in aflpp_fuzzers for fuzzer in fuzzers):
+        targets_aflpp = [path / (target + ".aflpp") for target in targets]
+
+    return targets_afl, targets_aflpp
+
+
+def jobs_from_config(config: Dict[str, Any]) -> List[Job]:
+    """
+    Create the jobs of an experiment: one job per fuzzer, target and trial.
+
+    Args:
+        config: Experiment configuration, as read from `experiment_config.yaml`.
+
+    Returns:
+        The jobs, grouped by fuzzer, then by target.
+    """
+    fuzzers = list(map(lambda fuzzer_name: Fuzzer[fuzzer_name.upper()], config["fuzzers"]))
+    targets_afl, targets_aflpp = get_targets(
+        Path(config["binaries_folder"]), config["targets"], fuzzers
+    )
+    jobs = []
+    for fuzzer in fuzzers:
+        if fuzzer.name in aflpp_fuzzers:
+            current_targets = targets_aflpp
+        else:
+            current_targets = targets_afl
+
+        if current_targets is not None:
+            for target in current_targets:
+                for trial, rng_seed in enumerate(config["rng_seeds"][: config["n_trials"]]):
+                    jobs.append(
+                        Job(
+                            target=target,
+                            fuzzer=fuzzer.name,
+                            trial=trial,
+                            rng_seed=rng_seed,
+                            pass_by_file=config["pass_by_file"],
+                        )
+                    )
+    return jobs
@@ -0,0 +1,238 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Persistent record of the state of all jobs of an experiment.
+
+The ledger is an SQLite database stored with the experiment results. Every state change is
+committed immediately, so that an interrupted experiment can be resumed without rerunning
+finished trials. Job names only identify jobs within an experiment: the ledger records the
+results folder and fuzzing duration of its experiment, and cannot be used to resume another one.
+"""
+import json
+import sqlite3
+import time
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from mlfuzz.experiment import Job, JobAssignment
+
+JobState = Enum("JobState", "QUEUED RUNNING FINISHED FAILED")
+
+
+@dataclass
+class LedgerEntry:
+    """State of one job as recorded in the ledger."""
+
+    name: str
+    state: JobState
+    core_id: Optional[int]
+    gpu_id: Optional[int]
+    handle: Optional[str]
+    start_time: Optional[float]
+    end_time: Optional[float]
+    exit_code: Optional[int]
+
+
+class JobLedger:
+    """
+    SQLite-backed ledger of experiment jobs.
+
+    Args:
+        path: Location of the database file. It is created if it does not exist.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")
+        with self._db:
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    name TEXT PRIMARY KEY,
+                    target TEXT NOT NULL,
+                    fuzzer TEXT NOT NULL,
+                    trial INTEGER NOT NULL,
+                    rng_seed INTEGER NOT NULL,
+                    state TEXT NOT NULL,
+                    core_id INTEGER,
+                    gpu_id INTEGER,
+                    handle TEXT,
+                    start_time REAL,
+                    end_time REAL,
+                    exit_code INTEGER,
+                    stage TEXT NOT NULL DEFAULT 'fuzz'
+                )
+                """
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS experiment (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+            # Ledgers written before post-processing stages only hold fuzzing jobs
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(jobs)")]
+            if "stage" not in columns:
+                self._db.execute("ALTER TABLE jobs ADD COLUMN stage TEXT NOT NULL DEFAULT 'fuzz'")
+
+    def close(self) -> None:
+        self._db.close()
+
+    def experiment(self) -> Dict[str, Any]:
+        """Settings of the experiment the ledger belongs to, empty if not recorded yet."""
+        rows = self._db.execute("SELECT key, value FROM experiment").fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def matches(self, results_folder: Path, duration: float) -> bool:
+        """Whether the ledger belongs to the experiment with the given settings, if any."""
+        recorded = self.experiment()
+        return not recorded or recorded == _experiment_settings(results_folder, duration)
+
+    def bind(self, results_folder: Path, duration: float) -> None:
+        """
+        Record the experiment the ledger belongs to, or check that it is the recorded one.
+
+        Args:
+            results_folder: Results folder of the experiment.
+            duration: Fuzzing time of the trials in seconds.
+
+        Raises:
+            ValueError: If the ledger belongs to an experiment with other settings.
+        """
+        if not self.matches(results_folder, duration):
+            raise ValueError(
+                f"{self.path} belongs to another experiment: {self.experiment()}, "
+                f"not {_experiment_settings(results_folder, duration)}."
+            )
+        with self._db:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO experiment (key, value) VALUES (?, ?)",
+                [
+                    (key, json.dumps(value))
+                    for key, value in _experiment_settings(results_folder, duration).items()
+                ],
+            )
+
+    def register(self, jobs: Iterable[Job]) -> None:
+        """Add the jobs that are not recorded yet as queued."""
+        with self._db:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO jobs (name, target, fuzzer, trial, rng_seed, state, stage) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        job.name(),
+                        str(job.target),
+                        job.fuzzer,
+                        job.trial,
+                        job.rng_seed,
+                        "QUEUED",
+                        job.stage,
+                    )
+                    for job in jobs
+                ],
+            )
+
+    def get(self, name: str) -> Optional[LedgerEntry]:
+        """Return the recorded state of a job, or `None` if the job is unknown."""
+        row = self._db.execute(
+            "SELECT name, state, core_id, gpu_id, handle, start_time, end_time, exit_code "
+            "FROM jobs WHERE name = ?",
+            (name,),
+        ).fetchone()
+        if row is None:
+            return None
+        return LedgerEntry(row[0], JobState[row[1]], *row[2:])
+
+    def entries(self, state: Optional[JobState] = None) -> List[LedgerEntry]:
+        """Return all recorded jobs, optionally only those in the given state."""
+        query = (
+            "SELECT name, state, core_id, gpu_id, handle, start_time, end_time, exit_code "
+            "FROM jobs"
+        )
+        if state is not None:
+            rows = self._db.execute(query + " WHERE state = ?", (state.name,)).fetchall()
+        else:
+            rows = self._db.execute(query).fetchall()
+        return [LedgerEntry(row[0], JobState[row[1]], *row[2:]) for row in rows]
+
+    def runtimes(self) -> List[Tuple[str, str, float]]:
+        """
+        Return the run times of the successfully finished fuzzing jobs.
+
+        Returns:
+            The target file name, fuzzer and run time in seconds of each finished job.
+        """
+        rows = self._db.execute(
+            "SELECT target, fuzzer, end_time - start_time FROM jobs "
+            "WHERE state = 'FINISHED' AND stage = 'fuzz' "
+            "AND start_time IS NOT NULL AND end_time IS NOT NULL"
+        ).fetchall()
+        return [(Path(target).name, fuzzer, runtime) for target, fuzzer, runtime in rows]
+
+    def unfinished_trials(self) -> Set[Tuple[str, str, int]]:
+        """
+        Return the trials with a job, including post-processing jobs, still queued or running.
+
+        Returns:
+            The target name without extension, fuzzer and trial index of each trial.
+        """
+        rows = self._db.execute(
+            "SELECT DISTINCT target, fuzzer, trial FROM jobs WHERE state IN ('QUEUED', 'RUNNING')"
+        ).fetchall()
+        return {(Path(target).stem, fuzzer, trial) for target, fuzzer, trial in rows}
+
+    def mark_queued(self, name: str) -> None:
+        """Reset a job so that it is run again."""
+        with self._db:
+            self._db.execute(
+                "UPDATE jobs SET state = 'QUEUED', core_id = NULL, gpu_id = NULL, handle = NULL, "
+                "start_time = NULL, end_time = NULL, exit_code = NULL WHERE name = ?",
+                (name,),
+            )
+
+    def mark_running(self, assignment: JobAssignment, handle: str) -> None:
+        """
+        Record that a job was launched.
+
+        Args:
+            assignment: Launched job with its core and GPU.
+            handle: Backend-specific identifier allowing to re-attach to the job later.
+        """
+        with self._db:
+            self._db.execute(
+                "UPDATE jobs SET state = 'RUNNING', core_id = ?, gpu_id = ?, handle = ?, "
+                "start_time = ?, end_time = NULL, exit_code = NULL WHERE name = ?",
+                (
+                    assignment.core_id,
+                    assignment.gpu_id,
+                    handle,
+                    time.time(),
+                    assignment.job.name(),
+                ),
+            )
+
+    def mark_finished(self, name: str, exit_code: Optional[int]) -> None:
+        """Record the end of a job. Jobs without a zero exit code are considered failed."""
+        state = JobState.FINISHED if exit_code == 0 else JobState.FAILED
+        with self._db:
+            self._db.execute(
+                "UPDATE jobs SET state = ?, end_time = ?, exit_code = ? WHERE name = ?",
+                (state.name, time.time(), exit_code, name),
+            )
+
+
+def _experiment_settings(results_folder: Path, duration: float) -> Dict[str, Any]:
+    return {"results_folder": str(results_folder.resolve()), "duration": float(duration)}
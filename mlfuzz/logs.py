@@ -0,0 +1,207 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Size-rotated and compressed console logs of jobs.
+
+A log `docker.log` is written incrementally. Once it exceeds the rotation size, it is moved
+to the compressed segment `docker.log.1.gz` (or `.zst`), then `docker.log.2.gz`, and so on:
+segments are numbered from oldest to newest and `docker.log` holds the most recent output.
+`LogReader` reads such a log as a whole, or backwards from its end without decompressing more
+segments than needed.
+"""
+import gzip
+import io
+import os
+import re
+import shutil
+from pathlib import Path
+from typing import IO, Iterator, List, Optional
+
+# File extension of the segments of each compression
+compressions = {"gzip": ".gz", "zstd": ".zst"}
+
+_block_size = 1 << 16
+
+
+def _zstandard():  # type: ignore[no-untyped-def]
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("zstd compression of logs requires the `zstandard` package.")
+    return zstandard
+
+
+def _compress(path: Path, compression: str) -> Path:
+    target = path.with_name(path.name + compressions[compression])
+    with open(path, "rb") as source:
+        if compression == "zstd":
+            with open(target, "wb") as raw:
+                _zstandard().ZstdCompressor().copy_stream(source, raw)
+        else:
+            with gzip.open(target, "wb") as compressed:
+                while True:
+                    block = source.read(_block_size)
+                    if not block:
+                        break
+                    compressed.write(block)
+    os.remove(path)
+    return target
+
+
+def _open_segment(path: Path) -> io.BufferedIOBase:
+    if path.suffix == compressions["zstd"]:
+        return _zstandard().ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    return gzip.open(path, "rb")
+
+
+class RotatingLogWriter:
+    """
+    Append-only log rotated into compressed segments once it exceeds a size.
+
+    Args:
+        path: Location of the log.
+        max_bytes: Size in bytes after which the log is rotated. Rotation is disabled if 0.
+        compression: Compression of the rotated segments, one of `compressions`.
+    """
+
+    def __init__(
+        self, path: Path, max_bytes: int = 64 * 2**20, compression: str = "gzip"
+    ) -> None:
+        if compression not in compressions:
+            raise ValueError(f"Unknown log compression: {compression}.")
+        if compression == "zstd":
+            _zstandard()  # Fail early if unavailable
+        self.path = path
+        self.max_bytes = max_bytes
+        self.compression = compression
+        self._file: Optional[IO[bytes]] = open(path, "ab")
+        self._size = self._file.tell()
+        self._next_segment = len(LogReader(path).segments()) + 1
+
+    def write(self, data: bytes) -> None:
+        assert self._file is not None
+        if self.max_bytes > 0 and self._size > 0 and self._size + len(data) > self.max_bytes:
+            self.rotate()
+        self._file.write(data)
+        self._size += len(data)
+
+    def flush(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+
+    def rotate(self) -> None:
+        """Move the current log to a new compressed segment and start an empty log."""
+        assert self._file is not None
+        self._file.close()
+        segment = self.path.with_name(f"{self.path.name}.{self._next_segment}")
+        os.replace(self.path, segment)
+        _compress(segment, self.compression)
+        self._next_segment += 1
+        self._file = open(self.path, "ab")
+        self._size = 0
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class LogReader:
+    """
+    Reader of a log written by `RotatingLogWriter`, or of a plain log file.
+
+    Args:
+        path: Location of the log, without segment suffix, e.g., `docker.log`.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    def segments(self) -> List[Path]:
+        """Compressed segments of the log, from oldest to newest."""
+        pattern = re.compile(re.escape(self.path.name) + r"\.(\d+)(\.gz|\.zst)$")
+        segments = []
+        if self.path.parent.is_dir():
+            for entry in self.path.parent.iterdir():
+                match = pattern.match(entry.name)
+                if match is not None:
+                    segments.append((int(match.group(1)), entry))
+        return [entry for _, entry in sorted(segments)]
+
+    def files(self) -> List[Path]:
+        """All files of the log, from oldest to newest."""
+        return self.segments() + ([self.path] if self.path.exists() else [])
+
+    def chunks(self) -> Iterator[bytes]:
+        """Content of the whole log, in blocks."""
+        for path in self.files():
+            with (open(path, "rb") if path == self.path else _open_segment(path)) as log_file:
+                while True:
+                    block = log_file.read(_block_size)
+                    if not block:
+                        break
+                    yield block
+
+    def reversed_lines(self) -> Iterator[bytes]:
+        """
+        Lines of the log from the last one to the first one, without line endings.
+
+        The current log is read backwards block by block; compressed segments are only
+        decompressed once the lines before them are needed.
+        """
+        partial = b""  # Beginning of a line continued in a later file
+        skip_empty = True  # The line ending at the end of the log does not start a new line
+        for path in reversed(self.files()):
+            if path == self.path:
+                blocks = self._reversed_blocks(path)
+            else:
+                with _open_segment(path) as segment:
+                    blocks = iter([segment.read()])
+            for block in blocks:
+                lines = (block + partial).split(b"\n")
+                partial = lines.pop(0)
+                for line in reversed(lines):
+                    if skip_empty and not line:
+                        skip_empty = False
+                        continue
+                    skip_empty = False
+                    yield line
+        if partial:
+            yield partial
+
+    def tail(self, n_lines: int) -> List[bytes]:
+        """The last lines of the log, in order, without line endings."""
+        lines: List[bytes] = []
+        for line in self.reversed_lines():
+            if len(lines) == n_lines:
+                break
+            lines.append(line)
+        return lines[::-1]
+
+    @staticmethod
+    def _reversed_blocks(path: Path) -> Iterator[bytes]:
+        with open(path, "rb") as log_file:
+            end = log_file.seek(0, io.SEEK_END)
+            while end > 0:
+                start = max(0, end - _block_size)
+                log_file.seek(start)
+                yield log_file.read(end - start)
+                end = start
+
+
+def move_log(source: Path, target: Path) -> None:
+    """Move a log with all its segments, naming them after `target`."""
+    for path in LogReader(source).files():
+        suffix = path.name[len(source.name) :]
+        shutil.move(str(path), str(target.with_name(target.name + suffix)))
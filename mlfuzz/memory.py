@@ -0,0 +1,165 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Admission control based on the measured memory usage of the host and of the running jobs.
+
+All fuzzers run without memory limit (`-m none`) because of ASAN, so the memory usage of a trial
+is only known once it runs. Launching jobs regardless of memory can push the host into swap,
+which slows down all concurrent trials. Before each launch, the memory the host would need is
+projected from the current usage, plus the memory that running jobs are still expected to take,
+plus the expected memory of the new job.
+"""
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+from mlfuzz.experiment import Job
+
+_page_size_mb = os.sysconf("SC_PAGE_SIZE") / 2**20
+
+# Memory statistics of Docker containers, for the usual cgroup layouts (v2 and v1)
+_container_memory_stats = [
+    ("/sys/fs/cgroup/system.slice/docker-{}.scope/memory.stat", "anon"),
+    ("/sys/fs/cgroup/docker/{}/memory.stat", "anon"),
+    ("/sys/fs/cgroup/memory/system.slice/docker-{}.scope/memory.stat", "total_rss"),
+    ("/sys/fs/cgroup/memory/docker/{}/memory.stat", "total_rss"),
+]
+
+
+def read_meminfo(meminfo: Path = Path("/proc/meminfo")) -> Dict[str, int]:
+    """Read the memory statistics of the host, in MB."""
+    stats = {}
+    with open(meminfo) as meminfo_file:
+        for line in meminfo_file:
+            key, _, value = line.partition(":")
+            fields = value.split()
+            if fields and fields[0].isdigit():
+                stats[key] = int(fields[0]) // 1024
+    return stats
+
+
+def session_rss_mb(sessions: Dict[str, int], proc: Path = Path("/proc")) -> Dict[str, int]:
+    """
+    Measure the resident memory of process sessions with a single scan of `/proc`.
+
+    Args:
+        sessions: Session ID (the PID of the session leader) of each job.
+        proc: Mount point of procfs.
+
+    Returns:
+        The total resident memory in MB of the processes of each session, indexed like
+        `sessions`.
+    """
+    names = {sid: name for name, sid in sessions.items()}
+    rss_pages = {name: 0 for name in sessions}
+    for pid_folder in proc.iterdir():
+        if not pid_folder.name.isdigit():
+            continue
+        try:
+            stat = (pid_folder / "stat").read_text()
+        except OSError:
+            continue  # The process exited in the meantime
+        # The command name in parentheses may contain spaces, split after it
+        fields = stat[stat.rfind(")") + 2 :].split()
+        sid = int(fields[3])
+        if sid in names:
+            rss_pages[names[sid]] += int(fields[21])
+    return {name: int(pages * _page_size_mb) for name, pages in rss_pages.items()}
+
+
+def container_rss_mb(container_id: str) -> Optional[int]:
+    """Anonymous memory of a Docker container in MB, or `None` if its cgroup is not found."""
+    for path, key in _container_memory_stats:
+        try:
+            with open(path.format(container_id)) as stat_file:
+                for line in stat_file:
+                    name, _, value = line.partition(" ")
+                    if name == key:
+                        return int(value) // 2**20
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+class MemoryGuard:
+    """
+    Hold back job launches that would make the memory usage of the host exceed a budget.
+
+    The expected memory of a job is its memory request, or more if earlier trials of the same
+    fuzzer on the same target were seen using more. Without earlier trial on the target, the peak
+    usage of the fuzzer on other targets is expected, or `floor_mb` for fuzzers not seen yet.
+    The host is only sampled once per scheduling round: jobs launched in the same round count
+    with their expected memory, so that an unknown job never counts as free.
+
+    Args:
+        budget_mb: Maximum memory usage of the host in MB.
+        floor_mb: Memory in MB expected of jobs of fuzzers without any earlier trial.
+    """
+
+    def __init__(self, budget_mb: int, floor_mb: int = 0) -> None:
+        self.budget_mb = budget_mb
+        self.floor_mb = floor_mb
+        self._host_used_mb = 0
+        self._usage: Dict[str, int] = {}  # Last measured usage of each running job
+        self._peaks: Dict[str, int] = {}  # Highest measured usage of each running job
+        self._history: Dict[Tuple[str, str], int] = {}  # Highest usage per (target, fuzzer)
+        self._fuzzer_history: Dict[str, int] = {}  # Highest usage per fuzzer, on any target
+
+    def update(self, job_usage: Dict[str, int]) -> None:
+        """
+        Sample the memory usage of the host.
+
+        Args:
+            job_usage: Measured memory usage in MB of the running jobs, indexed by job name.
+        """
+        meminfo = read_meminfo()
+        self._host_used_mb = meminfo["MemTotal"] - meminfo.get("MemAvailable", meminfo["MemFree"])
+        self._usage = dict(job_usage)
+        for name, used in job_usage.items():
+            self._peaks[name] = max(used, self._peaks.get(name, 0))
+
+    def expected_mb(self, job: Job, request_mb: int) -> int:
+        """Memory a job is expected to use at its peak, in MB."""
+        seen_mb = self._history.get((job.target.name, job.fuzzer))
+        if seen_mb is None:
+            seen_mb = self._fuzzer_history.get(job.fuzzer, self.floor_mb)
+        return max(request_mb, seen_mb)
+
+    def admits(self, job: Job, request_mb: int, running: Iterable[Tuple[Job, int]]) -> bool:
+        """
+        Check whether a job can be launched without exceeding the memory budget.
+
+        Args:
+            job: Job to launch.
+            request_mb: Memory requested by the job in MB.
+            running: Running jobs with their memory requests in MB.
+
+        Returns:
+            Whether the projected memory usage of the host stays within the budget.
+        """
+        projected = self._host_used_mb + self.expected_mb(job, request_mb)
+        for other, other_request_mb in running:
+            used = self._usage.get(other.name(), 0)
+            projected += max(0, self.expected_mb(other, other_request_mb) - used)
+        return projected <= self.budget_mb
+
+    def finished(self, job: Job) -> None:
+        """Remember the peak memory usage of a finished job for later trials."""
+        peak = self._peaks.pop(job.name(), None)
+        self._usage.pop(job.name(), None)
+        if peak is None:
+            return  # Never measured, e.g., it exited before the first sample
+        key = (job.target.name, job.fuzzer)
+        self._history[key] = max(peak, self._history.get(key, 0))
+        self._fuzzer_history[job.fuzzer] = max(peak, self._fuzzer_history.get(job.fuzzer, 0))
@@ -0,0 +1,325 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Live metrics of running trials, served over HTTP in the Prometheus text format.
+
+The statistics of each trial are read from the `fuzzer_stats` and `plot_data` files written by
+AFL-based fuzzers into the trial folder. To keep scrapes cheap with hundreds of running trials,
+`fuzzer_stats` is only read again when it changed, and only the lines appended to `plot_data`
+since the previous scrape are read.
+"""
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from mlfuzz.experiment import Job
+
+logger = logging.getLogger("neuzzpp")
+
+# Exported trial metrics: name, help text, and sources as (file, field) in order of preference.
+# Field names differ between AFL and AFL++ versions.
+trial_metrics: List[Tuple[str, str, List[Tuple[str, str]]]] = [
+    (
+        "mlfuzz_execs_per_second",
+        "Current executions per second of the trial.",
+        [("plot_data", "execs_per_sec"), ("fuzzer_stats", "execs_per_sec")],
+    ),
+    (
+        "mlfuzz_execs_total",
+        "Executions of the target since the start of the trial.",
+        [("fuzzer_stats", "execs_done"), ("plot_data", "total_execs")],
+    ),
+    (
+        "mlfuzz_edges_found",
+        "Edges covered by the queue of the trial.",
+        [("fuzzer_stats", "edges_found"), ("plot_data", "edges_found")],
+    ),
+    (
+        "mlfuzz_paths_total",
+        "Test cases in the queue of the trial.",
+        [
+            ("plot_data", "paths_total"),
+            ("plot_data", "corpus_count"),
+            ("fuzzer_stats", "paths_total"),
+            ("fuzzer_stats", "corpus_count"),
+        ],
+    ),
+    (
+        "mlfuzz_crashes_total",
+        "Unique crashes found by the trial.",
+        [
+            ("plot_data", "unique_crashes"),
+            ("plot_data", "saved_crashes"),
+            ("fuzzer_stats", "unique_crashes"),
+            ("fuzzer_stats", "saved_crashes"),
+        ],
+    ),
+    (
+        "mlfuzz_hangs_total",
+        "Unique hangs found by the trial.",
+        [
+            ("plot_data", "unique_hangs"),
+            ("plot_data", "saved_hangs"),
+            ("fuzzer_stats", "unique_hangs"),
+            ("fuzzer_stats", "saved_hangs"),
+        ],
+    ),
+    (
+        "mlfuzz_stability_ratio",
+        "Share of the coverage map that behaves deterministically.",
+        [("fuzzer_stats", "stability")],
+    ),
+    (
+        "mlfuzz_bitmap_coverage_ratio",
+        "Share of the coverage map that is covered.",
+        [("fuzzer_stats", "bitmap_cvg"), ("plot_data", "map_size")],
+    ),
+    (
+        "mlfuzz_last_update_timestamp_seconds",
+        "Time of the last update of the fuzzer statistics of the trial.",
+        [("fuzzer_stats", "last_update")],
+    ),
+]
+
+
+def parse_stat(value: str) -> Optional[float]:
+    """Convert an AFL statistic to a number. Percentages are converted to ratios."""
+    value = value.strip()
+    try:
+        if value.endswith("%"):
+            return float(value[:-1]) / 100
+        return float(value)
+    except ValueError:
+        return None
+
+
+class TrialStats:
+    """
+    Incremental reader of the statistics files of one trial.
+
+    Args:
+        job_folder: Output folder of the trial. The statistics files are found either there or,
+            for AFL++, in its `default` subfolder.
+    """
+
+    def __init__(self, job_folder: Path) -> None:
+        self.job_folder = job_folder
+        self.fuzzer_stats: Dict[str, str] = {}
+        self.plot_data: Dict[str, str] = {}
+        self._stats_version: Optional[Tuple[int, int]] = None
+        self._plot_offset = 0
+        self._plot_inode: Optional[int] = None
+        self._plot_columns: List[str] = []
+        self._plot_partial = ""
+
+    @property
+    def folder(self) -> Path:
+        """Folder containing the statistics files."""
+        default = self.job_folder / "default"
+        return default if default.is_dir() else self.job_folder
+
+    def update(self) -> None:
+        """Read what changed in the statistics files since the last update."""
+        folder = self.folder
+        self._update_fuzzer_stats(folder / "fuzzer_stats")
+        self._update_plot_data(folder / "plot_data")
+
+    def get(self, source: str, field: str) -> Optional[float]:
+        values = self.fuzzer_stats if source == "fuzzer_stats" else self.plot_data
+        return parse_stat(values[field]) if field in values else None
+
+    def _update_fuzzer_stats(self, path: Path) -> None:
+        # The fuzzers rewrite the file on each update, skip it when it did not change
+        try:
+            stat = os.stat(path)
+            version = (stat.st_mtime_ns, stat.st_size)
+            if version == self._stats_version:
+                return
+            with open(path) as stats_file:
+                lines = stats_file.read().splitlines()
+        except OSError:
+            return
+        self._stats_version = version
+        stats = {}
+        for line in lines:
+            key, sep, value = line.partition(":")
+            if sep:
+                stats[key.strip()] = value.strip()
+        self.fuzzer_stats = stats
+
+    def _update_plot_data(self, path: Path) -> None:
+        # The fuzzers append to the file, read from where the previous update stopped
+        try:
+            stat = os.stat(path)
+            if stat.st_ino != self._plot_inode or stat.st_size < self._plot_offset:
+                self._plot_inode, self._plot_offset, self._plot_partial = stat.st_ino, 0, ""
+            if stat.st_size == self._plot_offset:
+                return
+            with open(path, "rb") as plot_file:
+                plot_file.seek(self._plot_offset)
+                data = plot_file.read().decode("utf-8", errors="replace")
+                self._plot_offset = plot_file.tell()
+        except OSError:
+            return
+
+        lines = (self._plot_partial + data).split("\n")
+        self._plot_partial = lines.pop()  # Incomplete last line, if any
+        last_row = None
+        for line in lines:
+            if line.startswith("#"):
+                self._plot_columns = [column.strip() for column in line[1:].split(",")]
+            elif line.strip():
+                last_row = line
+        if last_row is not None and self._plot_columns:
+            values = [value.strip() for value in last_row.split(",")]
+            self.plot_data = dict(zip(self._plot_columns, values))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format(value: float) -> str:
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class MetricsSnapshot:
+    """
+    Running trials and scheduler gauges, published by the thread that owns the scheduler.
+
+    The exporter serves scrapes from its own threads. Reading the scheduler from there races
+    with the launches and exits handled by the experiment runner, which instead publishes a
+    consistent copy once per scheduling round.
+    """
+
+    def __init__(self) -> None:
+        self._trials: List[Job] = []
+        self._gauges: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def publish(self, trials: Iterable[Job], gauges: Dict[str, float]) -> None:
+        trials, gauges = list(trials), dict(gauges)
+        with self._lock:
+            self._trials, self._gauges = trials, gauges
+
+    def trials(self) -> List[Job]:
+        with self._lock:
+            return list(self._trials)
+
+    def gauges(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._gauges)
+
+
+class MetricsExporter:
+    """
+    HTTP endpoint serving the statistics of running trials and scheduler gauges.
+
+    Args:
+        results_folder: Results folder of the experiment.
+        trials: Function returning the jobs currently running. It is called from the HTTP
+            threads of the exporter, e.g., `MetricsSnapshot.trials`.
+        gauges: Function returning scheduler gauges, indexed by metric name. It is called from
+            the HTTP threads of the exporter, e.g., `MetricsSnapshot.gauges`.
+    """
+
+    def __init__(
+        self,
+        results_folder: Path,
+        trials: Callable[[], Iterable[Job]],
+        gauges: Callable[[], Dict[str, float]],
+    ) -> None:
+        self.results_folder = results_folder
+        self.trials = trials
+        self.gauges = gauges
+        self._stats: Dict[str, TrialStats] = {}
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def start(self, address: Tuple[str, int]) -> None:
+        """Serve the metrics on `http://<address>/metrics` in a background thread."""
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: object) -> None:
+                pass  # Do not log every scrape
+
+        self._server = ThreadingHTTPServer(address, Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        logger.info(f"Serving metrics on http://{address[0]}:{address[1]}/metrics.")
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def render(self) -> str:
+        """Collect all metrics in the Prometheus text format."""
+        with self._lock:
+            trials = self._update_trials()
+            lines: List[str] = []
+            for name, description, sources in trial_metrics:
+                lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge"]
+                for job, stats in trials:
+                    value = next(
+                        (
+                            value
+                            for value in (stats.get(*source) for source in sources)
+                            if value is not None
+                        ),
+                        None,
+                    )
+                    if value is not None:
+                        labels = (
+                            f'target="{_escape(job.target.stem)}",'
+                            f'fuzzer="{_escape(job.fuzzer)}",trial="{job.trial}"'
+                        )
+                        lines.append(f"{name}{{{labels}}} {_format(value)}")
+            for name, value in self.gauges().items():
+                lines += [f"# TYPE {name} gauge", f"{name} {_format(value)}"]
+            lines += [
+                "# TYPE mlfuzz_scrape_timestamp_seconds gauge",
+                f"mlfuzz_scrape_timestamp_seconds {time.time():.3f}",
+            ]
+        return "\n".join(lines) + "\n"
+
+    def _update_trials(self) -> List[Tuple[Job, TrialStats]]:
+        trials = []
+        running = {job.name(): job for job in self.trials()}
+        for name in list(self._stats):
+            if name not in running:
+                del self._stats[name]
+        for name, job in running.items():
+            if name not in self._stats:
+                self._stats[name] = TrialStats(job.folder(self.results_folder))
+            self._stats[name].update()
+            trials.append((job, self._stats[name]))
+        return trials
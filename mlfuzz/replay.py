@@ -0,0 +1,442 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Batch replay of fuzzing corpora to compute their coverage over time.
+
+Instead of starting `afl-showmap` once per seed, the seeds are replayed in batches through the
+directory mode of AFL++'s `afl-showmap` (`-i <folder> -o <folder>`), which runs all inputs of a
+folder through a single forkserver and writes one raw bitmap (`-b`) per input. The edges of a
+seed are the non-zero entries of its bitmap, read with numpy as a sorted array of edge indices,
+and the edges found so far are tracked in a boolean map indexed by edge. With a coverage cache
+(see `mlfuzz.coverage_cache`), only the seeds missing from the cache are executed. The output,
+`replayed_plot_data`, has one line `<relative time in s>, <edges found so far>` per seed, in
+the order in which they were found. The edges of each seed are saved into `replayed_edges`
+(see `mlfuzz.edge_table`). Replays are incremental: a checkpoint next to the output lets a
+replay continue where an interrupted or earlier one stopped, e.g., to follow the queue of a
+running fuzzer.
+"""
+import base64
+import dataclasses
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from mlfuzz.coverage_cache import CoverageCache, decode_edges, encode_edges, seed_digest
+from mlfuzz.edge_table import (
+    EdgeTableWriter,
+    edges_file_name,
+    load_edge_table,
+    row_bits_for,
+)
+from mlfuzz.warmup import file_digest
+
+logger = logging.getLogger("neuzzpp")
+
+# AFL++ build providing `afl-showmap` with its directory mode
+showmap_path = os.path.join(os.environ.get("AFL_PATH", "/aflpp"), "afl-showmap")
+
+# Name of the coverage file written into the output folder of a trial
+plot_file_name = "replayed_plot_data"
+
+# Suffixes of the files next to a plot file: rows written so far, and position of the replay
+partial_suffix = ".partial"
+checkpoint_suffix = ".checkpoint"
+
+_text_map = re.compile(rb"(\d+:\d+\n)*")
+_text_edge = re.compile(rb"^(\d+):", re.MULTILINE)
+
+
+def corpus_seeds(queue: Path) -> List[Path]:
+    """Seeds of a queue folder, in the order in which they were found."""
+    from neuzzpp.utils import get_timestamp_millis_from_filename
+
+    seeds = [seed for seed in queue.glob("*") if seed.is_file() and seed.name != ".cur_input"]
+    # Order by timestamp in filename, then by name, e.g., for queues without timestamps
+    return sorted(
+        seeds, key=lambda seed: (get_timestamp_millis_from_filename(seed.name), seed.name)
+    )
+
+
+def parse_map(data: bytes) -> np.ndarray:
+    """
+    Edges of an `afl-showmap` output.
+
+    Args:
+        data: Raw bitmap (`-b`), or text output with one `<edge>:<count>` line per edge.
+
+    Returns:
+        The sorted indices of the edges hit.
+    """
+    bitmap = np.frombuffer(data, dtype=np.uint8)
+    # Text output has no NUL bytes, unlike raw bitmaps, where most edges are not hit
+    if bitmap.size and bitmap.min() > 0 and _text_map.fullmatch(data):
+        return np.unique(np.array(_text_edge.findall(data)).astype(np.int64))
+    return np.flatnonzero(bitmap)
+
+
+def showmap_batches(
+    seeds: Sequence[Path],
+    target: Sequence[str],
+    batch_size: int = 1000,
+    timeout_ms: int = 1000,
+    showmap: str = showmap_path,
+) -> Iterator[Optional[np.ndarray]]:
+    """
+    Replay seeds on a target, one forkserver per batch of seeds.
+
+    Args:
+        seeds: Inputs to replay.
+        target: Target program and arguments, with `@@` to pass inputs by file.
+        batch_size: Number of seeds replayed by each `afl-showmap` process. It bounds the
+            space taken by the bitmaps of a batch.
+        timeout_ms: Timeout of each execution in milliseconds.
+        showmap: Path of `afl-showmap`.
+
+    Yields:
+        The edges of each seed, in order, or `None` if no bitmap was produced for it.
+    """
+    for first in range(0, len(seeds), batch_size):
+        batch = seeds[first : first + batch_size]
+        with tempfile.TemporaryDirectory(prefix="replay-") as work_folder:
+            in_folder, out_folder = Path(work_folder) / "in", Path(work_folder) / "out"
+            os.makedirs(in_folder)
+            # Name the inputs by position: queue names contain characters like `:` and `,`
+            names = [f"{index:06d}" for index in range(len(batch))]
+            for name, seed in zip(names, batch):
+                try:
+                    os.link(seed, in_folder / name)
+                except OSError:
+                    shutil.copyfile(seed, in_folder / name)
+            command = [showmap, "-q", "-b", "-e", "-m", "none", "-t", str(timeout_ms)]
+            command += ["-i", str(in_folder), "-o", str(out_folder), "--", *target]
+            result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            if not out_folder.is_dir():
+                raise subprocess.CalledProcessError(
+                    result.returncode, command, stderr=result.stderr
+                )
+            for name in names:
+                map_file = out_folder / name
+                yield parse_map(map_file.read_bytes()) if map_file.exists() else None
+
+
+def seed_edges(
+    seeds: Sequence[Path],
+    target: Sequence[str],
+    cache: Optional[CoverageCache] = None,
+    batch_size: int = 1000,
+    timeout_ms: int = 1000,
+    **kwargs: Any,
+) -> Iterator[Optional[np.ndarray]]:
+    """
+    Edges of seeds on a target, from the coverage cache if possible, else by replaying them.
+
+    Args:
+        seeds: Inputs to replay.
+        target: Target program and arguments, with `@@` to pass inputs by file.
+        cache: Coverage cache to look up first and to complete with the replayed seeds.
+        batch_size: Number of seeds looked up or replayed at once.
+        timeout_ms: Timeout of each execution in milliseconds.
+        kwargs: Other options of `showmap_batches`.
+
+    Yields:
+        The edges of each seed, in order, or `None` if the replay produced no bitmap for it.
+    """
+    if cache is None:
+        yield from showmap_batches(
+            seeds, target, batch_size=batch_size, timeout_ms=timeout_ms, **kwargs
+        )
+        return
+    # Replays with other arguments or another timeout can reach other edges
+    run_key = cache.run_key(target, timeout_ms)
+    n_hits = 0
+    for first in range(0, len(seeds), batch_size):
+        batch = seeds[first : first + batch_size]
+        digests = [seed_digest(seed) for seed in batch]
+        found = cache.get(run_key, digests)
+        n_hits += sum(digest in found for digest in digests)
+        missing = {digest: seed for digest, seed in zip(digests, batch) if digest not in found}
+        replayed: Dict[str, np.ndarray] = {}
+        if missing:
+            batches = showmap_batches(
+                list(missing.values()),
+                target,
+                batch_size=batch_size,
+                timeout_ms=timeout_ms,
+                **kwargs,
+            )
+            for digest, edges in zip(missing, batches):
+                if edges is not None:
+                    replayed[digest] = edges
+            # Failed replays are not cached: they may be due to, e.g., a loaded machine
+            cache.put(run_key, replayed)
+        found.update(replayed)
+        yield from (found.get(digest) for digest in digests)
+    logger.info(f"Coverage cache hits: {n_hits} of {len(seeds)} seeds.")
+
+
+@dataclass
+class ReplayCheckpoint:
+    """Position reached by the replay of a corpus, saved next to its plot file."""
+
+    target: str  # SHA-256 of the target binary
+    target_args: List[str]
+    n_seeds: int  # Number of seeds replayed, in order, including failed ones
+    last_seed: str  # Name of the last seed replayed
+    last_time: int  # Relative time of the last seed in the plot file, in seconds
+    plot_size: int  # Size in bytes of the plot file up to the last seed
+    # Sorted edges covered so far
+    edges: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int64))
+    failed: List[int] = field(default_factory=list)  # Positions of the seeds that failed
+
+    def save(self, path: Path) -> None:
+        """Write the checkpoint atomically."""
+        data = dataclasses.asdict(self)
+        data["edges"] = base64.b64encode(encode_edges(self.edges)).decode()
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "w") as out_file:
+            json.dump(data, out_file)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["ReplayCheckpoint"]:
+        """Read a checkpoint, or return `None` if there is no readable one."""
+        try:
+            with open(path) as in_file:
+                data = json.load(in_file)
+            data["edges"] = decode_edges(base64.b64decode(data["edges"]))
+            return cls(**data)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+
+def checkpoint_path(plot_file: Path) -> Path:
+    """Location of the checkpoint of the replay writing a plot file."""
+    return plot_file.with_name(plot_file.name + checkpoint_suffix)
+
+
+def _resumable(
+    checkpoint: Optional[ReplayCheckpoint],
+    seeds: Sequence[Path],
+    target: Sequence[str],
+    digest: str,
+) -> bool:
+    """Whether a checkpoint was made by replaying a prefix of the seeds on the same target."""
+    return (
+        checkpoint is not None
+        and checkpoint.target == digest
+        and checkpoint.target_args == list(target[1:])
+        and checkpoint.n_seeds <= len(seeds)
+        and (checkpoint.n_seeds == 0 or seeds[checkpoint.n_seeds - 1].name == checkpoint.last_seed)
+    )
+
+
+def _restore_partial(plot_file: Path, partial_file: Path, plot_size: int) -> bool:
+    """
+    Recreate the partial plot file of a checkpoint. Return whether it was possible.
+
+    Rows written after the checkpoint by an interrupted replay are dropped.
+    """
+    if not (partial_file.exists() and partial_file.stat().st_size >= plot_size):
+        if not (plot_file.exists() and plot_file.stat().st_size >= plot_size):
+            return False
+        shutil.copyfile(plot_file, partial_file)
+    os.truncate(partial_file, plot_size)
+    return True
+
+
+def _restore_table(edges_file: Path, partial_file: Path, n_rows: int) -> Optional[EdgeTableWriter]:
+    """Reopen the partial edge table of a checkpoint, or return `None` if it is lost."""
+    if partial_file.exists():
+        try:
+            return EdgeTableWriter(partial_file, resume_rows=n_rows)
+        except ValueError:
+            pass
+    if load_edge_table(edges_file) is None:
+        return None
+    shutil.copyfile(edges_file, partial_file)
+    try:
+        return EdgeTableWriter(partial_file, resume_rows=n_rows)
+    except ValueError:
+        return None
+
+
+def replay_seeds(
+    seeds: Sequence[Path],
+    target: Sequence[str],
+    plot_file: Path,
+    cache: Optional[CoverageCache] = None,
+    resume: bool = True,
+    edges_file: Optional[Path] = None,
+    batch_size: int = 1000,
+    **kwargs: Any,
+) -> int:
+    """
+    Replay seeds and write the number of edges found after each of them.
+
+    The replay is incremental: its position and the edges covered so far are saved next to
+    the plot file after every batch of seeds. A later call on the same, possibly grown, corpus
+    and target continues from there and only appends the rows of the new seeds. The rows are
+    written to a partial file next to the plot file, renamed once complete, so that the plot
+    file is never seen partially written. The same goes for the edge table of the seeds.
+
+    Args:
+        seeds: Inputs to replay, in the order in which they were found.
+        target: Target program and arguments, with `@@` to pass inputs by file.
+        plot_file: Output file.
+        cache: Coverage cache of the seeds, if any.
+        resume: Whether to continue from the checkpoint of an earlier replay, if any.
+        edges_file: Edge table to write the edges of every seed into (see
+            `mlfuzz.edge_table`), if any.
+        batch_size: Number of seeds replayed between two checkpoints.
+        kwargs: Other options of `showmap_batches`.
+
+    Returns:
+        The total number of edges covered by the seeds.
+    """
+    from neuzzpp.utils import get_timestamp_millis_from_filename
+
+    partial_file = plot_file.with_name(plot_file.name + partial_suffix)
+    checkpoint_file = checkpoint_path(plot_file)
+    partial_table = (
+        None if edges_file is None else edges_file.with_name(edges_file.name + ".partial")
+    )
+    digest = file_digest(Path(target[0]))
+    checkpoint = ReplayCheckpoint.load(checkpoint_file) if resume else None
+    table: Optional[EdgeTableWriter] = None
+    if _resumable(checkpoint, seeds, target, digest):
+        up_to_date = (
+            checkpoint.n_seeds == len(seeds)
+            and not partial_file.exists()
+            and plot_file.exists()
+            and plot_file.stat().st_size == checkpoint.plot_size
+        )
+        if edges_file is not None:
+            complete_table = load_edge_table(edges_file)
+            up_to_date = up_to_date and not partial_table.exists() and complete_table is not None
+            up_to_date = up_to_date and len(complete_table) == checkpoint.n_seeds
+            del complete_table  # Unmap the table before it is changed
+        if up_to_date:
+            os.utime(plot_file)  # Newer than the queue, like after a full replay
+            return len(checkpoint.edges)
+        if not _restore_partial(plot_file, partial_file, checkpoint.plot_size):
+            checkpoint = None
+        elif edges_file is not None:
+            table = _restore_table(edges_file, partial_table, checkpoint.n_seeds)
+            if table is None:
+                checkpoint = None
+    else:
+        checkpoint = None
+    if checkpoint is None:
+        # Start over, without a checkpoint that does not match the new partial files
+        if checkpoint_file.exists():
+            os.remove(checkpoint_file)
+        with open(partial_file, "w") as out_file:
+            out_file.write("# relative_time, edges_found\n")
+        checkpoint = ReplayCheckpoint(
+            digest, list(target[1:]), 0, "", 0, partial_file.stat().st_size
+        )
+        if edges_file is not None:
+            table = EdgeTableWriter(partial_table)
+    elif checkpoint.n_seeds:
+        logger.info(f"Resuming replay after {checkpoint.n_seeds} seeds ({checkpoint.last_seed}).")
+
+    new_seeds = seeds[checkpoint.n_seeds :]
+    n_failed = 0
+    # Virgin map of the edges: an edge is new to a seed if it is not covered yet
+    covered = np.zeros(row_bits_for(int(checkpoint.edges.max(initial=0))), dtype=bool)
+    covered[checkpoint.edges] = True
+    n_covered = len(checkpoint.edges)
+    with open(partial_file, "a") as out_file:
+        # Exhaust the edges first, so that the generator runs to completion
+        edges_of_seeds = seed_edges(new_seeds, target, cache, batch_size=batch_size, **kwargs)
+        for index, (edges, seed) in enumerate(zip(edges_of_seeds, new_seeds), 1):
+            if table is not None:
+                table.append(edges)
+            if edges is None:
+                n_failed += 1
+                checkpoint.failed.append(checkpoint.n_seeds)
+            else:
+                if edges.size and edges[-1] >= covered.size:
+                    covered = np.concatenate(
+                        (covered, np.zeros(row_bits_for(int(edges[-1])) - covered.size, bool))
+                    )
+                n_covered += int(np.count_nonzero(~covered[edges]))
+                covered[edges] = True
+                checkpoint.last_time = int(get_timestamp_millis_from_filename(seed.name) / 1000)
+                out_file.write(f"{checkpoint.last_time}, {n_covered}\n")
+            checkpoint.n_seeds += 1
+            checkpoint.last_seed = seed.name
+            if index % batch_size == 0:
+                out_file.flush()
+                if table is not None:
+                    table.flush()
+                checkpoint.plot_size = out_file.tell()
+                checkpoint.edges = np.flatnonzero(covered)
+                checkpoint.save(checkpoint_file)
+        checkpoint.plot_size = out_file.tell()
+    checkpoint.edges = np.flatnonzero(covered)
+    if table is not None:
+        table.flush()
+    checkpoint.save(checkpoint_file)
+    if table is not None:
+        table.close([seed.name for seed in seeds], checkpoint.failed, digest, target[1:])
+        os.replace(partial_table, edges_file)
+    os.replace(partial_file, plot_file)
+    if n_failed:
+        logger.error(f"Bitmap extraction failed for {n_failed} of {len(new_seeds)} seeds.")
+    return n_covered
+
+
+def replay_corpus(
+    output_folder: Path,
+    target: Path,
+    target_args: Sequence[str] = (),
+    cache: Optional[CoverageCache] = None,
+    resume: bool = True,
+) -> Path:
+    """
+    Replay the queue of a fuzzer output folder into its `replayed_plot_data`, and the edges of
+    its seeds into its edge table, `replayed_edges`.
+
+    Args:
+        output_folder: Folder with the `queue` of the fuzzer (`default` for AFL++).
+        target: Instrumented target binary.
+        target_args: Arguments of the target, e.g., `@@`.
+        cache: Coverage cache of the seeds, if any.
+        resume: Whether to continue from the checkpoint of an earlier replay, if any.
+
+    Returns:
+        The path of the plot file.
+    """
+    plot_file = output_folder / plot_file_name
+    seeds = corpus_seeds(output_folder / "queue")
+    n_edges = replay_seeds(
+        seeds,
+        [str(target), *target_args],
+        plot_file,
+        cache,
+        resume,
+        edges_file=output_folder / edges_file_name,
+    )
+    logger.info(f"Replayed {len(seeds)} seeds of {output_folder}: {n_edges} edges.")
+    return plot_file
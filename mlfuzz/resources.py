@@ -0,0 +1,157 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Host memory and GPU shares requested by jobs, besides the core each job runs on.
+
+GPUs are divisible: a job requests a fraction of a GPU, and several jobs whose fractions sum up
+to at most one share a GPU. The ML models of NEUZZ, Neuzz++ and PreFuzz are small enough for
+several trials to train on the same GPU.
+
+Cores are not part of the requests: every job runs on exactly one logical CPU handed out by
+`CoreAllocator`. Threads of a job, e.g., TensorFlow threads training the model of an ML fuzzer,
+share that CPU.
+"""
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+# Tolerance for rounding errors when summing up GPU fractions
+_epsilon = 1e-6
+
+
+@dataclass
+class ResourceRequest:
+    """Resources needed by one job, besides its core."""
+
+    memory_mb: int = 0
+    gpu: float = 0.0
+
+
+def read_host_memory_mb(meminfo: Path = Path("/proc/meminfo")) -> Optional[int]:
+    """Total memory of the host in MB, or `None` if it cannot be read."""
+    try:
+        with open(meminfo) as meminfo_file:
+            for line in meminfo_file:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class ResourcePool:
+    """
+    Memory and GPU shares available to the jobs of a host.
+
+    Args:
+        memory_mb: Memory available to jobs in MB, or `None` for no limit.
+        gpus: IDs of the GPUs available to jobs.
+        gpu_capacity: Capacity of each GPU, in the unit of the GPU requests of jobs.
+    """
+
+    def __init__(
+        self, memory_mb: Optional[int] = None, gpus: Iterable[int] = (), gpu_capacity: float = 1.0
+    ) -> None:
+        self.memory_mb = memory_mb
+        self.used_memory_mb = 0
+        self.free_gpu = {gpu: gpu_capacity for gpu in gpus}
+
+    @property
+    def free_memory_mb(self) -> Optional[int]:
+        return None if self.memory_mb is None else self.memory_mb - self.used_memory_mb
+
+    def gpu_candidates(self, request: ResourceRequest) -> List[int]:
+        """GPUs with enough free share for the request, the most used ones first (best fit)."""
+        fitting = [gpu for gpu, free in self.free_gpu.items() if free + _epsilon >= request.gpu]
+        return sorted(fitting, key=lambda gpu: (self.free_gpu[gpu], gpu))
+
+    def fits(self, request: ResourceRequest) -> bool:
+        """Whether a job with the given request can be started now."""
+        free_memory = self.free_memory_mb
+        if free_memory is not None and request.memory_mb > free_memory:
+            return False
+        return request.gpu == 0 or bool(self.gpu_candidates(request))
+
+    def slots(self, request: ResourceRequest) -> Optional[int]:
+        """Number of jobs with the given request that can be started now, `None` if unlimited."""
+        slots: Optional[int] = None
+        free_memory = self.free_memory_mb
+        if free_memory is not None and request.memory_mb > 0:
+            slots = max(0, free_memory // request.memory_mb)
+        if request.gpu > 0:
+            gpu_slots = sum(
+                int((free + _epsilon) // request.gpu) for free in self.free_gpu.values()
+            )
+            slots = gpu_slots if slots is None else min(slots, gpu_slots)
+        return slots
+
+    def allocate(self, request: ResourceRequest, gpu_id: Optional[int]) -> None:
+        """Reserve the requested resources, on the given GPU for GPU requests."""
+        self.used_memory_mb += request.memory_mb
+        if gpu_id is not None:
+            self.free_gpu[gpu_id] = self.free_gpu.get(gpu_id, 0.0) - request.gpu
+
+    def release(self, request: ResourceRequest, gpu_id: Optional[int]) -> None:
+        """Return the resources of a finished job to the pool."""
+        self.used_memory_mb -= request.memory_mb
+        if gpu_id is not None:
+            self.free_gpu[gpu_id] = self.free_gpu.get(gpu_id, 0.0) + request.gpu
+
+
+def job_request(
+    requests: Dict[str, ResourceRequest], fuzzer: str, needs_gpu: bool
+) -> ResourceRequest:
+    """
+    Resources requested by a job of the given fuzzer.
+
+    Args:
+        requests: Resource request of the jobs of each fuzzer, with a `"default"` entry for the
+            other fuzzers.
+        fuzzer: Name of the fuzzer of the job.
+        needs_gpu: Whether the job runs on a GPU. Otherwise, its GPU request is ignored.
+    """
+    request = requests.get(fuzzer, requests.get("default", ResourceRequest()))
+    if not needs_gpu:
+        return ResourceRequest(memory_mb=request.memory_mb)
+    return ResourceRequest(memory_mb=request.memory_mb, gpu=request.gpu or 1.0)
+
+
+def resource_requests_from_config(
+    config: Dict[str, Any], ml_fuzzers: Iterable[str]
+) -> Dict[str, ResourceRequest]:
+    """
+    Read the resource requests of the jobs of each fuzzer from an experiment configuration.
+
+    Fuzzers without entry in `job_resources` use the `default` entry. ML fuzzers request a whole
+    GPU unless configured otherwise.
+
+    Args:
+        config: Experiment configuration, as read from `experiment_config.yaml`.
+        ml_fuzzers: Names of the fuzzers allowed to use GPUs.
+
+    Returns:
+        The resource request of each fuzzer, indexed by upper-case fuzzer name. The `default`
+        request is stored under `"default"`.
+    """
+    ml_fuzzers = set(ml_fuzzers)
+    entries = {name.upper(): values for name, values in (config.get("job_resources") or {}).items()}
+    default = entries.pop("DEFAULT", None) or {}
+    requests = {"default": ResourceRequest(memory_mb=default.get("memory_mb", 0))}
+    for fuzzer in set(entries) | ml_fuzzers:
+        values = {**default, **(entries.get(fuzzer) or {})}
+        requests[fuzzer] = ResourceRequest(
+            memory_mb=values.get("memory_mb", 0),
+            gpu=values.get("gpu", 1.0) if fuzzer in ml_fuzzers else 0.0,
+        )
+    return requests
@@ -0,0 +1,617 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Shared implementation of the run scripts of the fuzzers (`fuzzers/*/run_*.py`).
+
+Each fuzzer is described by a `FuzzerSpec`. `run_fuzzer` parses the common command line, sets
+up the AFL environment, runs the fuzzer under a `Supervisor` and replays the corpus.
+
+The supervisor starts every process in its own process group and enforces the fuzzing time
+as a wall-clock deadline: at the deadline, the process group gets SIGTERM, which AFL-based
+fuzzers handle by saving their state and exiting, then SIGKILL after a grace period. Helper
+processes, like the ML models of NEUZZ and PreFuzz, are stopped the same way once the fuzzer
+exited. The start and end time of every phase of the run (startup, warmup, fuzzing, replay)
+are recorded in `phases.json` in the output folder.
+
+The AFL warmup of NEUZZ-like fuzzers can be shared between trials through a warmup cache
+(see `mlfuzz.warmup`).
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from mlfuzz.warmup import WarmupCache, warmup_key
+
+# Environment of all AFL-based fuzzers
+afl_environment = {
+    "AFL_NO_UI": "1",
+    # Skip AFL's CPU frequency check (fails on Docker).
+    "AFL_SKIP_CPUFREQ": "1",
+    # No need to bind affinity to one core, Docker enforces 1 core usage.
+    "AFL_NO_AFFINITY": "1",
+    # AFL will abort on startup if the core pattern sends notifications to
+    # external programs. We don't care about this.
+    "AFL_I_DONT_CARE_ABOUT_MISSING_CRASHES": "1",
+    # Don't exit when crashes are found. This can happen when corpus from
+    # OSS-Fuzz is used.
+    "AFL_SKIP_CRASHES": "1",
+    # Shuffle the queue
+    "AFL_SHUFFLE_QUEUE": "1",
+}
+
+# Additional environment of AFL++-based fuzzers
+aflpp_environment = {"AFL_FORKSRV_INIT_TMOUT": "1000"}
+
+# Name of the file recording the phases of a run in the output folder
+phases_file = "phases.json"
+
+# Script replaying the corpus of a running fuzzer with `--live_replay`
+replay_script = "/mlfuzz/scripts/replay_corpus.py"
+
+
+@dataclass
+class ModelSpec:
+    """
+    ML stage of NEUZZ-like fuzzers, run after a warmup with AFL.
+
+    The placeholders `{queue}`, `{target}` and `{target_rel}` of `model_command` are replaced
+    by the queue folder of the warmup, the target binary and its path relative to the current
+    folder.
+
+    The model is started `model_prestart` seconds before the end of the warmup, so that it
+    loads its ML framework while AFL still fuzzes. It computes the bitmaps of the corpus and
+    trains only once the fuzzer connected to it, so it cannot start earlier than that. The
+    fuzzer is started as soon as the model listens on `port`.
+    """
+
+    fuzzer: str  # Path of the ML-guided fuzzer
+    model_command: List[str]  # Command starting the ML model
+    input_folder: str  # Folder name of the warmup corpus in the output folder
+    warmup: int = 60 * 60  # Maximum warmup time with AFL in seconds
+    max_seed_length: int = 10000  # Limit seed input size for effective learning
+    port: int = 12012  # Local TCP port on which the model waits for the fuzzer
+    model_prestart: int = 60  # Time in seconds before the end of the warmup to start the model
+    model_timeout: int = 600  # Maximum time in seconds for the model to listen on its port
+
+
+@dataclass
+class FuzzerSpec:
+    """Declarative description of how to run a fuzzer."""
+
+    name: str  # Short name used in the console output, e.g., `afl`
+    title: str  # Display name, e.g., `AFL`
+    afl_fuzz: str  # Path of the `afl-fuzz` binary, or of the warmup fuzzer for ML fuzzers
+    afl_args: List[str] = field(default_factory=list)  # Extra `afl-fuzz` options, e.g., `-d`
+    seed_option: str = "-s"  # Option setting the seed of the random number generator
+    aflpp: bool = False  # Whether the fuzzer is based on AFL++ and writes to `default`
+    env: Dict[str, str] = field(default_factory=dict)  # Additional environment variables
+    model: Optional[ModelSpec] = None
+
+
+class Supervisor:
+    """
+    Run the processes of a fuzzing trial and record the phases of the trial.
+
+    Args:
+        output_folder: Folder where the phases are recorded in `phases.json`.
+        grace_period: Time in seconds between SIGTERM and SIGKILL.
+        tag: Prefix of console messages.
+    """
+
+    def __init__(self, output_folder: Path, grace_period: float = 10.0, tag: str = "") -> None:
+        self.output_folder = output_folder
+        self.grace_period = grace_period
+        self.tag = tag
+        self.record: Dict[str, Any] = {"phases": []}
+        self._helpers: List[subprocess.Popen] = []
+        self._current: Optional[subprocess.Popen] = None
+        self._stopping = False
+
+    def log(self, message: str) -> None:
+        print(f"[{self.tag}] {message}", flush=True)
+
+    def begin(self, phase: str) -> None:
+        """Start a phase, ending the current one."""
+        self.end()
+        self.record["phases"].append({"phase": phase, "start": time.time(), "end": None})
+        self._save()
+
+    def end(self) -> None:
+        """End the current phase, if any."""
+        phases = self.record["phases"]
+        if phases and phases[-1]["end"] is None:
+            phases[-1]["end"] = time.time()
+            self._save()
+
+    def handle_signals(self) -> None:
+        """Stop all processes when the run script is stopped, e.g., by `docker stop`."""
+
+        def stop(signum: int, frame: Any) -> None:
+            self._stopping = True
+            self.record["stopped_by"] = signal.Signals(signum).name
+            for proc in ([self._current] if self._current is not None else []) + self._helpers:
+                self._signal(proc, signal.SIGTERM)
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+    def start_helper(self, command: Sequence[str]) -> subprocess.Popen:
+        """Start a process running alongside the fuzzer, stopped by `stop_helpers`."""
+        self.log("Running command: " + " ".join(command))
+        proc = subprocess.Popen(command, start_new_session=True)
+        self._helpers.append(proc)
+        return proc
+
+    def stop_helpers(self) -> None:
+        for proc in self._helpers:
+            self._terminate(proc)
+        self._helpers = []
+
+    def run(
+        self,
+        command: Sequence[str],
+        deadline: Optional[float] = None,
+        started_marker: Optional[Path] = None,
+        phase: Optional[str] = None,
+        at: Optional[Tuple[float, Callable[[], None]]] = None,
+    ) -> int:
+        """
+        Run a process until it exits or the deadline passes.
+
+        Args:
+            command: Command to run in a new process group.
+            deadline: Time (as from `time.time()`) at which the process group is terminated.
+            started_marker: File created by the process once started, e.g., `fuzzer_stats`.
+                The current phase then changes to `phase`.
+            phase: Phase starting with `started_marker`.
+            at: Time and action run once at that time while the process runs, e.g., to start
+                a helper process ahead of the next phase.
+
+        Returns:
+            The exit code of the process. Processes stopped at their deadline return 0.
+
+        Raises:
+            subprocess.CalledProcessError: The process failed before its deadline.
+        """
+        if self._stopping:
+            raise SystemExit(1)
+        self.log("Running command: " + " ".join(command))
+        proc = subprocess.Popen(command, start_new_session=True)
+        self._current = proc
+        timed_out = False
+        try:
+            while True:
+                timeout = 1.0 if started_marker is not None else None
+                if at is not None:
+                    if time.time() >= at[0]:
+                        at[1]()
+                        at = None
+                    else:
+                        until_at = at[0] - time.time()
+                        timeout = until_at if timeout is None else min(timeout, until_at)
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        timed_out = True
+                        self.log("Time budget used up. Stopping the fuzzer.")
+                        self._terminate(proc)
+                        break
+                    timeout = remaining if timeout is None else min(timeout, remaining)
+                try:
+                    proc.wait(timeout)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+                if started_marker is not None and started_marker.exists():
+                    started_marker = None
+                    if phase is not None:
+                        self.begin(phase)
+        finally:
+            self._current = None
+        if self._stopping:
+            self.log(f"Stopped by {self.record['stopped_by']}.")
+            self.stop_helpers()
+            self.end()
+            raise SystemExit(1)
+        if proc.returncode != 0 and not timed_out:
+            raise subprocess.CalledProcessError(proc.returncode, list(command))
+        return 0 if timed_out else proc.returncode
+
+    def _terminate(self, proc: subprocess.Popen) -> None:
+        """SIGTERM the process group of a process, then SIGKILL it after the grace period."""
+        self._signal(proc, signal.SIGTERM)
+        try:
+            proc.wait(self.grace_period)
+        except subprocess.TimeoutExpired:
+            self.log(f"Process {proc.pid} ignored SIGTERM. Killing it.")
+            self.record["killed"] = self.record.get("killed", 0) + 1
+            self._signal(proc, signal.SIGKILL)
+            proc.wait()
+        # Also remove what is left of the group, e.g., forkservers
+        self._signal(proc, signal.SIGKILL)
+
+    @staticmethod
+    def _signal(proc: subprocess.Popen, signum: int) -> None:
+        try:
+            os.killpg(proc.pid, signum)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def _save(self) -> None:
+        os.makedirs(self.output_folder, exist_ok=True)
+        path = self.output_folder / phases_file
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "w") as out_file:
+            json.dump(self.record, out_file, indent=2)
+        os.replace(tmp_path, path)
+
+
+def afl_command(
+    spec: FuzzerSpec, args: argparse.Namespace, afl_fuzz: str, extra_args: Sequence[str] = ()
+) -> List[str]:
+    """Command line of `afl-fuzz` for a trial."""
+    command = [
+        afl_fuzz,
+        *extra_args,
+        "-i",
+        args.input_folder,
+        "-o",
+        args.output_folder,
+        # Use no memory limit as ASAN doesn't play nicely with one.
+        "-m",
+        "none",
+        "-t",
+        "1000+",  # Use same default 1 sec timeout, but add '+' to skip hangs.
+    ]
+    if args.seed_prng is not None:
+        command += [spec.seed_option, str(args.seed_prng)]
+    command += ["--", args.target_binary]
+    if args.pass_by_file:
+        command += ["@@"]
+    return command
+
+
+def parse_args(spec: FuzzerSpec, argv: Sequence[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=f"Script running a single {spec.title} experiment",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("input_folder", help="path to input corpus", type=str)
+    parser.add_argument("output_folder", help="path to output folder", type=str)
+    parser.add_argument("target_binary", help="target to fuzz", type=str)
+    parser.add_argument(
+        "-d", "--duration", help="experiment duration in seconds", type=int, default=None
+    )
+    parser.add_argument(
+        "-s",
+        "--seed_prng",
+        help="seed for the random number generator of the fuzzer",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--pass_by_file",
+        help="pass fuzz data to target by file",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--skip_replay",
+        help="do not replay the corpus after fuzzing, e.g., when done by a separate job",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--coverage_cache",
+        help="SQLite file caching the edges of seeds, used by the replay",
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "--live_replay",
+        help="replay the corpus every LIVE_REPLAY seconds while fuzzing, 0 to only replay at the "
+        "end (not supported by NEUZZ-like fuzzers, whose queue moves after the warmup)",
+        type=float,
+        default=0,
+    )
+    parser.add_argument(
+        "--grace_period",
+        help="seconds between SIGTERM and SIGKILL when the time budget is used up",
+        type=float,
+        default=10.0,
+    )
+    parser.add_argument(
+        "--warmup_cache",
+        help="folder caching the AFL warmup of NEUZZ-like fuzzers, shared between trials",
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "--warmup_only",
+        help="only run the AFL warmup to store it in the warmup cache",
+        default=False,
+        action="store_true",
+    )
+    args = parser.parse_args(argv[1:])
+    if args.warmup_only and (spec.model is None or args.warmup_cache is None):
+        parser.error("--warmup_only requires a fuzzer with warmup and --warmup_cache")
+    return args
+
+
+def run_fuzzer(spec: FuzzerSpec, argv: Sequence[str] = tuple(sys.argv)) -> None:
+    """
+    Run a fuzzing trial as specified, then replay its corpus.
+
+    Args:
+        spec: Description of the fuzzer.
+        argv: Command line of the run script.
+    """
+    args = parse_args(spec, argv)
+    start = time.time()
+    deadline = None if args.duration is None else start + args.duration
+    output_folder = Path(args.output_folder)
+    supervisor = Supervisor(output_folder, grace_period=args.grace_period, tag=f"run_{spec.name}")
+    supervisor.record.update({"fuzzer": spec.title, "duration": args.duration})
+    supervisor.handle_signals()
+
+    os.environ.update(afl_environment)
+    if spec.aflpp:
+        os.environ.update(aflpp_environment)
+    os.environ.update(spec.env)
+
+    # AFL writes its statistics once it processed the initial corpus
+    stats_folder = output_folder / "default" if spec.aflpp else output_folder
+    supervisor.begin("startup")
+    if spec.model is None:
+        if args.live_replay and not args.skip_replay:
+            # The final replay below only adds the seeds found since the last live replay
+            supervisor.start_helper(_live_replay_command(args, stats_folder))
+        supervisor.log(f"Running target with {spec.title}.")
+        try:
+            supervisor.run(
+                afl_command(spec, args, spec.afl_fuzz, spec.afl_args),
+                deadline,
+                started_marker=stats_folder / "fuzzer_stats",
+                phase="fuzzing",
+            )
+        finally:
+            supervisor.stop_helpers()
+        supervisor.log(f"{spec.title} is done.")
+    else:
+        if args.live_replay and not args.skip_replay:
+            supervisor.log(f"Live replay is not supported by {spec.title}: replaying at the end.")
+        if not _run_model_fuzzer(spec, args, supervisor, start, deadline):
+            supervisor.end()
+            if args.warmup_only:
+                # The warmup is in the cache, its work folder is not needed anymore
+                shutil.rmtree(output_folder, ignore_errors=True)
+            return
+
+    # Replay corpus, unless a separate post-processing job does it
+    if not args.skip_replay:
+        from mlfuzz.coverage_cache import open_cache
+        from mlfuzz.replay import replay_corpus
+
+        supervisor.begin("replay")
+        supervisor.log("Replaying corpus.")
+        replay_corpus(stats_folder, Path(args.target_binary), cache=open_cache(args.coverage_cache))
+    supervisor.end()
+    supervisor.log("All done. Exiting now.")
+
+
+def _live_replay_command(args: argparse.Namespace, stats_folder: Path) -> List[str]:
+    """Command replaying the queue of the fuzzer every `--live_replay` seconds."""
+    from mlfuzz.edge_table import edges_file_name
+    from mlfuzz.replay import plot_file_name
+
+    command = ["python", replay_script, "--live", str(args.live_replay)]
+    # Same outputs as the final replay, which continues from them
+    command += ["--edges", str(stats_folder / edges_file_name)]
+    if args.coverage_cache is not None:
+        command += ["--coverage_cache", args.coverage_cache]
+    return command + [
+        str(stats_folder / "queue"),
+        str(stats_folder / plot_file_name),
+        args.target_binary,
+    ]
+
+
+def _run_model_fuzzer(
+    spec: FuzzerSpec,
+    args: argparse.Namespace,
+    supervisor: Supervisor,
+    start: float,
+    deadline: Optional[float],
+) -> bool:
+    """Run the AFL warmup and the ML stage of a NEUZZ-like fuzzer. Return whether it ran."""
+    model = spec.model
+    assert model is not None
+    warmup_time = model.warmup if args.duration is None else min(args.duration, model.warmup)
+
+    afl_output_dir = os.path.join(args.output_folder, "queue")
+    input_dir = os.path.join(args.output_folder, model.input_folder)
+    target_rel_path = os.path.relpath(args.target_binary, os.getcwd())
+    placeholders = {
+        "{queue}": afl_output_dir,
+        "{target}": args.target_binary,
+        "{target_rel}": target_rel_path,
+    }
+    model_procs: List[subprocess.Popen] = []
+
+    def start_model() -> None:
+        # Spinning up the neural network
+        if not model_procs:
+            model_procs.append(
+                supervisor.start_helper([placeholders.get(arg, arg) for arg in model.model_command])
+            )
+
+    try:
+        if not _warm_up(spec, args, supervisor, start, warmup_time, start_model):
+            return False
+        if supervisor.record.get("warmup_cached"):
+            # The cached warmup counts towards the fuzzing time, as if it just ran
+            start = time.time() - warmup_time
+            deadline = None if args.duration is None else start + args.duration
+        if deadline is not None and time.time() >= deadline:
+            supervisor.log(f"Exit early without running {spec.title} due to time constraints")
+            return False
+
+        # Treat afl's queue folder as the input of the ML fuzzer
+        supervisor.begin("startup")
+        os.rename(afl_output_dir, input_dir)
+        longest_seed_len = _trim_seeds(Path(input_dir), model.max_seed_length, supervisor)
+
+        # Wait for the model to be ready
+        start_model()
+        _wait_for_listener(model_procs[0], model.port, model.model_timeout, supervisor)
+
+        command = [
+            model.fuzzer,
+            "-m",
+            "none",
+            "-i",
+            input_dir,
+            "-o",
+            afl_output_dir,
+            "-l",
+            str(longest_seed_len),
+            "-t",
+            str(warmup_time * 1000),
+        ]
+        if args.seed_prng:
+            command += ["-s", str(args.seed_prng)]
+        command += [target_rel_path]
+        supervisor.begin("fuzzing")
+        supervisor.run(command, deadline)
+    finally:
+        supervisor.stop_helpers()
+    supervisor.log(f"{spec.title} is done.")
+    return True
+
+
+def _warm_up(
+    spec: FuzzerSpec,
+    args: argparse.Namespace,
+    supervisor: Supervisor,
+    start: float,
+    warmup_time: int,
+    start_model: Callable[[], None],
+) -> bool:
+    """Run or restore the AFL warmup of a NEUZZ-like fuzzer. Return whether to continue."""
+    assert spec.model is not None
+    output_folder = Path(args.output_folder)
+    cache, key = None, ""
+    inputs: Dict[str, object] = {}
+    if args.warmup_cache is not None:
+        cache = WarmupCache(Path(args.warmup_cache))
+        key, inputs = warmup_key(
+            Path(args.target_binary),
+            Path(args.input_folder),
+            args.seed_prng,
+            warmup_time,
+            Path(spec.afl_fuzz),
+            args.pass_by_file,
+        )
+        supervisor.record["warmup_key"] = key
+    if cache is not None and cache.lookup(key) is not None:
+        if not args.warmup_only:
+            start_model()  # Loads while the warmup is restored
+        supervisor.log(f"Restoring cached warmup {key}.")
+        supervisor.begin("warmup")
+        cache.restore(key, output_folder)
+        supervisor.record["warmup_cached"] = True
+    else:
+        # Spawn the afl fuzzing process for warmup
+        supervisor.log("Running target with afl-fuzz for warmup.")
+        warmup_args = [] if args.pass_by_file else ["2147483647"]
+        warmup_end = start + warmup_time
+        at = None
+        if not args.warmup_only and (args.duration is None or args.duration > warmup_time):
+            at = (warmup_end - spec.model.model_prestart, start_model)
+        # Pass INT_MAX to afl to maximize the number of persistent loops it performs
+        supervisor.run(
+            afl_command(spec, args, spec.afl_fuzz) + warmup_args,
+            warmup_end,
+            started_marker=output_folder / "fuzzer_stats",
+            phase="warmup",
+            at=at,
+        )
+        supervisor.log("Warmed up!")
+        if cache is not None:
+            supervisor.log(f"Caching warmup {key}.")
+            cache.store(key, output_folder, inputs, exclude={phases_file})
+    return not args.warmup_only
+
+
+def _trim_seeds(input_dir: Path, max_seed_length: int, supervisor: Supervisor) -> int:
+    """Trim the corpus according to max_seed_length. Return the longest seed length."""
+    supervisor.log(f"Trim seed inputs to max {max_seed_length}")
+    longest_seed_len = 0
+    for file in input_dir.glob("*"):
+        if file.is_dir():  # delete folders
+            shutil.rmtree(file)
+        else:  # trim files
+            with open(file, "rb+") as seed_file:
+                seed_file.seek(0, os.SEEK_END)
+                seed_len = seed_file.tell()
+                if seed_len > max_seed_length:
+                    seed_file.truncate(max_seed_length)
+                    longest_seed_len = max_seed_length
+                elif seed_len > longest_seed_len:
+                    longest_seed_len = seed_len
+    supervisor.log(f"Longest seed length is: {longest_seed_len}")
+    return longest_seed_len
+
+
+def listening_ports() -> Set[int]:
+    """Local TCP ports in the LISTEN state, from `/proc/net/tcp` and `/proc/net/tcp6`."""
+    ports = set()
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(table) as in_file:
+                next(in_file)  # Header
+                for line in in_file:
+                    fields = line.split()
+                    if fields[3] == "0A":  # TCP_LISTEN
+                        ports.add(int(fields[1].rsplit(":", 1)[1], 16))
+        except FileNotFoundError:
+            continue
+    return ports
+
+
+def _wait_for_listener(
+    proc: subprocess.Popen, port: int, timeout: float, supervisor: Supervisor
+) -> None:
+    """
+    Wait until the model listens on its port.
+
+    The model accepts a single connection, the one of the fuzzer, so readiness is read from the
+    socket table of the kernel instead of connecting to the port.
+    """
+    start = time.time()
+    while port not in listening_ports():
+        if proc.poll() is not None:
+            raise RuntimeError(f"The model exited with code {proc.returncode} before starting.")
+        if time.time() - start > timeout:
+            raise RuntimeError(f"The model did not listen on port {port} after {timeout} s.")
+        time.sleep(0.2)
+    supervisor.log(f"Model ready after {time.time() - start:.1f} s of waiting.")
@@ -0,0 +1,328 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Distribution of experiment jobs on the CPUs and GPUs of the local host."""
+import logging
+import os
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from mlfuzz.backends import ExecutionBackend
+from mlfuzz.experiment import Job, JobAssignment, gpu_fuzzers
+from mlfuzz.memory import MemoryGuard
+from mlfuzz.resources import (
+    ResourcePool,
+    ResourceRequest,
+    job_request,
+    read_host_memory_mb,
+    resource_requests_from_config,
+)
+from mlfuzz.stages import output_folder
+from mlfuzz.topology import CoreAllocator, CpuTopology, read_gpu_numa_nodes
+
+logger = logging.getLogger("neuzzpp")
+
+
+class JobScheduler:
+    """
+    Assign jobs to free cores, memory and GPU shares, launch them and collect them once they
+    finish.
+
+    Args:
+        backend: Execution backend starting the jobs.
+        results_folder: Results folder of the experiment.
+        cores: Allocator of the cores available for jobs.
+        resources: Memory and GPUs available for jobs.
+        use_gpu: Whether ML jobs require a GPU.
+        requests: Resource request of the jobs of each fuzzer, with a `"default"` entry for the
+            other fuzzers.
+        gpu_nodes: NUMA node of each GPU, if known. ML jobs run on cores of that node.
+        simulate_gpus: Whether the GPUs are simulated. GPU shares are then accounted for, but
+            the jobs do not get access to any GPU.
+        memory_guard: Optional admission control holding back jobs under memory pressure.
+        memory_limits: Whether to limit the memory of each job to its memory request.
+    """
+
+    def __init__(
+        self,
+        backend: ExecutionBackend,
+        results_folder: Path,
+        cores: CoreAllocator,
+        resources: ResourcePool,
+        use_gpu: bool,
+        requests: Optional[Dict[str, ResourceRequest]] = None,
+        gpu_nodes: Optional[Dict[int, Optional[int]]] = None,
+        simulate_gpus: bool = False,
+        memory_guard: Optional[MemoryGuard] = None,
+        memory_limits: bool = False,
+    ) -> None:
+        self.backend = backend
+        self.results_folder = results_folder
+        self.cores = cores
+        self.resources = resources
+        self.use_gpu = use_gpu
+        self.requests = requests or {}
+        self.gpu_nodes = gpu_nodes or {}
+        self.simulate_gpus = simulate_gpus
+        self.memory_guard = memory_guard
+        self.memory_limits = memory_limits
+        self.running: Dict[str, JobAssignment] = {}
+
+    def needs_gpu(self, job: Job) -> bool:
+        return self.use_gpu and job.stage == "fuzz" and job.fuzzer in gpu_fuzzers
+
+    def request(self, job: Job) -> ResourceRequest:
+        """Resources requested by a job, besides its core."""
+        # Post-processing jobs only run the target, whatever the fuzzer
+        fuzzer = job.fuzzer if job.stage == "fuzz" else "default"
+        return job_request(self.requests, fuzzer, self.needs_gpu(job))
+
+    def capacity(self) -> Tuple[int, int]:
+        """
+        Number of jobs, and of ML jobs among them, that can be started now.
+
+        The numbers are conservative: they assume the largest memory and GPU requests.
+        """
+        largest = ResourceRequest(
+            memory_mb=max([request.memory_mb for request in self.requests.values()], default=0),
+            gpu=max([request.gpu for request in self.requests.values()], default=1.0) or 1.0,
+        )
+        cpus = self.cores.available()
+        memory_slots = self.resources.slots(ResourceRequest(memory_mb=largest.memory_mb))
+        if memory_slots is not None:
+            cpus = min(cpus, memory_slots)
+        if not self.use_gpu:
+            return cpus, 0
+        gpu_slots = self.resources.slots(largest)
+        return cpus, cpus if gpu_slots is None else min(cpus, gpu_slots)
+
+    def gauges(self) -> Dict[str, float]:
+        """Current state of the scheduler, as metrics indexed by name."""
+        gauges = {
+            "mlfuzz_running_jobs": float(len(self.running)),
+            "mlfuzz_free_cores": float(self.cores.available()),
+            "mlfuzz_free_gpu_share": sum(self.resources.free_gpu.values()),
+        }
+        if self.resources.free_memory_mb is not None:
+            gauges["mlfuzz_unreserved_memory_mb"] = float(self.resources.free_memory_mb)
+        return gauges
+
+    def adopt(self, job: Job, core_id: int, gpu_id: Optional[int], handle: str) -> bool:
+        """
+        Track a job launched by a previous run on the given core and GPU.
+
+        Returns:
+            Whether the backend could re-attach to the job.
+        """
+        if not self.backend.adopt(job.name(), handle):
+            return False
+        logger.info(f"Adopting {job.name()} on core {core_id}.")
+        self.running[job.name()] = JobAssignment(job, core_id, gpu_id)
+        self.cores.claim(core_id)
+        self.resources.allocate(self.request(job), gpu_id)
+        return True
+
+    def fill(
+        self, jobs: List[Job], command: Callable[[Job], Sequence[str]]
+    ) -> List[Tuple[JobAssignment, str]]:
+        """
+        Launch pending jobs until all free cores are used or no pending job fits anymore.
+
+        Launched jobs and jobs that failed to launch are removed from `jobs`. Jobs waiting for
+        memory or a GPU share do not hold back smaller jobs behind them.
+
+        Args:
+            jobs: Queue of pending jobs.
+            command: Function returning the command line running a job.
+
+        Returns:
+            The launched jobs with their backend handles.
+        """
+        launched: List[Tuple[JobAssignment, str]] = []
+        pending: List[Job] = []
+        n_held_back = 0
+        if jobs and self.memory_guard is not None:
+            self.memory_guard.update(self.backend.memory_usage())
+        while jobs and self.cores.available() > 0:
+            job = jobs.pop(0)
+            job_name = job.name()
+            request = self.request(job)
+            if not self.resources.fits(request):
+                pending.append(job)  # Leave it for later, smaller jobs may still fit
+                continue
+            # A job is always admitted on an idle host, even beyond the budget
+            if (
+                self.running
+                and self.memory_guard is not None
+                and not self.memory_guard.admits(
+                    job,
+                    request.memory_mb,
+                    [
+                        (other.job, self.request(other.job).memory_mb)
+                        for other in self.running.values()
+                    ],
+                )
+            ):
+                pending.append(job)
+                n_held_back += 1
+                continue
+            gpu_id, node = None, None
+            if request.gpu > 0:
+                # Pack jobs on the most used GPUs, preferring those with a free core on their node
+                candidates = self.resources.gpu_candidates(request)
+                gpu_id = min(
+                    candidates,
+                    key=lambda gpu: (
+                        self.cores.available(self.gpu_nodes.get(gpu)) == 0,
+                        candidates.index(gpu),
+                    ),
+                )
+                node = self.gpu_nodes.get(gpu_id)
+            core_id = self.cores.allocate(node)
+            assert core_id is not None
+            self.resources.allocate(request, gpu_id)
+            memory_limit = request.memory_mb if self.memory_limits and request.memory_mb else None
+            new_job = JobAssignment(job, core_id, gpu_id, memory_limit)
+
+            job_folder = job.folder(self.results_folder)
+            handle: Optional[str] = None
+            try:
+                os.makedirs(job_folder, exist_ok=True)
+            except OSError:
+                logger.warning(f"Failed to create output folder {job_folder}. Skipping job.")
+            else:
+                logger.info(f"Running experiment {job_name} on core {core_id}.")
+                # Jobs on simulated GPUs run without GPU, like on a CPU-only host
+                visible = (
+                    JobAssignment(job, core_id, None, memory_limit)
+                    if self.simulate_gpus
+                    else new_job
+                )
+                handle = self.backend.launch(visible, command(job))
+
+            if handle is not None:
+                self.running[job_name] = new_job
+                launched.append((new_job, handle))
+            else:
+                self._release(new_job)
+        jobs[:0] = pending
+        if n_held_back > 0:
+            logger.info(
+                f"Holding back {n_held_back} jobs: the projected memory usage would exceed "
+                "the memory budget."
+            )
+        return launched
+
+    def wait(self, timeout: float) -> List[Tuple[JobAssignment, Optional[int]]]:
+        """
+        Wait for running jobs to finish, then save their logs and free their resources.
+
+        Args:
+            timeout: Maximum waiting time in seconds.
+
+        Returns:
+            The finished jobs with their exit codes.
+        """
+        finished: List[Tuple[JobAssignment, Optional[int]]] = []
+        for job_name, exitcode in self.backend.wait(timeout).items():
+            current = self.running.pop(job_name)
+            finished.append((current, exitcode))
+            logger.info(f"{job_name} finished.")
+            self._release(current)
+            if self.memory_guard is not None:
+                self.memory_guard.finished(current.job)
+
+            if exitcode is None:
+                logger.warning(f"{job_name}: job disappeared without an exit code.")
+                continue
+
+            # Save job log
+            out_folder = output_folder(current.job.folder(self.results_folder))
+            log_name = "docker.log" if current.job.stage == "fuzz" else f"{current.job.stage}.log"
+            os.makedirs(out_folder, exist_ok=True)  # Warmup jobs run before their trial
+            self.backend.save_logs(job_name, out_folder / log_name)
+
+            # Check exit code
+            if exitcode == 0:
+                self.backend.cleanup(job_name)
+            else:
+                logger.warning(f"{job_name}: job exited with code {exitcode}.")
+        return finished
+
+    def _release(self, assignment: JobAssignment) -> None:
+        self.cores.release(assignment.core_id)
+        self.resources.release(self.request(assignment.job), assignment.gpu_id)
+
+
+def scheduler_from_config(
+    backend: ExecutionBackend,
+    config: Dict[str, Any],
+    n_cpus: Optional[int] = None,
+    n_gpus: Optional[int] = None,
+) -> JobScheduler:
+    """
+    Create a scheduler for the local host from an experiment configuration.
+
+    Args:
+        backend: Execution backend starting the jobs.
+        config: Experiment configuration, as read from `experiment_config.yaml`.
+        n_cpus: Number of jobs to run at the same time, instead of `n_cpus` from `config`.
+        n_gpus: Number of GPUs to use, instead of `n_gpus` from `config`.
+
+    Returns:
+        The configured scheduler.
+    """
+    n_cpus = config["n_cpus"] if n_cpus is None else n_cpus
+    n_gpus = config["n_gpus"] if n_gpus is None else n_gpus
+    simulate_gpus = config.get("simulate_gpus", False)
+    reserved = set(config.get("reserved_cpus") or [])
+    gpu_nodes: Dict[int, Optional[int]] = {}
+    if config.get("cpu_topology", True):
+        # Spread jobs over all CPUs of the host, up to `n_cpus` jobs at a time
+        topology = CpuTopology.read()
+        cpus: Iterable[int] = topology.cores.keys()
+        if config.get("gpu_numa_nodes"):
+            gpu_nodes = dict(enumerate(config["gpu_numa_nodes"]))
+        elif config["use_gpu"] and n_gpus > 0 and not simulate_gpus:
+            gpu_nodes = read_gpu_numa_nodes(n_gpus)
+    else:
+        topology = CpuTopology.flat(n_cpus)
+        cpus = range(n_cpus)
+    cores = CoreAllocator(
+        topology,
+        [cpu for cpu in cpus if cpu not in reserved],
+        max_jobs=n_cpus,
+        share_physical_cores=config.get("share_physical_cores", False),
+    )
+    if cores.available() < n_cpus:
+        logger.warning(
+            f"Only {cores.available()} cores available for jobs, fewer than n_cpus = {n_cpus}."
+        )
+    memory_mb = config.get("memory_mb") or read_host_memory_mb()
+    memory_budget_mb = config.get("memory_budget_mb", 0)
+    return JobScheduler(
+        backend,
+        Path(config["results_folder"]),
+        cores,
+        ResourcePool(memory_mb, range(n_gpus)),
+        config["use_gpu"],
+        requests=resource_requests_from_config(config, gpu_fuzzers),
+        gpu_nodes=gpu_nodes,
+        simulate_gpus=simulate_gpus,
+        memory_guard=(
+            MemoryGuard(memory_budget_mb, floor_mb=config.get("memory_floor_mb", 1024))
+            if memory_budget_mb > 0
+            else None
+        ),
+        memory_limits=config.get("memory_limits", False),
+    )
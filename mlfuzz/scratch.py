@@ -0,0 +1,186 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Local scratch staging of trial output.
+
+AFL-based fuzzers rewrite their statistics and `.cur_input` all the time. Instead of writing
+into the trial folder on a possibly shared file system, a job can fuzz into a local scratch
+folder (a size-limited tmpfs in Docker) that is copied to the trial folder periodically.
+Files are copied atomically: readers of the trial folder, like the metrics exporter and the
+watchdog, never see partially copied files, and the modification times are kept. Files removed
+or renamed in scratch are removed from the trial folder too, e.g., the `queue` of the AFL
+warmup of NEUZZ and PreFuzz once it became their `neuzz_in` or `prefuzz_in`.
+"""
+import logging
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Collection, Dict, List, Sequence, Set, Tuple
+
+logger = logging.getLogger("neuzzpp")
+
+# Location of the wrapper running jobs in scratch space, as installed in the `mlfuzz` image
+scratch_script = "/mlfuzz/scripts/run_in_scratch.py"
+
+# Files rewritten for every execution, useless once the trial is over
+volatile_files = {".cur_input"}
+
+
+class ScratchSyncer:
+    """
+    Copy the changes of a scratch folder to a target folder, periodically in a thread.
+
+    Only what the syncer copied itself is removed from the target folder: files written there
+    by others, like the logs of the job, are kept.
+
+    Args:
+        source: Scratch folder written by the fuzzer.
+        target: Folder receiving a copy of `source`.
+        interval: Time in seconds between two synchronizations.
+        skip: Names of the files that are not copied.
+    """
+
+    def __init__(
+        self,
+        source: Path,
+        target: Path,
+        interval: float = 60.0,
+        skip: Collection[str] = volatile_files,
+    ) -> None:
+        self.source = source
+        self.target = target
+        self.interval = interval
+        self.skip = skip
+        self._synced: Dict[Path, Tuple[int, int]] = {}  # Size and mtime of the copied files
+        self._folders: Set[Path] = set()  # Copied subfolders
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the periodic synchronization and copy the last changes."""
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.sync()
+
+    def sync(self) -> int:
+        """
+        Copy the files that changed since the last synchronization, and remove the copies of
+        the files and folders that no longer exist in the scratch folder.
+
+        Returns:
+            The number of copied files.
+        """
+        files: Set[Path] = set()
+        folders: Set[Path] = set()
+        n_copied = 0
+        for path in self._changed_files(files, folders):
+            relative = path.relative_to(self.source)
+            try:
+                stat = path.lstat()
+                self._copy(path, self.target / relative)
+            except FileNotFoundError:
+                files.discard(relative)
+                continue  # Removed by the fuzzer in the meantime
+            self._synced[relative] = (stat.st_size, stat.st_mtime_ns)
+            n_copied += 1
+        self._remove_deleted(files, folders)
+        return n_copied
+
+    def _changed_files(self, files: Set[Path], folders: Set[Path]) -> List[Path]:
+        # Also collects the relative paths of all files and subfolders of the scratch folder
+        changed = []
+        for folder, subfolders, names in os.walk(self.source):
+            relative_folder = Path(folder).relative_to(self.source)
+            os.makedirs(self.target / relative_folder, exist_ok=True)
+            if relative_folder != Path("."):
+                folders.add(relative_folder)
+            for name in names:
+                if name in self.skip:
+                    continue
+                path = Path(folder) / name
+                try:
+                    stat = path.lstat()
+                except FileNotFoundError:
+                    continue
+                relative = relative_folder / name
+                files.add(relative)
+                if self._synced.get(relative) != (stat.st_size, stat.st_mtime_ns):
+                    changed.append(path)
+        return changed
+
+    def _remove_deleted(self, files: Set[Path], folders: Set[Path]) -> None:
+        for relative in set(self._synced) - files:
+            try:
+                os.remove(self.target / relative)
+            except FileNotFoundError:
+                pass
+            del self._synced[relative]
+        # Deepest folders first, keeping the ones with files from others
+        for relative in sorted(self._folders - folders, key=lambda path: len(path.parts))[::-1]:
+            try:
+                os.rmdir(self.target / relative)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                logger.warning(f"Kept {self.target / relative}, not empty.")
+        self._folders = folders
+
+    @staticmethod
+    def _copy(source: Path, target: Path) -> None:
+        # Copy next to the target, then rename over it
+        tmp_target = target.with_name(f".{target.name}.sync-tmp")
+        if tmp_target.is_symlink() or tmp_target.exists():
+            os.remove(tmp_target)
+        shutil.copy2(source, tmp_target, follow_symlinks=False)
+        os.replace(tmp_target, target)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.sync()
+            except OSError as err:
+                logger.warning(f"Failed to copy {self.source} to {self.target}: {err}")
+
+
+def in_scratch(
+    command: Sequence[str], trial_folder: Path, scratch_folder: str, interval: float
+) -> List[str]:
+    """
+    Wrap the command of a job so that it writes to scratch space instead of its trial folder.
+
+    Args:
+        command: Command running the job, with the trial folder as output folder.
+        trial_folder: Output folder of the job in the results folder.
+        scratch_folder: Folder in which the job creates its scratch output folder.
+        interval: Time in seconds between two copies to the trial folder.
+
+    Returns:
+        The command running the job through `run_in_scratch.py`.
+    """
+    return [
+        "python",
+        scratch_script,
+        "--scratch_folder",
+        scratch_folder,
+        "--sync_interval",
+        str(interval),
+        str(trial_folder),
+        "--",
+        *command,
+    ]
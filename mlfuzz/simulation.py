@@ -0,0 +1,113 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Discrete-event simulation of an experiment, to compare job orders without running any job.
+
+The simulation follows the rules of `JobScheduler.fill`: the queue is scanned in order while a
+core is free, jobs whose memory or GPU share does not fit are skipped without holding back the
+jobs behind them, and GPUs are shared best-fit. Memory admission based on measured usage and the
+CPU topology are not simulated.
+"""
+import heapq
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from mlfuzz.experiment import Job
+from mlfuzz.resources import ResourcePool, ResourceRequest
+
+
+@dataclass
+class SimulationResult:
+    """
+    Predicted outcome of an experiment.
+
+    Attributes:
+        makespan: Time from the first job start to the last job end, in seconds.
+        cpu_utilization: Share of the core time used by jobs during the makespan.
+        gpu_utilization: Share of the GPU time requested by jobs during the makespan.
+        end_times: End time of each job in seconds, indexed by job name.
+        unschedulable: Names of the jobs whose request never fits the host.
+    """
+
+    makespan: float
+    cpu_utilization: float
+    gpu_utilization: float
+    end_times: Dict[str, float] = field(default_factory=dict)
+    unschedulable: List[str] = field(default_factory=list)
+
+
+def simulate(
+    jobs: Iterable[Job],
+    costs: Callable[[Job], float],
+    requests: Callable[[Job], ResourceRequest],
+    n_cpus: int,
+    n_gpus: int = 0,
+    memory_mb: Optional[int] = None,
+) -> SimulationResult:
+    """
+    Replay a job queue on a simulated host.
+
+    Args:
+        jobs: Job queue, in the order in which jobs are started.
+        costs: Function returning the run time of a job in seconds.
+        requests: Function returning the resources requested by a job, besides its core.
+        n_cpus: Number of jobs running at the same time.
+        n_gpus: Number of GPUs.
+        memory_mb: Memory available to jobs in MB, or `None` for no limit.
+
+    Returns:
+        The predicted makespan and utilization of the host.
+    """
+    queue = list(jobs)
+    pool = ResourcePool(memory_mb, range(n_gpus))
+    running: List[Tuple[float, int, str, ResourceRequest, Optional[int]]] = []
+    end_times: Dict[str, float] = {}
+    now, n_launched, cpu_time, gpu_time = 0.0, 0, 0.0, 0.0
+    while queue:
+        # Start pending jobs until all cores are busy
+        pending: List[Job] = []
+        while queue and len(running) < n_cpus:
+            job = queue.pop(0)
+            request = requests(job)
+            if not pool.fits(request):
+                pending.append(job)
+                continue
+            gpu_id = pool.gpu_candidates(request)[0] if request.gpu > 0 else None
+            pool.allocate(request, gpu_id)
+            cost = costs(job)
+            heapq.heappush(running, (now + cost, n_launched, job.name(), request, gpu_id))
+            n_launched += 1
+            cpu_time += cost
+            gpu_time += cost * request.gpu
+        queue[:0] = pending
+        if not running:
+            break  # The remaining jobs never fit
+
+        # Advance to the next job end, and collect all jobs ending at the same time
+        now = running[0][0]
+        while running and running[0][0] <= now:
+            end_time, _, name, request, gpu_id = heapq.heappop(running)
+            pool.release(request, gpu_id)
+            end_times[name] = end_time
+    for end_time, _, name, _, _ in running:
+        end_times[name] = end_time
+
+    makespan = max(end_times.values(), default=0.0)
+    return SimulationResult(
+        makespan=makespan,
+        cpu_utilization=cpu_time / (n_cpus * makespan) if makespan > 0 else 0.0,
+        gpu_utilization=gpu_time / (n_gpus * makespan) if makespan > 0 and n_gpus > 0 else 0.0,
+        end_times=end_times,
+        unschedulable=[job.name() for job in queue],
+    )
@@ -0,0 +1,128 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Post-processing stages of fuzzing trials.
+
+Each trial is a small graph of stages: the fuzzing job itself, then the replay of its corpus,
+a summary of the replayed coverage and the triage of its crashes. Every post-processing stage
+is a separate job on the same trial folder, started once the stage it depends on finished.
+A stage writes a single artifact into the output folder of the trial when it succeeds, so
+stages whose artifact already exists are not run again.
+"""
+import dataclasses
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from mlfuzz.experiment import Job
+
+
+@dataclass(frozen=True)
+class Stage:
+    """Step of the processing of a trial."""
+
+    name: str
+    after: Optional[str]  # Stage that must finish first
+    artifact: Optional[str]  # File written into the output folder of the trial when done
+
+
+# Stages of a trial, in topological order
+stages: Dict[str, Stage] = {
+    "fuzz": Stage("fuzz", None, None),
+    "replay": Stage("replay", "fuzz", "replayed_plot_data"),
+    "coverage": Stage("coverage", "replay", "coverage_summary.json"),
+    "triage": Stage("triage", "fuzz", "crash_triage.json"),
+}
+post_processing_stages = [name for name in stages if name != "fuzz"]
+
+
+def output_folder(trial_folder: Path) -> Path:
+    """Folder of the fuzzer output of a trial: `default` for AFL++-based fuzzers."""
+    return trial_folder / "default" if (trial_folder / "default").is_dir() else trial_folder
+
+
+def artifact_path(job: Job, results_folder: Path) -> Optional[Path]:
+    """Location of the artifact of a stage job, or `None` for fuzzing jobs."""
+    artifact = stages[job.stage].artifact
+    if artifact is None:
+        return None
+    return output_folder(job.folder(results_folder)) / artifact
+
+
+def is_done(job: Job, results_folder: Path) -> bool:
+    """Whether the artifact of a post-processing job already exists."""
+    path = artifact_path(job, results_folder)
+    return path is not None and path.exists()
+
+
+def discard(job: Job, results_folder: Path) -> None:
+    """Remove what is left of an interrupted job, to run it again from scratch."""
+    path = artifact_path(job, results_folder)
+    if path is not None and path.exists():
+        os.remove(path)
+
+
+class StageGraph:
+    """
+    Stage graph of the trials of an experiment.
+
+    Args:
+        names: Post-processing stages to run after fuzzing. The stages they depend on are
+            added if missing.
+    """
+
+    def __init__(self, names: Sequence[str]) -> None:
+        selected = set()
+        for name in names:
+            if name not in stages or name == "fuzz":
+                raise ValueError(f"Unknown post-processing stage: {name}.")
+            while name is not None and name != "fuzz":
+                selected.add(name)
+                name = stages[name].after
+        self.names = [name for name in post_processing_stages if name in selected]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.names
+
+    def jobs(self, trial: Job) -> List[Job]:
+        """Post-processing jobs of a trial, in topological order."""
+        return [dataclasses.replace(trial, stage=name) for name in self.names]
+
+    def successors(self, job: Job) -> List[Job]:
+        """Jobs of the same trial that can start once `job` finished."""
+        return [
+            dataclasses.replace(job, stage=name)
+            for name in self.names
+            if stages[name].after == job.stage
+        ]
+
+    def predecessor(self, job: Job) -> Optional[Job]:
+        """Job of the same trial that must finish before `job`, if any."""
+        after = stages[job.stage].after
+        return None if after is None else dataclasses.replace(job, stage=after)
+
+
+def stage_graph_from_config(config: Dict[str, Any]) -> Optional[StageGraph]:
+    """
+    Create the stage graph of an experiment from its configuration.
+
+    Args:
+        config: Experiment configuration, as read from `experiment_config.yaml`.
+
+    Returns:
+        The stage graph, or `None` if post-processing is done inside the fuzzing jobs.
+    """
+    names = config.get("post_processing") or []
+    return StageGraph(names) if names else None
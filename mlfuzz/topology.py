@@ -0,0 +1,193 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Allocation of CPU cores to jobs based on the topology of the host.
+
+Fuzzers running on two hyperthreads of the same physical core, or far from the memory and GPU
+they use, execute fewer inputs per second than fuzzers with a core of their own. To keep trials
+comparable, cores are allocated one trial per physical core by default, and ML jobs get a core on
+the NUMA node of their GPU.
+"""
+import logging
+import subprocess
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger("neuzzpp")
+
+sys_cpu_folder = Path("/sys/devices/system/cpu")
+sys_pci_folder = Path("/sys/bus/pci/devices")
+
+
+def parse_cpu_list(cpu_list: str) -> List[int]:
+    """Parse a CPU list in the kernel format, e.g., `0-3,8,10-11`."""
+    cpus: List[int] = []
+    for part in cpu_list.strip().split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus += range(int(first), int(last or first) + 1)
+    return cpus
+
+
+@dataclass
+class CpuTopology:
+    """
+    Physical core and NUMA node of each logical CPU of the host.
+
+    Attributes:
+        cores: Physical core of each logical CPU, as a (package ID, core ID) pair.
+        nodes: NUMA node of each logical CPU.
+    """
+
+    cores: Dict[int, Tuple[int, int]]
+    nodes: Dict[int, int]
+
+    @classmethod
+    def flat(cls, n_cpus: int) -> "CpuTopology":
+        """Topology of `n_cpus` independent cores on a single NUMA node."""
+        return cls({cpu: (0, cpu) for cpu in range(n_cpus)}, {cpu: 0 for cpu in range(n_cpus)})
+
+    @classmethod
+    def read(cls, cpu_folder: Path = sys_cpu_folder) -> "CpuTopology":
+        """
+        Read the topology of the online CPUs from sysfs.
+
+        CPUs whose topology is not exposed (e.g., in some containers) are considered separate
+        physical cores on NUMA node 0.
+        """
+        cores: Dict[int, Tuple[int, int]] = {}
+        nodes: Dict[int, int] = {}
+        for cpu in parse_cpu_list((cpu_folder / "online").read_text()):
+            topology = cpu_folder / f"cpu{cpu}" / "topology"
+            try:
+                package_id = int((topology / "physical_package_id").read_text())
+                core_id = int((topology / "core_id").read_text())
+            except (OSError, ValueError):
+                package_id, core_id = 0, cpu
+            cores[cpu] = (package_id, core_id)
+            node_links = sorted((cpu_folder / f"cpu{cpu}").glob("node[0-9]*"))
+            nodes[cpu] = int(node_links[0].name[len("node") :]) if node_links else 0
+        return cls(cores, nodes)
+
+
+def read_gpu_numa_nodes(n_gpus: int) -> Dict[int, Optional[int]]:
+    """
+    Detect the NUMA node of the NVIDIA GPUs of the host.
+
+    Returns:
+        The NUMA node of each GPU, or `None` where it cannot be determined.
+    """
+    unknown: Dict[int, Optional[int]] = {gpu: None for gpu in range(n_gpus)}
+    try:
+        out = subprocess.check_output(
+            ["nvidia-smi", "--query-gpu=index,pci.bus_id", "--format=csv,noheader"],
+            encoding="utf-8",
+            stderr=subprocess.DEVNULL,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return unknown
+
+    nodes = dict(unknown)
+    for line in out.splitlines():
+        index, _, bus_id = line.partition(",")
+        # nvidia-smi reports an 8-digit PCI domain, sysfs a 4-digit one
+        domain, _, device = bus_id.strip().lower().partition(":")
+        try:
+            node = int((sys_pci_folder / f"{domain[-4:]}:{device}" / "numa_node").read_text())
+            gpu = int(index)
+        except (OSError, ValueError):
+            continue
+        if gpu in nodes:
+            nodes[gpu] = node if node >= 0 else None
+    return nodes
+
+
+class CoreAllocator:
+    """
+    Hand out logical CPUs to jobs, one job per CPU.
+
+    Args:
+        topology: Topology of the host.
+        cpus: Logical CPUs available for jobs.
+        max_jobs: Maximum number of jobs running at the same time.
+        share_physical_cores: Whether jobs may run on SMT siblings of busy CPUs. If `True`,
+            idle physical cores are still used first.
+    """
+
+    def __init__(
+        self,
+        topology: CpuTopology,
+        cpus: Iterable[int],
+        max_jobs: Optional[int] = None,
+        share_physical_cores: bool = False,
+    ) -> None:
+        self.topology = topology
+        self.cpus = sorted(cpu for cpu in cpus if cpu in topology.cores)
+        self.max_jobs = len(self.cpus) if max_jobs is None else max_jobs
+        self.share_physical_cores = share_physical_cores
+        self._busy: Set[int] = set()
+
+    def available(self, node: Optional[int] = None) -> int:
+        """Number of jobs that can be started now, optionally only on the given NUMA node."""
+        candidates = self._candidates()
+        if node is not None:
+            candidates = [cpu for cpu in candidates if self.topology.nodes[cpu] == node]
+        if not self.share_physical_cores:
+            # Candidates are idle physical cores, count each of them once
+            candidates = list({self.topology.cores[cpu]: cpu for cpu in candidates}.values())
+        return min(len(candidates), self.max_jobs - len(self._busy))
+
+    def allocate(self, node: Optional[int] = None) -> Optional[int]:
+        """
+        Reserve a CPU for a job.
+
+        Args:
+            node: Preferred NUMA node. Without preference, the node with most free CPUs is used.
+
+        Returns:
+            The reserved CPU, or `None` if no CPU is available.
+        """
+        if self.available() == 0:
+            return None
+        candidates = self._candidates()
+        by_node: Dict[int, List[int]] = {}
+        for cpu in candidates:
+            by_node.setdefault(self.topology.nodes[cpu], []).append(cpu)
+        if node in by_node:
+            candidates = by_node[node]
+        else:
+            candidates = max(by_node.values(), key=len)
+
+        # Prefer CPUs whose physical core is idle
+        busy_cores = {self.topology.cores[cpu] for cpu in self._busy}
+        cpu = min(candidates, key=lambda cpu: (self.topology.cores[cpu] in busy_cores, cpu))
+        self._busy.add(cpu)
+        return cpu
+
+    def claim(self, cpu: int) -> None:
+        """Mark a CPU as used by a job that is already running."""
+        self._busy.add(cpu)
+
+    def release(self, cpu: int) -> None:
+        """Make the CPU of a finished job available again."""
+        self._busy.discard(cpu)
+
+    def _candidates(self) -> List[int]:
+        free = [cpu for cpu in self.cpus if cpu not in self._busy]
+        if self.share_physical_cores:
+            return free
+        busy_cores = {self.topology.cores[cpu] for cpu in self._busy}
+        return [cpu for cpu in free if self.topology.cores[cpu] not in busy_cores]
@@ -0,0 +1,192 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Cache of the AFL warmup of NEUZZ and PreFuzz trials.
+
+Both fuzzers start with the same AFL run on the same target, seeds and random seed before
+their ML stage. The output folder of a warmup is cached under a key hashing everything the
+warmup depends on, so that the trials of both fuzzers, and of later experiments, restore it
+instead of fuzzing for another hour. The experiment runner runs each shared warmup once as a
+`warmup` job, then starts the ML fuzzers waiting for it.
+"""
+import dataclasses
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Collection, Dict, List, Optional, Sequence, Tuple
+
+from mlfuzz.experiment import Job, warmup_fuzzers
+
+# File describing a cached warmup, next to its output
+metadata_file = "warmup.json"
+
+
+def file_digest(path: Path) -> str:
+    """SHA-256 of the content of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as in_file:
+        for chunk in iter(lambda: in_file.read(2**20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def folder_digest(folder: Path) -> str:
+    """SHA-256 of the names and contents of all files of a folder."""
+    digest = hashlib.sha256()
+    for path in sorted(path for path in folder.rglob("*") if path.is_file()):
+        digest.update(path.relative_to(folder).as_posix().encode() + b"\0")
+        digest.update(file_digest(path).encode())
+    return digest.hexdigest()
+
+
+def warmup_key(
+    target_binary: Path,
+    seeds_folder: Path,
+    rng_seed: Optional[int],
+    duration: int,
+    afl_fuzz: Path,
+    pass_by_file: bool,
+) -> Tuple[str, Dict[str, object]]:
+    """
+    Cache key of a warmup.
+
+    Args:
+        target_binary: Fuzzed binary.
+        seeds_folder: Initial corpus.
+        rng_seed: Seed of the random number generator of AFL.
+        duration: Warmup time in seconds.
+        afl_fuzz: AFL binary running the warmup.
+        pass_by_file: Whether inputs are passed to the target by file.
+
+    Returns:
+        The key and the inputs it was computed from.
+    """
+    inputs: Dict[str, object] = {
+        "target": file_digest(target_binary),
+        "seeds": folder_digest(seeds_folder),
+        "rng_seed": rng_seed,
+        "duration": duration,
+        "afl": file_digest(afl_fuzz),
+        "pass_by_file": pass_by_file,
+    }
+    key = hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+    return key, inputs
+
+
+class WarmupCache:
+    """
+    Folder of cached warmup outputs, one subfolder per key.
+
+    Args:
+        folder: Location of the cache, shared by all jobs.
+    """
+
+    def __init__(self, folder: Path) -> None:
+        self.folder = folder
+
+    def lookup(self, key: str) -> Optional[Path]:
+        """Folder of the cached warmup with the given key, if any."""
+        path = self.folder / key
+        return path if (path / metadata_file).exists() else None
+
+    def store(
+        self,
+        key: str,
+        output_folder: Path,
+        inputs: Dict[str, object],
+        exclude: Collection[str] = (),
+    ) -> None:
+        """
+        Add the output folder of a warmup to the cache.
+
+        The output is copied next to its final location, then renamed, so that concurrent jobs
+        never restore a partial warmup. If the key was stored in the meantime, the copy is
+        dropped.
+
+        Args:
+            key: Key of the warmup.
+            output_folder: Output folder of the warmup.
+            inputs: Inputs of the key, saved with the warmup.
+            exclude: Names of files of the output folder that are not cached.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        tmp_folder = self.folder / f".tmp-{key}-{os.getpid()}"
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+        shutil.copytree(
+            output_folder,
+            tmp_folder,
+            symlinks=True,
+            ignore=lambda folder, names: [
+                name for name in names if Path(folder) == output_folder and name in exclude
+            ],
+        )
+        metadata = {**inputs, "created_at": time.time()}
+        with open(tmp_folder / metadata_file, "w") as out_file:
+            json.dump(metadata, out_file, indent=2)
+        try:
+            os.rename(tmp_folder, self.folder / key)
+        except OSError:
+            if self.lookup(key) is None:
+                raise
+            shutil.rmtree(tmp_folder, ignore_errors=True)
+
+    def restore(self, key: str, output_folder: Path) -> None:
+        """
+        Copy a cached warmup into an output folder.
+
+        The modification times of the restored files are shifted as if the warmup just ended,
+        so that the timeline of the corpus stays consistent with the fuzzing that follows.
+        """
+        cached = self.lookup(key)
+        if cached is None:
+            raise KeyError(key)
+        with open(cached / metadata_file) as in_file:
+            offset = time.time() - json.load(in_file)["created_at"]
+        for folder, _, files in os.walk(cached):
+            relative = Path(folder).relative_to(cached)
+            os.makedirs(output_folder / relative, exist_ok=True)
+            for name in files:
+                if relative == Path(".") and name == metadata_file:
+                    continue
+                target = output_folder / relative / name
+                shutil.copy2(Path(folder) / name, target, follow_symlinks=False)
+                if not target.is_symlink():
+                    mtime = target.stat().st_mtime + offset
+                    os.utime(target, (mtime, mtime))
+
+
+def shared_warmups(jobs: Sequence[Job]) -> List[Tuple[Job, List[Job]]]:
+    """
+    Group the fuzzing jobs that start with the same warmup.
+
+    Args:
+        jobs: Fuzzing jobs of an experiment.
+
+    Returns:
+        For every warmup shared by several jobs, the job running the warmup and the jobs
+        waiting for it.
+    """
+    groups: Dict[Tuple[Path, int, bool], List[Job]] = OrderedDict()
+    for job in jobs:
+        if job.stage == "fuzz" and job.fuzzer in warmup_fuzzers:
+            groups.setdefault((job.target, job.rng_seed, job.pass_by_file), []).append(job)
+    return [
+        (dataclasses.replace(group[0], stage="warmup"), group)
+        for group in groups.values()
+        if len(group) > 1
+    ]
@@ -0,0 +1,291 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Detection of stalled and straggling trials.
+
+A trial is flagged when, during its fuzzing time:
+  - none of its statistics files, queue or crashes folders changed for a while, e.g., because the
+    target hangs in the forkserver or the ML model of NEUZZ never comes up;
+  - its exec rate collapsed to a small share of its peak for a while;
+and, at any time, when it runs much longer than the configured fuzzing duration. The replay of
+the corpus after the fuzzing time is timed separately, based on the phases recorded by the
+run scripts in `phases.json`: its duration depends on the size of the corpus, not on the
+fuzzing duration.
+
+Flagged trials are killed and queued again, within a retry budget. Every intervention is
+recorded in `watchdog.jsonl` in the trial folder, along with the console output of the killed
+attempt.
+"""
+import json
+import os
+import shutil
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from mlfuzz.experiment import Job
+from mlfuzz.logs import move_log
+from mlfuzz.metrics import TrialStats
+from mlfuzz.runner import phases_file
+
+record_file_name = "watchdog.jsonl"
+
+# Exec rates are noisy while the fuzzer calibrates its seeds, ignore the first minutes
+_warmup_period = 300.0
+# Exec rates are only meaningful while the fuzzer keeps its statistics up to date
+_fresh_stats_age = 120.0
+
+
+@dataclass
+class _TrialState:
+    stats: TrialStats
+    started: float
+    last_progress: float
+    progress_marker: Tuple[float, ...]
+    peak_rate: float = 0.0
+    slow_since: Optional[float] = None
+    replay_started: Optional[float] = None
+
+
+class Watchdog:
+    """
+    Watch the progress of running trials and flag the ones that need to be restarted.
+
+    Args:
+        results_folder: Results folder of the experiment.
+        duration: Fuzzing time of the trials in seconds.
+        stall_timeout: Time in seconds without progress after which a trial is stalled.
+        min_exec_ratio: Share of its peak exec rate below which the throughput of a trial has
+            collapsed.
+        collapse_timeout: Time in seconds the throughput must stay collapsed to flag the trial.
+        max_runtime_factor: Multiple of `duration` after which a trial that did not start
+            replaying its corpus is a straggler.
+        max_replay_time: Time in seconds a trial may spend replaying its corpus, 0 for no limit.
+        max_retries: How often a trial is restarted before it is given up.
+    """
+
+    def __init__(
+        self,
+        results_folder: Path,
+        duration: float,
+        stall_timeout: float = 1800.0,
+        min_exec_ratio: float = 0.05,
+        collapse_timeout: float = 900.0,
+        max_runtime_factor: float = 2.0,
+        max_replay_time: float = 0.0,
+        max_retries: int = 2,
+    ) -> None:
+        self.results_folder = results_folder
+        self.duration = duration
+        self.stall_timeout = stall_timeout
+        self.min_exec_ratio = min_exec_ratio
+        self.collapse_timeout = collapse_timeout
+        self.max_runtime_factor = max_runtime_factor
+        self.max_replay_time = max_replay_time
+        self.max_retries = max_retries
+        self._trials: Dict[str, _TrialState] = {}
+        self._flagged: Dict[str, str] = {}
+
+    def check(self, running: Iterable[Job]) -> Dict[str, str]:
+        """
+        Check the progress of the running trials.
+
+        Args:
+            running: Jobs currently running.
+
+        Returns:
+            The reasons for flagging the trials that were newly flagged, indexed by job name.
+        """
+        now = time.time()
+        running_names = set()
+        flagged: Dict[str, str] = {}
+        for job in running:
+            name = job.name()
+            running_names.add(name)
+            if name in self._flagged:
+                continue
+            if name not in self._trials:
+                self._track(job, now, now)
+            reason = self._check_trial(self._trials[name], now)
+            if reason is not None:
+                self._flagged[name] = flagged[name] = reason
+        for name in list(self._trials):
+            if name not in running_names:
+                del self._trials[name]
+        return flagged
+
+    def adopt(self, job: Job, started: Optional[float]) -> None:
+        """
+        Track a trial launched by a previous run of the experiment.
+
+        Args:
+            job: Adopted job.
+            started: Launch time of the job, as recorded in the job ledger. Without it, the
+                trial is timed from its first check.
+        """
+        if started is not None:
+            self._track(job, started, time.time())
+
+    def intervention(self, name: str) -> Optional[str]:
+        """Return (and forget) the reason why a finished job was flagged, if it was."""
+        self._trials.pop(name, None)
+        return self._flagged.pop(name, None)
+
+    def retries(self, job: Job) -> int:
+        """Number of times the trial was already restarted by the watchdog."""
+        return len([record for record in self.records(job) if record.get("action") == "requeued"])
+
+    def records(self, job: Job) -> List[Dict]:
+        """Interventions recorded for a trial, oldest first."""
+        try:
+            with open(job.folder(self.results_folder) / record_file_name) as record_file:
+                return [json.loads(line) for line in record_file if line.strip()]
+        except (OSError, ValueError):
+            return []
+
+    def record(self, job: Job, reason: str, action: str) -> None:
+        """Record an intervention in the trial folder."""
+        job_folder = job.folder(self.results_folder)
+        stats = TrialStats(job_folder)
+        stats.update()
+        entry = {
+            "time": time.time(),
+            "job": job.name(),
+            "reason": reason,
+            "action": action,
+            "fuzzer_stats": stats.fuzzer_stats,
+            "plot_data": stats.plot_data,
+        }
+        os.makedirs(job_folder, exist_ok=True)
+        with open(job_folder / record_file_name, "a") as record_file:
+            record_file.write(json.dumps(entry) + "\n")
+
+    def reset_trial_folder(self, job: Job) -> None:
+        """
+        Empty the trial folder for a new attempt, keeping the watchdog records.
+
+        The console output of the killed attempt is kept as `watchdog-attempt-<n>.log`.
+        """
+        job_folder = job.folder(self.results_folder)
+        attempt = self.retries(job)
+        for log_file in (job_folder / "docker.log", job_folder / "default" / "docker.log"):
+            if log_file.exists():
+                move_log(log_file, job_folder / f"watchdog-attempt-{attempt}.log")
+        for entry in job_folder.iterdir():
+            if entry.name == record_file_name or entry.name.startswith("watchdog-attempt-"):
+                continue
+            if entry.is_dir() and not entry.is_symlink():
+                shutil.rmtree(entry, ignore_errors=True)
+            else:
+                entry.unlink()
+
+    def _track(self, job: Job, started: float, now: float) -> None:
+        stats = TrialStats(job.folder(self.results_folder))
+        self._trials[job.name()] = _TrialState(stats, started, now, self._progress_marker(stats))
+
+    def _check_trial(self, trial: _TrialState, now: float) -> Optional[str]:
+        runtime = now - trial.started
+        if runtime > self.duration and trial.replay_started is None:
+            trial.replay_started = self._replay_start(trial.stats.folder)
+        if trial.replay_started is not None:
+            replay_time = now - trial.replay_started
+            if 0 < self.max_replay_time < replay_time:
+                return f"straggler, replaying its corpus for {replay_time:.0f}s"
+            return None
+        if runtime > self.max_runtime_factor * self.duration:
+            return f"straggler, running for {runtime:.0f}s"
+        if runtime > self.duration:
+            return None  # Replaying the corpus, the fuzzer statistics do not change anymore
+
+        marker = self._progress_marker(trial.stats)
+        if marker != trial.progress_marker:
+            trial.progress_marker, trial.last_progress = marker, now
+        elif now - trial.last_progress > self.stall_timeout:
+            return f"stalled, no progress for {now - trial.last_progress:.0f}s"
+
+        trial.stats.update()
+        rate = trial.stats.get("plot_data", "execs_per_sec")
+        if rate is None:
+            rate = trial.stats.get("fuzzer_stats", "execs_per_sec")
+        if rate is None or now - marker[0] > _fresh_stats_age or runtime < _warmup_period:
+            trial.slow_since = None
+            return None
+        trial.peak_rate = max(trial.peak_rate, rate)
+        if rate >= self.min_exec_ratio * trial.peak_rate:
+            trial.slow_since = None
+        elif trial.slow_since is None:
+            trial.slow_since = now
+        elif now - trial.slow_since > self.collapse_timeout:
+            return (
+                f"throughput collapsed to {rate:.1f} execs/s (peak {trial.peak_rate:.1f}) "
+                f"for {now - trial.slow_since:.0f}s"
+            )
+        return None
+
+    @staticmethod
+    def _replay_start(folder: Path) -> Optional[float]:
+        # Start of the replay phase recorded by the run script, if it began
+        try:
+            with open(folder / phases_file) as phases:
+                record = json.load(phases)
+        except (OSError, ValueError):
+            return None
+        starts = [
+            phase["start"] for phase in record.get("phases", []) if phase["phase"] == "replay"
+        ]
+        return starts[-1] if starts else None
+
+    @staticmethod
+    def _progress_marker(stats: TrialStats) -> Tuple[float, ...]:
+        # Modification times of the files and folders a fuzzer updates while it makes progress,
+        # the newest one first
+        folder = stats.folder
+        times = []
+        for path in (
+            folder / "plot_data",
+            folder / "fuzzer_stats",
+            folder / "queue",
+            folder / "crashes",
+            folder,
+        ):
+            try:
+                times.append(os.stat(path).st_mtime)
+            except OSError:
+                times.append(0.0)
+        return (max(times), *times)
+
+
+def watchdog_from_config(config: Dict[str, Any]) -> Optional[Watchdog]:
+    """
+    Create the watchdog configured in an experiment configuration.
+
+    Args:
+        config: Experiment configuration, as read from `experiment_config.yaml`.
+
+    Returns:
+        The configured watchdog, or `None` if it is disabled.
+    """
+    if not config.get("watchdog", False):
+        return None
+    return Watchdog(
+        Path(config["results_folder"]),
+        config["duration"],
+        stall_timeout=config.get("watchdog_stall_timeout", 1800),
+        min_exec_ratio=config.get("watchdog_min_exec_ratio", 0.05),
+        collapse_timeout=config.get("watchdog_collapse_timeout", 900),
+        max_runtime_factor=config.get("watchdog_max_runtime_factor", 2.0),
+        max_replay_time=config.get("watchdog_max_replay_time", 0),
+        max_retries=config.get("watchdog_max_retries", 2),
+    )
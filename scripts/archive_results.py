@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+This script packs the finished trials of an experiment into a content-addressed archive
+(see `mlfuzz.archive`), where identical files of all trials are stored only once.
+
+The following structure is assumed about the experiment folder:
+
+  <exp_name>/<target>/<fuzzer>/trial-<index>/...
+
+Trials are archived under the name `<target>/<fuzzer>/trial-<index>`. Trials that are already
+archived are skipped, as well as trials with jobs still queued or running in the job ledger.
+With `--remove`, the trial folders are deleted once archived.
+"""
+import argparse
+import logging
+import shutil
+import sys
+from pathlib import Path
+from typing import Sequence
+
+from mlfuzz.archive import TrialArchive, archive_compressions
+from mlfuzz.ledger import JobLedger
+
+# Configure console logger
+logging.basicConfig(
+    stream=sys.stdout,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    level=logging.INFO,
+)
+logger = logging.getLogger("neuzzpp")
+
+
+def main(argv: Sequence[str] = tuple(sys.argv)) -> None:
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("results_folder", help="output folder from an experiment", type=str)
+    parser.add_argument(
+        "--archive", help="archive file, by default `<results_folder>.archive.sqlite`", type=str
+    )
+    parser.add_argument(
+        "--ledger", help="job ledger, by default `<results_folder>.jobs.sqlite`", type=str
+    )
+    parser.add_argument(
+        "--compression",
+        help="compression of new contents",
+        choices=archive_compressions,
+        default="zlib",
+    )
+    parser.add_argument(
+        "--remove", help="delete the trial folders once archived", action="store_true"
+    )
+    args = parser.parse_args(argv[1:])
+
+    results_folder = Path(args.results_folder)
+    archive_file = Path(args.archive or str(results_folder) + ".archive.sqlite")
+    ledger_file = Path(args.ledger or str(results_folder) + ".jobs.sqlite")
+    unfinished = set()
+    if ledger_file.exists():
+        ledger = JobLedger(ledger_file)
+        unfinished = ledger.unfinished_trials()
+        ledger.close()
+
+    total_bytes, stored_bytes, n_trials = 0, 0, 0
+    with TrialArchive(archive_file, compression=args.compression) as archive:
+        for trial_folder in sorted(results_folder.glob("*/*/trial-*")):
+            if not trial_folder.is_dir():
+                continue
+            target, fuzzer = trial_folder.parent.parent.name, trial_folder.parent.name
+            name = f"{target}/{fuzzer}/{trial_folder.name}"
+            trial = int(trial_folder.name.split("-")[-1])
+            if (target, fuzzer, trial) in unfinished:
+                logger.info(f"Skipping {name}: it is not finished.")
+                continue
+            if not archive.has_trial(name):
+                stats = archive.add_trial(name, trial_folder)
+                logger.info(
+                    f"Archived {name}: {stats.n_files} files, {stats.n_new_contents} new contents, "
+                    f"{stats.total_bytes / 2**20:.1f} MB stored in "
+                    f"{stats.stored_bytes / 2**20:.1f} MB."
+                )
+                total_bytes += stats.total_bytes
+                stored_bytes += stats.stored_bytes
+                n_trials += 1
+            if args.remove:
+                shutil.rmtree(trial_folder)
+    logger.info(
+        f"Archived {n_trials} trials: {total_bytes / 2**20:.1f} MB stored in "
+        f"{stored_bytes / 2**20:.1f} MB in {archive_file}."
+    )
+
+
+if __name__ == "__main__":
+    main()
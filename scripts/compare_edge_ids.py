@@ -15,6 +15,12 @@
 """
 This intersects the found edges from a fuzzing experiment folder.
 
+The edges of a trial are read from its edge table, `replayed_edges`, if its corpus was replayed
+with the same binary and arguments, and obtained by replaying its corpus otherwise. For each
+target, the edges of all trials are held as a (fuzzer, trial, edge) bit array, from which the
+number of edges found by both, either or only one of every pair of fuzzers, and by each fuzzer
+in at least k of its trials, are computed at once. Targets are processed one at a time.
+
 The following structure is assumed about the experiment folder:
 
   <exp_name>/<target>/<fuzzer>/trial-<index>/<fuzzer_output>
@@ -29,19 +35,25 @@ import argparse
 import logging
 import pathlib
 import sys
-from enum import Enum
-from typing import Dict, List, Optional, Sequence, Set
-
-from neuzzpp.preprocess import create_path_coverage_bitmap
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from mlfuzz.coverage_cache import CoverageCache, open_cache
+from mlfuzz.edge_table import (
+    edges_file_name,
+    load_edge_table,
+    min_row_bits,
+    pack_edges,
+    popcount,
+    row_bits_for,
+)
+from mlfuzz.replay import seed_edges
 
-# Define supported fuzzers - AFLPP based fuzzers for now only
-Fuzzer = Enum("Fuzzer", "AFLPP HAVOC NEUZZ NEUZZPP PREFUZZ")
-fuzzers = [
-    Fuzzer.AFLPP,
-    Fuzzer.NEUZZPP,
-    Fuzzer.NEUZZ,
-    Fuzzer.PREFUZZ,
-]
+# Fuzzers compared by default - AFLPP based fuzzers for now only
+default_fuzzers = ["AFLPP", "NEUZZPP", "NEUZZ", "PREFUZZ"]
 
 # Configure console logger
 logging.basicConfig(
@@ -52,59 +64,149 @@ logging.basicConfig(
 logger = logging.getLogger("neuzzpp")
 
 
-def get_edge_ids_for_corpus(corpus_path: pathlib.Path, target_with_args: List[str]) -> Set[int]:
+def get_edge_ids_for_corpus(
+    corpus_path: pathlib.Path,
+    target_with_args: List[str],
+    cache: Optional[CoverageCache] = None,
+) -> np.ndarray:
     """
-    Extracts a set of edge IDs that the given corpus triggers on the given target
+    Extracts the edge IDs that the given corpus triggers on the given target
 
     Args:
         corpus_path : The path to the corpus
         target_with_args : The target binary with arguments
+        cache : Coverage cache to look the seeds up in before replaying them
 
     Returns:
-        The set of triggered edge IDs.
+        The sorted triggered edge IDs.
     """
 
-    seed_list = [seed for seed in corpus_path.glob("id*")]
+    # Read the edges from the edge table of the replay, if it ran the same command
+    table = load_edge_table(corpus_path.parent / edges_file_name)
+    if table is not None and table.replayed_with(target_with_args):
+        return table.all_edges()
 
-    cov_bitmap: Dict[pathlib.Path, Optional[Set[int]]] = create_path_coverage_bitmap(
-        target_with_args, seed_list
-    )
-    all_edges = set.union(*cov_bitmap.values())
+    seed_list = sorted(corpus_path.glob("id*"))
+
+    covered = np.zeros(min_row_bits, dtype=bool)
+    for edges in seed_edges(seed_list, target_with_args, cache):
+        if edges is not None and edges.size:
+            if edges[-1] >= covered.size:
+                grow = row_bits_for(int(edges[-1])) - covered.size
+                covered = np.concatenate((covered, np.zeros(grow, dtype=bool)))
+            covered[edges] = True
+
+    return np.flatnonzero(covered)
+
+
+@dataclass
+class EdgeAlgebra:
+    """
+    Edges found by the fuzzers of a target, compared pairwise.
+
+    Rows and columns of the matrices follow `fuzzers`.
+    """
+
+    fuzzers: List[str]
+    n_trials: np.ndarray  # Trials of each fuzzer
+    intersections: np.ndarray  # Edges found by both fuzzers, in any of their trials
+    found_in: np.ndarray  # Column k: edges found by a fuzzer in at least k + 1 of its trials
+
+    @property
+    def sizes(self) -> np.ndarray:
+        """Edges found by each fuzzer."""
+        return np.diag(self.intersections)
+
+    @property
+    def unions(self) -> np.ndarray:
+        """Edges found by either fuzzer."""
+        return self.sizes[:, None] + self.sizes[None, :] - self.intersections
+
+    @property
+    def exclusives(self) -> np.ndarray:
+        """Edges found by the row fuzzer and not by the column fuzzer."""
+        return self.sizes[:, None] - self.intersections
+
+
+def edge_algebra(trials: Dict[str, List[np.ndarray]], chunk_bytes: int = 8192) -> EdgeAlgebra:
+    """
+    Compare the edges found by the trials of several fuzzers.
+
+    The edges are packed into a (fuzzer, trial, edge) bit array, processed in blocks of edges
+    to bound the memory taken by unpacked bits.
 
-    return all_edges
+    Args:
+        trials: Sorted edges found by each trial, by fuzzer.
+        chunk_bytes: Size of the blocks of edges in bytes, 8 edges per byte.
+
+    Returns:
+        The pairwise comparison of the fuzzers.
+    """
+    fuzzers = list(trials)
+    n_fuzzers = len(fuzzers)
+    n_trials = np.array([len(trials[fuzzer]) for fuzzer in fuzzers], dtype=np.int64)
+    max_trials = int(n_trials.max(initial=0))
+    max_edge = max(
+        (int(edges[-1]) for fuzzer in fuzzers for edges in trials[fuzzer] if edges.size),
+        default=0,
+    )
+    row_bytes = row_bits_for(max_edge) // 8
+    # Missing trials of fuzzers with fewer trials stay all-zero
+    bits = np.zeros((n_fuzzers, max_trials, row_bytes), dtype=np.uint8)
+    for index, fuzzer in enumerate(fuzzers):
+        for trial, edges in enumerate(trials[fuzzer]):
+            bits[index, trial] = pack_edges(edges, row_bytes)
+
+    intersections = np.zeros((n_fuzzers, n_fuzzers), dtype=np.int64)
+    # Histogram of the number of trials finding each edge, per fuzzer
+    histogram = np.zeros((n_fuzzers, max_trials + 1), dtype=np.int64)
+    offsets = np.arange(n_fuzzers)[:, None] * (max_trials + 1)
+    for first in range(0, row_bytes, chunk_bytes):
+        block = bits[:, :, first : first + chunk_bytes]
+        union = np.bitwise_or.reduce(block, axis=1)
+        intersections += popcount(union[:, None, :] & union[None, :, :]).astype(np.int64)
+        counts = np.unpackbits(block, axis=2, bitorder="little").sum(axis=1, dtype=np.int64)
+        histogram += np.bincount(
+            (counts + offsets).ravel(), minlength=n_fuzzers * (max_trials + 1)
+        ).reshape(n_fuzzers, max_trials + 1)
+    # Edges found in at least k trials, for k from 1 to the number of trials
+    found_in = np.cumsum(histogram[:, ::-1], axis=1)[:, ::-1][:, 1:]
+    return EdgeAlgebra(fuzzers, n_trials, intersections, found_in)
 
 
 def compute_edge_intersections_for_experiment(
-    experiments_folder: pathlib.Path, binaries_folder: pathlib.Path
-) -> Dict[str, Dict[Fuzzer, Dict[int, int]]]:
+    experiments_folder: pathlib.Path,
+    binaries_folder: pathlib.Path,
+    fuzzers: Sequence[str] = tuple(default_fuzzers),
+    cache: Optional[CoverageCache] = None,
+) -> Iterator[Tuple[str, EdgeAlgebra]]:
     """
-    Extract coverage information from an experiment into a Pandas dataframe.
+    Compare the edges found by the fuzzers of an experiment, one target at a time.
 
     Assumptions:
-      * Coverage files are called `replayed_plot_data`.
       * An experiment is structured as:
           <exp_name>/<target>/<fuzzer>/trial-<index>/<fuzzer_output>
         or
           <exp_name>/<target>/<fuzzer>/trial-<index>/default/<fuzzer_output>.
-      * The names of the plot data columns used for computations are "# relative_time"
-        and "edges_found".
+      * All corpora of a target are replayed on its AFL++ build, `<target>.aflpp`, so that
+        edge IDs are comparable across fuzzers.
 
     Args:
         experiments_folder: Experiment folder structured as specified above.
         binaries_folder: Path to fuzzing targets.
-    Returns
-        A dictionary of edge data per target.
+        fuzzers: Names of the fuzzers to compare, as in the experiment folder.
+        cache: Coverage cache of the seeds, if any.
+
+    Yields:
+        The name of each target and the comparison of its fuzzers.
     """
 
-    edges_per_target: Dict[str, Dict[Fuzzer, Dict[int, int]]] = {}
     # Walk folders and extract edge ids for each fuzzer and target
-    for target in experiments_folder.glob("*"):
-        cumulated_edges: Dict[Fuzzer, Dict[int, int]] = {}
+    for target in sorted(experiments_folder.glob("*")):
+        trials: Dict[str, List[np.ndarray]] = {}
         for fuzzer in fuzzers:
-            fuzzer_exp_path = target.joinpath(fuzzer.name)
-            cumulated_edges[fuzzer] = {}
-            trial_count = 0
-            for trial in fuzzer_exp_path.glob("trial-*"):
+            trials[fuzzer] = []
+            for trial in sorted(target.joinpath(fuzzer).glob("trial-*")):
                 corpus = list(trial.glob("**/queue"))
                 if len(corpus) != 1:
                     logger.warning(f"Unexpected folder structure in {trial.absolute()}")
@@ -114,58 +216,86 @@ def compute_edge_intersections_for_experiment(
 
                 logger.info(f"Investigating Corpus {corpus[0]} on {target_with_args}")
 
-                edge_ids = get_edge_ids_for_corpus(corpus[0], [str(target_with_args)])
-                trial_count += 1
-                for edge_id in edge_ids:
-                    if edge_id not in cumulated_edges[fuzzer]:
-                        cumulated_edges[fuzzer][edge_id] = 1  # seen edge for the first time
-                    else:
-                        cumulated_edges[fuzzer][edge_id] += 1  # increment edge counter
-            logger.info(f"Got {trial_count} trials for {fuzzer.name}!")
-
-        edges_per_target[target.name] = cumulated_edges
-
-    return edges_per_target
+                trials[fuzzer].append(
+                    get_edge_ids_for_corpus(corpus[0], [str(target_with_args)], cache)
+                )
+            logger.info(f"Got {len(trials[fuzzer])} trials for {fuzzer}!")
+
+        yield target.name, edge_algebra(trials)
+
+
+def print_edge_algebra(target: str, algebra: EdgeAlgebra) -> None:
+    """Print the pairwise comparison of the fuzzers of a target."""
+    names = algebra.fuzzers
+    print(f"\n## {target}\n")
+    for title, matrix in [
+        ("Edges found by both fuzzers", algebra.intersections),
+        ("Edges found by either fuzzer", algebra.unions),
+        ("Edges found by the row fuzzer only", algebra.exclusives),
+    ]:
+        print(f"{title}:")
+        print(pd.DataFrame(matrix, index=names, columns=names).to_string())
+        print()
+    columns = [f">={k}" for k in range(1, algebra.found_in.shape[1] + 1)]
+    print("Edges found in at least k trials:")
+    print(pd.DataFrame(algebra.found_in, index=names, columns=columns).to_string())
+
+
+def summary_row(target: str, algebra: EdgeAlgebra) -> str:
+    """Row of the comparison of AFL++, Neuzz++, NEUZZ and PreFuzz, as in the paper."""
+    aflpp, neuzzpp, neuzz, prefuzz = (
+        algebra.fuzzers.index(name) for name in ["AFLPP", "NEUZZPP", "NEUZZ", "PREFUZZ"]
+    )
+    sizes, unions, exclusives = algebra.sizes, algebra.unions, algebra.exclusives
+    return (
+        f"| {target} | {sizes[aflpp]} "
+        f"| {sizes[neuzzpp]} "
+        f"| {unions[aflpp, neuzzpp]} "
+        f"| {exclusives[aflpp, neuzzpp]} "
+        f"| {exclusives[neuzzpp, aflpp]} "
+        f"| {exclusives[neuzz, aflpp]} "
+        f"| {exclusives[prefuzz, aflpp]} "
+        f"| {exclusives[neuzz, neuzzpp]} "
+        f"| {exclusives[prefuzz, neuzzpp]} | "
+    )
 
 
 def main(argv: Sequence[str] = tuple(sys.argv)) -> None:
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument("results_folder", help="output folder from an experiment", type=str)
     parser.add_argument("binaries_folder", help="folder containing target binaries", type=str)
+    parser.add_argument(
+        "--fuzzers",
+        help="fuzzers to compare, as named in the results folder",
+        nargs="+",
+        default=default_fuzzers,
+    )
+    parser.add_argument(
+        "--coverage_cache", help="SQLite file caching the edges of seeds", type=str, default=None
+    )
     args = parser.parse_args(argv[1:])
 
-    edges_per_target = compute_edge_intersections_for_experiment(
+    summary = []
+    for target, algebra in compute_edge_intersections_for_experiment(
         pathlib.Path(args.results_folder).expanduser(),
         pathlib.Path(args.binaries_folder).expanduser(),
-    )
-
-    print(
-        "| Target | #Edges AFL++ | #Edges Neuzz++ | Union | AFL++ excl. "
-        "| Neuzz++ excl. | Neuzz - AFL++ | PreFuzz - AFL++ | Neuzz - Neuzz++ | PreFuzz - Neuzz++ | "
-    )
-    print("| --- | --- | --- | --- | --- | --- | --- | --- | --- | --- | ")
-
-    for target in edges_per_target.keys():
-
-        cumulated_edges = edges_per_target[target]
-        unified_edges = set(cumulated_edges[Fuzzer.AFLPP].keys()).union(
-            cumulated_edges[Fuzzer.NEUZZPP].keys()
-        )
-        aflpp_edges = cumulated_edges[Fuzzer.AFLPP].keys()
-        neuzpp_edges = cumulated_edges[Fuzzer.NEUZZPP].keys()
-
-        # Print intersection and subtractions
+        args.fuzzers,
+        open_cache(args.coverage_cache),
+    ):
+        print_edge_algebra(target, algebra)
+        if set(default_fuzzers) <= set(algebra.fuzzers):
+            summary.append(summary_row(target, algebra))
+
+    if summary:
+        print()
         print(
-            f"| {target} | {len(aflpp_edges)} "
-            f"| {len(neuzpp_edges)} "
-            f"| {len(unified_edges)} "
-            f"| {len(aflpp_edges - neuzpp_edges)} "
-            f"| {len(neuzpp_edges - aflpp_edges)} "
-            f"| {len(cumulated_edges[Fuzzer.NEUZZ].keys() - aflpp_edges)} "
-            f"| {len(cumulated_edges[Fuzzer.PREFUZZ].keys() - aflpp_edges)} "
-            f"| {len(cumulated_edges[Fuzzer.NEUZZ].keys() - neuzpp_edges)} "
-            f"| {len(cumulated_edges[Fuzzer.PREFUZZ].keys() - neuzpp_edges)} | "
+            "| Target | #Edges AFL++ | #Edges Neuzz++ | Union | AFL++ excl. "
+            "| Neuzz++ excl. | Neuzz - AFL++ | PreFuzz - AFL++ | Neuzz - Neuzz++ "
+            "| PreFuzz - Neuzz++ | "
         )
+        print("| --- | --- | --- | --- | --- | --- | --- | --- | --- | --- | ")
+        for row in summary:
+            print(row)
 
 
 if __name__ == "__main__":
@@ -16,20 +16,28 @@
 Script for computing the coverage obtained by machine learning seeds of fuzzers
 NEUZZ, NEUZZPP and PREFUZZ.
 
-The coverage is extracted from existing `replayed_plot_data` files of each run by matching
-seed names with obtained coverage based on timestamps.
+The coverage is read from the edge table of each run, `replayed_edges`, which records the
+edges of every seed by name. For runs without edge table, it is extracted from their
+`replayed_plot_data` by matching seed names with obtained coverage based on timestamps. With
+`--archive`, the trials are read from an archive written by `archive_results.py` instead of the
+results folder.
 """
 import argparse
+import io
 import logging
 import pathlib
 import sys
-from typing import Sequence
+import tempfile
+from typing import Iterator, List, Optional, Sequence, Tuple
 
 import numpy as np
 import pandas as pd
 
 from neuzzpp.utils import get_timestamp_millis_from_filename
 
+from mlfuzz.archive import TrialArchive
+from mlfuzz.edge_table import EdgeTable, edges_file_name, load_edge_table
+
 # Configure logger - console
 logger = logging.getLogger("neuzzpp")
 logger.setLevel(logging.INFO)
@@ -39,44 +47,105 @@ console_logger.setFormatter(log_formatter)
 logger.addHandler(console_logger)
 
 
+def trials_from_folder(
+    results_folder: pathlib.Path, target: str, fuzzer: str
+) -> Iterator[Tuple[io.BytesIO, List[str], Optional[EdgeTable]]]:
+    """Replayed coverage, seed names and edge table of the trials of a fuzzer on a target."""
+    for plot_data_file in (results_folder / target / fuzzer).glob("**/replayed_plot_data"):
+        seeds_path = plot_data_file.parent / "queue"
+        yield io.BytesIO(plot_data_file.read_bytes()), [
+            str(seed) for seed in seeds_path.glob("id*")
+        ], load_edge_table(plot_data_file.parent / edges_file_name)
+
+
+def trials_from_archive(
+    archive: TrialArchive, target: str, fuzzer: str
+) -> Iterator[Tuple[io.BytesIO, List[str], Optional[EdgeTable]]]:
+    """Same as `trials_from_folder`, for the trials archived by `archive_results.py`."""
+    for trial in archive.trials(f"{target}/{fuzzer}/*"):
+        for plot_data_file in archive.files(trial, "*replayed_plot_data"):
+            out_folder = plot_data_file.path[: -len("replayed_plot_data")]
+            seed_names = [
+                seed.path
+                for seed in archive.files(trial, f"{out_folder}queue/id*")
+                if "/" not in seed.path[len(f"{out_folder}queue/") :]
+            ]
+            # The edge table is memory-mapped, extract it while the trial is processed
+            with tempfile.TemporaryDirectory(prefix="edges-") as tmp_folder:
+                table = None
+                if archive.files(trial, f"{out_folder}{edges_file_name}"):
+                    edges_file = pathlib.Path(tmp_folder) / edges_file_name
+                    edges_file.write_bytes(archive.read(trial, f"{out_folder}{edges_file_name}"))
+                    table = load_edge_table(edges_file)
+                yield io.BytesIO(archive.read(trial, plot_data_file.path)), seed_names, table
+                del table  # Unmap the table before its file is removed
+
+
+def ml_coverage_from_table(table: EdgeTable, seed_pattern: str) -> int:
+    """Number of edges first covered by the seeds of a trial whose name contains a pattern."""
+    is_ml_seed = np.array([seed_pattern in name for name in table.seeds], dtype=bool)
+    return int(table.new_edges()[is_ml_seed].sum())
+
+
+def ml_coverage_from_plot(plot_data: io.BytesIO, seed_names: List[str], seed_pattern: str) -> float:
+    """Same as `ml_coverage_from_table`, from the replayed coverage of a trial."""
+    # Read replayed coverage
+    cov_data = pd.read_csv(plot_data, sep=", ", engine="python")
+
+    # Get seed names ordered like in the replay, by timestamp in filename, then by name
+    seed_list = sorted(
+        (name.split("/")[-1] for name in seed_names),
+        key=lambda name: (get_timestamp_millis_from_filename(name), name),
+    )
+
+    # Merge seed names and their coverage, then filter and sum for ML coverage
+    cov_data["seed"] = seed_list
+    # The first seed finds all of its edges
+    cov_data["cov_diff"] = cov_data.edges_found.diff().fillna(cov_data.edges_found)
+    cov_data = cov_data[cov_data["seed"].str.contains(seed_pattern, regex=False)]
+    return float(cov_data.cov_diff.sum())
+
+
 def main(argv: Sequence[str] = tuple(sys.argv)) -> None:
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument("results_folder", help="output folder from an experiment", type=str)
+    parser.add_argument(
+        "--archive", help="read the trials from this archive instead of the folder", type=str
+    )
     args = parser.parse_args(argv[1:])
 
+    archive = TrialArchive(pathlib.Path(args.archive)) if args.archive else None
+    if archive is not None:
+        pairs = sorted({tuple(name.split("/")[:2]) for name in archive.trials()})
+    else:
+        pairs = [
+            (target.name, fuzzer.name)
+            for target in pathlib.Path(args.results_folder).glob("*")
+            for fuzzer in target.glob("*")
+        ]
+
     res = {}
-    for target in pathlib.Path(args.results_folder).glob("*"):
-        for fuzzer in target.glob("*"):
-            # Choose seed name pattern based on fuzzer name
-            if fuzzer.name == "NEUZZPP":
-                seed_pattern = "ml-mutator"
-            elif fuzzer.name in ["NEUZZ", "PREFUZZ"]:
-                seed_pattern = "id_"
+    for target_name, fuzzer_name in pairs:
+        # Choose seed name pattern based on fuzzer name
+        if fuzzer_name == "NEUZZPP":
+            seed_pattern = "ml-mutator"
+        elif fuzzer_name in ["NEUZZ", "PREFUZZ"]:
+            seed_pattern = "id_"
+        else:
+            continue
+
+        if archive is not None:
+            trials = trials_from_archive(archive, target_name, fuzzer_name)
+        else:
+            trials = trials_from_folder(pathlib.Path(args.results_folder), target_name, fuzzer_name)
+        ml_cov: List[float] = []
+        for plot_data, seed_names, table in trials:
+            if table is not None:
+                ml_cov.append(ml_coverage_from_table(table, seed_pattern))
             else:
-                continue
-
-            ml_cov = []
-            for plot_data_file in fuzzer.glob("**/replayed_plot_data"):
-                trial_folder = plot_data_file.parent
-
-                # Read replayed coverage
-                cov_data = pd.read_csv(plot_data_file, sep=", ", engine="python")
-
-                # Get seeds list ordered by timestamp in filename
-                seeds_path = trial_folder / "queue"
-                seed_list = [seed for seed in seeds_path.glob("id*")]
-                seed_list = sorted(
-                    seed_list, key=lambda f: get_timestamp_millis_from_filename(f.name)
-                )
-
-                # Merge seed names and their coverage, then filter and sum for ML coverage
-                cov_data["seed"] = seed_list
-                cov_data["seed"] = cov_data["seed"].apply(lambda x: str(x))
-                cov_data["cov_diff"] = cov_data.edges_found.diff()
-                cov_data = cov_data[cov_data["seed"].str.contains(seed_pattern)]
-                ml_cov.append(cov_data.cov_diff.sum())
-
-                res[(target.name, fuzzer.name)] = (int(np.mean(ml_cov)), np.std(ml_cov))
+                ml_cov.append(ml_coverage_from_plot(plot_data, seed_names, seed_pattern))
+
+            res[(target_name, fuzzer_name)] = (int(np.mean(ml_cov)), np.std(ml_cov))
 
     cov_dict = {
         "index": list(res.keys()),
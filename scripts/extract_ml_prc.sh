@@ -11,4 +11,5 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-for d in */ ; do for file in ./$d/NEUZZPP/*/default/docker.log; do tac $file | grep -Pom1 'val_prc: (0.\d*)' | awk -F':' '{ print $2}' ;  done | awk -v d=$d '{s+=$1; count++} END {print d " | " s/count " | " count " trials " }'; done
+read_log="$(dirname "$0")/read_log.py"
+for d in */ ; do for file in ./$d/NEUZZPP/*/default/docker.log; do "$read_log" --reverse $file | grep -Pom1 'val_prc: (0.\d*)' | awk -F':' '{ print $2}' ;  done | awk -v d=$d '{s+=$1; count++} END {print d " | " s/count " | " count " trials " }'; done
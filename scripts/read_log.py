@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Script printing the console log of a trial, e.g., `docker.log`, including its rotated and
+compressed segments (`docker.log.1.gz`, ...).
+
+With `--reverse`, the lines are printed from the last one to the first one like `tac`, reading
+only as much of the log as the consumer needs.
+"""
+import argparse
+import os
+import pathlib
+import sys
+from typing import Sequence
+
+from mlfuzz.logs import LogReader
+
+
+def main(argv: Sequence[str] = tuple(sys.argv)) -> None:
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("log", help="path of the log, without segment suffix", type=str)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("-n", "--tail", help="only print the last lines", type=int)
+    group.add_argument("-r", "--reverse", help="print the lines in reverse", action="store_true")
+    args = parser.parse_args(argv[1:])
+
+    reader = LogReader(pathlib.Path(args.log))
+    out = sys.stdout.buffer
+    try:
+        if args.tail is not None:
+            for line in reader.tail(args.tail):
+                out.write(line + b"\n")
+        elif args.reverse:
+            for line in reader.reversed_lines():
+                out.write(line + b"\n")
+        else:
+            for chunk in reader.chunks():
+                out.write(chunk)
+        out.flush()
+    except BrokenPipeError:
+        # The consumer stopped reading, e.g., `grep -m1`, silence the flush at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+
+if __name__ == "__main__":
+    main()
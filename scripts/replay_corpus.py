@@ -15,16 +15,20 @@
 """
 Script for replaying an AFL++ corpus to an instrumented target binary in order to
 compute a plottable coverage data file.
+
+The seeds are replayed in batches, each through a single `afl-showmap` forkserver
+(see `mlfuzz.replay`). The replay continues from the checkpoint of an earlier replay into the
+same output file, if any. With `--live`, the corpus of a running fuzzer is replayed periodically
+until the script is stopped.
 """
 import argparse
 import logging
 import pathlib
-import subprocess
 import sys
-from typing import Set
+import time
 
-from neuzzpp.preprocess import CoverageBuilder
-from neuzzpp.utils import get_timestamp_millis_from_filename
+from mlfuzz.coverage_cache import open_cache
+from mlfuzz.replay import corpus_seeds, replay_seeds
 
 # Configure logger - console
 logger = logging.getLogger("neuzzpp")
@@ -37,6 +41,25 @@ logger.addHandler(console_logger)
 parser = argparse.ArgumentParser()
 parser.add_argument("input", help="path to input corpus", type=str)
 parser.add_argument("output", help="path and name of the output plot file", type=str)
+parser.add_argument(
+    "--batch_size", help="seeds replayed by each afl-showmap process", type=int, default=1000
+)
+parser.add_argument("--timeout", help="timeout of each execution in ms", type=int, default=1000)
+parser.add_argument(
+    "--coverage_cache", help="SQLite file caching the edges of seeds", type=str, default=None
+)
+parser.add_argument(
+    "--edges", help="path of the edge table of the seeds, if wanted", type=str, default=None
+)
+parser.add_argument(
+    "--restart", help="replay all seeds, ignoring earlier checkpoints", action="store_true"
+)
+parser.add_argument(
+    "--live",
+    help="replay the new seeds of a running fuzzer every LIVE seconds, until stopped",
+    type=float,
+    default=None,
+)
 parser.add_argument(
     "target",
     help="target program and arguments",
@@ -46,34 +69,28 @@ parser.add_argument(
 )
 args = parser.parse_args()
 
-target_with_args = args.target
-seeds_path = pathlib.Path(args.input)
-seed_list = [seed for seed in seeds_path.glob("*") if seed.is_file() and seed.name != ".cur_input"]
-# Order by timestamp in filename
-seed_list = sorted(seed_list, key=lambda f: get_timestamp_millis_from_filename(f.name))
-
-out_file = open(args.output, "w")
-out_file.write("# relative_time, edges_found\n")
-
-all_edges: Set[int] = set()
-out: bytes
-cov_tool = CoverageBuilder(target_with_args)
-
-for seed in seed_list:
-    try:
-        command = cov_tool.get_command_for_seed(seed)
-        out = subprocess.check_output(command)
-
-        edges_curr_seed: Set[int] = set()
-        for line in out.splitlines():
-            edge = int(line.split(b":")[0])
-            if edge not in all_edges:
-                all_edges.add(edge)
-        out_file.write(
-            f"{int(get_timestamp_millis_from_filename(seed.name) / 1000)}, {len(all_edges)}\n"
+queue = pathlib.Path(args.input)
+cache = open_cache(args.coverage_cache)
+resume = not args.restart
+while True:
+    if queue.is_dir():
+        seed_list = corpus_seeds(queue)
+        if args.live is not None:
+            # The fuzzer may still be writing its newest seeds
+            while seed_list and seed_list[-1].stat().st_mtime > time.time() - 1:
+                seed_list.pop()
+        n_edges = replay_seeds(
+            seed_list,
+            args.target,
+            pathlib.Path(args.output),
+            batch_size=args.batch_size,
+            cache=cache,
+            resume=resume,
+            edges_file=pathlib.Path(args.edges) if args.edges else None,
+            timeout_ms=args.timeout,
         )
-    except subprocess.CalledProcessError as err:
-        logger.error(f"Bitmap extraction failed: {err}")
-
-
-out_file.close()
+        logger.info(f"Replayed {len(seed_list)} seeds: {n_edges} edges.")
+        resume = True
+    if args.live is None:
+        break
+    time.sleep(args.live)
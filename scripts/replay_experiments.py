@@ -14,9 +14,9 @@
 # limitations under the License.
 """
 Script for replaying the corpora of multiple fuzzing trials to extract coverage information.
-For each trial, the coverage data will be written in its respective folder in `replayed_plot_data`.
+For each trial, the coverage data will be written in its respective folder in `replayed_plot_data`,
+and the edges of each seed in `replayed_edges`.
 
-The target binaries are searched in `/shared/binaries`.
 The following structure is assumed about the experiment folder:
 
   <exp_name>/<target>/<fuzzer>/trial-<index>/<fuzzer_output>
@@ -26,13 +26,37 @@ or
   <exp_name>/<target>/<fuzzer>/trial-<index>/default/<fuzzer_output>
 
 These are compatible with output from AFL, AFL++ and other fuzzers based on them.
+Each trial is replayed on the build of its target for its fuzzer (`<target>.aflpp` for fuzzers
+based on AFL++, `<target>.afl` otherwise) in `--binaries_folder`, by default the
+`binaries_folder` of `experiment_config.yaml`.
+
+Trials are replayed in parallel by `--n_jobs` worker processes, each pinned to its own core.
+Trials whose `replayed_plot_data` is newer than their queue are skipped, and the others continue
+from the checkpoint of their last replay, unless `--force` is set.
 """
 import argparse
+import concurrent.futures
 import logging
+import os
 import pathlib
-import subprocess
 import sys
-from typing import Sequence
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import yaml
+
+from mlfuzz.coverage_cache import open_cache
+from mlfuzz.edge_table import edges_file_name
+from mlfuzz.experiment import binary_name
+from mlfuzz.replay import (
+    ReplayCheckpoint,
+    checkpoint_path,
+    corpus_seeds,
+    plot_file_name,
+    replay_seeds,
+)
+from mlfuzz.topology import CoreAllocator, CpuTopology, parse_cpu_list
 
 # Configure console logger
 logging.basicConfig(
@@ -43,34 +67,179 @@ logging.basicConfig(
 logger = logging.getLogger("neuzzpp")
 
 
+@dataclass
+class Trial:
+    """Trial to replay."""
+
+    output_folder: pathlib.Path  # Folder with the `queue` of the fuzzer
+    binary: pathlib.Path
+    n_seeds: int  # Seeds left to replay
+
+
+def is_up_to_date(output_folder: pathlib.Path) -> bool:
+    """Whether the replayed coverage and edges of a trial are newer than its queue."""
+    plot_file = output_folder / plot_file_name
+    if not plot_file.exists() or not (output_folder / edges_file_name).exists():
+        return False
+    queue = output_folder / "queue"
+    newest = max([queue.stat().st_mtime] + [seed.stat().st_mtime for seed in queue.iterdir()])
+    return plot_file.stat().st_mtime >= newest
+
+
+def find_trials(
+    results_folder: pathlib.Path, binaries_folder: pathlib.Path, force: bool
+) -> List[Trial]:
+    """Trials of an experiment that need to be replayed, largest first."""
+    trials = []
+    for target in sorted(results_folder.glob("*")):
+        for plot_data in sorted(target.glob("**/plot_data")):
+            output_folder = plot_data.parent
+            if not (output_folder / "queue").is_dir():
+                continue
+            if not force and is_up_to_date(output_folder):
+                continue
+            fuzzer = output_folder.relative_to(target).parts[0]
+            binary = binaries_folder / binary_name(target.name, fuzzer)
+            n_seeds = len(corpus_seeds(output_folder / "queue"))
+            if not force:
+                # Interrupted or outdated replays continue from their checkpoint
+                checkpoint = ReplayCheckpoint.load(checkpoint_path(output_folder / plot_file_name))
+                if checkpoint is not None:
+                    n_seeds = max(n_seeds - checkpoint.n_seeds, 0)
+            trials.append(Trial(output_folder, binary, n_seeds))
+    # Start with the longest replays, so that the last ones do not keep the end busy
+    return sorted(trials, key=lambda trial: trial.n_seeds, reverse=True)
+
+
+def replay_trial(
+    trial: Trial,
+    cpu: Optional[int],
+    batch_size: int,
+    timeout_ms: int,
+    coverage_cache: Optional[str] = None,
+    resume: bool = True,
+) -> int:
+    """Replay one trial in a worker process, on the given CPU."""
+    if cpu is not None:
+        os.sched_setaffinity(0, {cpu})  # Inherited by afl-showmap and the target
+    seeds = corpus_seeds(trial.output_folder / "queue")
+    return replay_seeds(
+        seeds,
+        [str(trial.binary)],
+        trial.output_folder / plot_file_name,
+        cache=open_cache(coverage_cache),
+        resume=resume,
+        edges_file=trial.output_folder / edges_file_name,
+        batch_size=batch_size,
+        timeout_ms=timeout_ms,
+    )
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
 def main(argv: Sequence[str] = tuple(sys.argv)) -> None:
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument("results_folder", help="output folder from an experiment", type=str)
+    parser.add_argument(
+        "--binaries_folder",
+        help="folder of the target binaries, by default from experiment_config.yaml",
+        type=str,
+    )
+    parser.add_argument(
+        "-j", "--n_jobs", help="number of trials replayed in parallel", type=int, default=1
+    )
+    parser.add_argument(
+        "--cpus",
+        help="logical CPUs to pin the replays to, e.g., `0-7,16`, by default all usable CPUs",
+        type=str,
+    )
+    parser.add_argument("--no_pinning", help="do not pin the replays to CPUs", action="store_true")
+    parser.add_argument(
+        "--batch_size", help="seeds replayed by each afl-showmap process", type=int, default=1000
+    )
+    parser.add_argument("--timeout", help="timeout of each execution in ms", type=int, default=1000)
+    parser.add_argument(
+        "--coverage_cache", help="SQLite file caching the edges of seeds", type=str, default=None
+    )
+    parser.add_argument(
+        "--force",
+        help="replay all trials from scratch, even with up-to-date coverage or a checkpoint",
+        action="store_true",
+    )
     args = parser.parse_args(argv[1:])
 
-    binaries_folder = pathlib.Path("/shared/binaries")
-    scripts_folder = pathlib.Path(__file__).parent.resolve()
+    binaries_folder = args.binaries_folder
+    if binaries_folder is None:
+        config_file = pathlib.Path(__file__).parent / "experiment_config.yaml"
+        if not config_file.exists():
+            parser.error("--binaries_folder is required without experiment_config.yaml")
+        with open(config_file, "r") as conf_file:
+            binaries_folder = yaml.load(conf_file, Loader=yaml.FullLoader)["binaries_folder"]
+
+    trials = find_trials(
+        pathlib.Path(args.results_folder), pathlib.Path(binaries_folder), args.force
+    )
+    total_seeds = sum(trial.n_seeds for trial in trials)
+    logger.info(f"{len(trials)} trials with {total_seeds} seeds to replay.")
 
-    for target in pathlib.Path(args.results_folder).glob("*"):
-        target_path = binaries_folder / (target.name + ".afl")
-        for trial in target.glob("**/plot_data"):
-            trial_results_folder = trial.parent
-            out_file = trial_results_folder / "replayed_plot_data"
+    cpus = parse_cpu_list(args.cpus) if args.cpus else sorted(os.sched_getaffinity(0))
+    allocator = CoreAllocator(CpuTopology.read(), cpus, max_jobs=args.n_jobs)
+    n_workers = min(args.n_jobs, allocator.available()) if not args.no_pinning else args.n_jobs
+    if trials and n_workers < args.n_jobs:
+        logger.warning(f"Only {n_workers} physical cores available for replays.")
 
-            # Run corpus replay for one trial
-            if not out_file.exists():
-                print(out_file)
+    start = time.time()
+    done_seeds, n_done, n_failed = 0, 0, 0
+    pending = list(trials)
+    running: Dict[concurrent.futures.Future, Trial] = {}
+    cpu_of: Dict[concurrent.futures.Future, Optional[int]] = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max(n_workers, 1)) as pool:
+        while pending or running:
+            while pending and len(running) < max(n_workers, 1):
+                cpu = None if args.no_pinning else allocator.allocate()
+                trial = pending.pop(0)
+                future = pool.submit(
+                    replay_trial,
+                    trial,
+                    cpu,
+                    args.batch_size,
+                    args.timeout,
+                    args.coverage_cache,
+                    not args.force,
+                )
+                running[future] = trial
+                cpu_of[future] = cpu
+            finished, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in finished:
+                trial = running.pop(future)
+                cpu = cpu_of.pop(future)
+                if cpu is not None:
+                    allocator.release(cpu)
+                n_done += 1
+                done_seeds += trial.n_seeds
                 try:
-                    subprocess.run(
-                        [
-                            scripts_folder / "replay_corpus.py",
-                            trial_results_folder / "queue",
-                            out_file,
-                            target_path,
-                        ]
-                    )
-                except subprocess.CalledProcessError as err:
-                    logger.warning(f"{err.output}. Skipping trial.")
+                    n_edges = future.result()
+                    status = f"{n_edges} edges,"
+                except Exception as err:
+                    n_failed += 1
+                    status = f"failed ({err}), skipped,"
+                elapsed = time.time() - start
+                eta = elapsed / done_seeds * (total_seeds - done_seeds) if done_seeds else 0
+                logger.info(
+                    f"[{n_done}/{len(trials)}] {trial.output_folder}: {status} "
+                    f"{100 * done_seeds / max(total_seeds, 1):.0f}% of the seeds replayed, "
+                    f"ETA {format_duration(eta)}."
+                )
+    logger.info(
+        f"Replayed {n_done - n_failed} trials in {format_duration(time.time() - start)}, "
+        f"{n_failed} failed."
+    )
 
 
 if __name__ == "__main__":
@@ -16,24 +16,47 @@
 
   - The following fuzzers are supported: AFL, AFL++, PreFuzz, original Neuzz based on AFL,
     Neuzz++ based on AFL++, Havoc MAB, MOPT, MOPT++, and Darwin.
-  - The experiments are queued and distributed on cores.
+  - The experiments are queued and distributed on cores. All free cores (and GPUs) are filled
+    at once, and container exits are detected from the Docker event stream.
+  - The state of every job is recorded in a ledger next to the results folder. When the script
+    is restarted, finished jobs are skipped and jobs still running are adopted.
+  - Jobs run in Docker containers by default. The `native` backend runs them as host processes
+    instead, on hosts providing the same fuzzer installation as the `mlfuzz` image.
+  - An optional watchdog kills and requeues trials that stall, whose exec rate collapses, or
+    that run far longer than configured.
+  - Optionally, the AFL warmup shared by NEUZZ and PreFuzz trials runs once per target and
+    seed, and is cached for the trials of both fuzzers.
+  - Optionally, the replay, coverage summary and crash triage of each trial run as separate
+    post-processing jobs, on the cores left free by fuzzing jobs.
+  - With `--serve HOST:PORT`, the jobs are served to workers on several hosts instead
+    (see `run_worker.py`).
   - The specification of the experiment is done in `experiment_config.yaml`
     (see default values in `experiment_config.yaml.default`).
   - Machine learning jobs can be run with GPU support (deactivated by default). If activated,
     only ML jobs will use GPUs.
 """
+import argparse
 import logging
 import os
-import subprocess
+import shutil
 import sys
-import time
-from dataclasses import dataclass
-from enum import Enum
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional
 
 import yaml
 
+from mlfuzz.backends import backend_from_config
+from mlfuzz.costs import cost_model_from_config, order_jobs
+from mlfuzz.distributed import Coordinator, parse_address
+from mlfuzz.experiment import Job, jobs_from_config
+from mlfuzz.ledger import JobLedger, JobState
+from mlfuzz.metrics import MetricsExporter, MetricsSnapshot
+from mlfuzz.scheduler import scheduler_from_config
+from mlfuzz.scratch import in_scratch
+from mlfuzz.stages import discard, is_done, stage_graph_from_config
+from mlfuzz.warmup import shared_warmups
+from mlfuzz.watchdog import watchdog_from_config
+
 # Configure console logger
 logging.basicConfig(
     stream=sys.stdout,
@@ -42,126 +65,22 @@ logging.basicConfig(
 )
 logger = logging.getLogger("neuzzpp")
 
+parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument(
+    "--serve",
+    type=str,
+    default=None,
+    help="Serve the jobs to workers on HOST:PORT instead of running them locally. "
+    "Workers are started on every host with `run_worker.py HOST:PORT`.",
+)
+args = parser.parse_args()
+
 # Read experiment configuration
 with open(Path(__file__).parent / "experiment_config.yaml", "r") as conf_file:
     config = yaml.load(conf_file, Loader=yaml.FullLoader)
-binaries_folder = Path(config["binaries_folder"])
 seeds_folder = Path(config["seeds_folder"])
 results_folder = Path(config["results_folder"])
 
-# Define supported fuzzers
-Fuzzer = Enum("Fuzzer", "AFL AFLPP HAVOC NEUZZ NEUZZPP PREFUZZ DARWIN MOPT MOPTPP")
-fuzzers = list(map(lambda fuzzer_name: Fuzzer[fuzzer_name.upper()], config["fuzzers"]))
-
-# Define CPU and GPU range
-free_cpus = set(range(config["n_cpus"]))
-free_gpus = set(range(config["n_gpus"]))
-
-
-@dataclass
-class Job:
-    """Class keeping track of jobs / experiments to launch."""
-
-    target: Path
-    fuzzer: str
-    trial: int
-    rng_seed: int
-    pass_by_file: bool
-
-    def name(self) -> str:
-        if self.pass_by_file:
-            return f"{self.target.name}_{self.fuzzer}_slow_trial-{self.trial}"
-
-        return f"{self.target.name}_{self.fuzzer}_trial-{self.trial}"
-
-
-@dataclass
-class JobAssignment:
-    """Class keeping track of assignment of jobs to CPUs/GPUs."""
-
-    job: Job
-    core_id: int
-    gpu_id: Optional[int]
-
-    def command(self) -> str:
-        cmd = (
-            f"docker run -d -u $(id -u):$(id -g) --name {self.job.name()} "
-            f"-v {binaries_folder}:{binaries_folder} "
-            f"-v {seeds_folder}:{seeds_folder} "
-            f"-v {results_folder}:{results_folder} "
-            f'--cpuset-cpus "{self.core_id}" '
-        )
-        if self.gpu_id is not None:
-            cmd += f"--gpus '\"device={self.gpu_id}\"' "
-        cmd += config["docker_image"] + " python "
-        if self.job.fuzzer == Fuzzer.AFLPP.name:
-            cmd += "/aflpp/run_aflpp.py "
-        elif self.job.fuzzer == Fuzzer.NEUZZPP.name:
-            cmd += "/neuzzpp/run_neuzzpp.py "
-        elif self.job.fuzzer == Fuzzer.AFL.name:
-            cmd += "/afl/run_afl.py "
-        elif self.job.fuzzer == Fuzzer.HAVOC.name:
-            cmd += "/havoc/run_havoc.py "
-        elif self.job.fuzzer == Fuzzer.NEUZZ.name:
-            cmd += "/neuzz/run_neuzz.py "
-        elif self.job.fuzzer == Fuzzer.PREFUZZ.name:
-            cmd += "/prefuzz/run_prefuzz.py "
-        elif self.job.fuzzer == Fuzzer.DARWIN.name:
-            cmd += "/darwin/run_darwin.py "
-        elif self.job.fuzzer == Fuzzer.MOPT.name:
-            cmd += "/mopt/run_mopt.py "
-        elif self.job.fuzzer == Fuzzer.MOPTPP.name:
-            cmd += "/moptpp/run_moptpp.py "
-        else:
-            raise ValueError(f"Unknown fuzzer: {self.job.fuzzer}.")
-        cmd += (
-            f"{seeds_folder / self.job.target.stem} "
-            f"{results_folder / self.job.target.stem / self.job.fuzzer}/trial-{self.job.trial} "
-            f"{self.job.target} -d {config['duration']} -s {self.job.rng_seed} "
-        )
-        if self.job.pass_by_file:
-            cmd += "--pass_by_file"
-
-        return cmd
-
-
-def get_targets(
-    path: Path, targets: List[str], fuzzers: List[Fuzzer]
-) -> Tuple[Optional[List[Path]], Optional[List[Path]]]:
-    """
-    Read the list of targets for fuzzing from a given folder, then split them according to
-    their compilation options (detected via target extension).
-
-    Args:
-        path: Folder containing the compiled binaries to fuzz.
-        targets: List of target names without extension.
-        fuzzers: List of fuzzers specified for the current experiment.
-
-    Returns:
-        Two lists of targets, one with targets built for AFL, the other for AFL++.
-        If any of the two types of targets are not required for the experiment, the corresponding
-        list will be `None`.
-    """
-    targets_afl, targets_aflpp = None, None
-    if (
-        Fuzzer.AFL in fuzzers
-        or Fuzzer.NEUZZ in fuzzers
-        or Fuzzer.PREFUZZ in fuzzers
-        or Fuzzer.HAVOC in fuzzers
-        or Fuzzer.DARWIN in fuzzers
-        or Fuzzer.MOPT in fuzzers
-    ):
-        targets_afl = [path / (target + ".afl") for target in targets]
-
-    if Fuzzer.AFLPP in fuzzers or Fuzzer.NEUZZPP in fuzzers or Fuzzer.MOPTPP in fuzzers:
-        targets_aflpp = [path / (target + ".aflpp") for target in targets]
-
-    return targets_afl, targets_aflpp
-
-
-# Get targets for experiment
-targets_afl, targets_aflpp = get_targets(binaries_folder, config["targets"], fuzzers)
-
 # Create empty seeds for targets that do not have any
 for target_name in config["targets"]:
     os.makedirs(seeds_folder / target_name, exist_ok=True)
@@ -170,97 +89,273 @@ for target_name in config["targets"]:
             seed_handle.write("hi")  # Default seed from Fuzzbench
 
 # Create jobs
-jobs = []
-for fuzzer in fuzzers:
-    if fuzzer in (Fuzzer.AFLPP, Fuzzer.NEUZZPP, Fuzzer.MOPTPP):
-        current_targets = targets_aflpp
-    else:
-        current_targets = targets_afl
-
-    if current_targets is not None:
-        for target in current_targets:
-            for trial, rng_seed in enumerate(config["rng_seeds"][: config["n_trials"]]):
-                jobs.append(
-                    Job(
-                        target=target,
-                        fuzzer=fuzzer.name,
-                        trial=trial,
-                        rng_seed=rng_seed,
-                        pass_by_file=config["pass_by_file"],
-                    )
-                )
+jobs = jobs_from_config(config)
 logger.info(f"{len(jobs)} jobs to create.")
 
-# Launch jobs
-running: List[JobAssignment] = []
-while jobs or running:
-    # Check finished jobs
-    finished: List[Job] = []
-    for current in running:
-        code = subprocess.call(
-            f"docker ps -a | grep {current.job.name()} | grep Exited",
-            shell=True,
+ledger_file = config.get("ledger_file") or str(results_folder) + ".jobs.sqlite"
+os.makedirs(Path(ledger_file).parent, exist_ok=True)
+ledger = JobLedger(Path(ledger_file))
+try:
+    ledger.bind(results_folder, config["duration"])
+except ValueError as err:
+    # Its jobs would be skipped or adopted instead of being run
+    logger.error(f"{err} Use another `ledger_file` for this experiment.")
+    sys.exit(1)
+ledger.register(jobs)
+
+# Post-processing stages of the trials, run as separate jobs after fuzzing
+stage_graph = stage_graph_from_config(config) if args.serve is None else None
+if stage_graph is not None:
+    ledger.register([stage_job for job in jobs for stage_job in stage_graph.jobs(job)])
+elif config.get("post_processing"):
+    logger.warning("post_processing is ignored with --serve: fuzzing jobs replay their corpus.")
+
+# Warmups shared by NEUZZ and PreFuzz trials, run once as separate jobs before the trials
+warmup_cache = Path(config["warmup_cache"]) if config.get("warmup_cache") else None
+warmups = shared_warmups(jobs) if warmup_cache is not None and args.serve is None else []
+ledger.register([warmup_job for warmup_job, _ in warmups])
+
+# Edges of seeds shared by the replays of all trials
+coverage_cache = Path(config["coverage_cache"]) if config.get("coverage_cache") else None
+if coverage_cache is not None:
+    os.makedirs(coverage_cache.parent, exist_ok=True)
+
+# Order the jobs, e.g., to start the longest ones first
+jobs = order_jobs(jobs, config.get("job_order", "fifo"), cost_model_from_config(config, ledger))
+
+
+def job_command(job: Job) -> List[str]:
+    command = job.command(
+        seeds_folder,
+        results_folder,
+        config["duration"],
+        skip_replay=stage_graph is not None and "replay" in stage_graph,
+        warmup_cache=warmup_cache,
+        coverage_cache=coverage_cache,
+        live_replay=config.get("live_replay", 0),
+    )
+    if config.get("scratch", False) and job.stage == "fuzz":
+        # Fuzz into the tmpfs of the container, or into the working directory of native jobs
+        command = in_scratch(
+            command,
+            job.folder(results_folder),
+            "/scratch" if config.get("backend", "docker") == "docker" else "scratch",
+            config.get("scratch_sync_interval", 60),
         )
-        if code == 0:
-            logger.info(f"{current.job.name()} finished.")
-            running.remove(current)
-            finished.append(current.job)
-            free_cpus.add(current.core_id)
-            if current.gpu_id is not None:
-                free_gpus.add(current.gpu_id)
-
-    # Clean-up finished jobs
-    for job in finished:
-        # Save Docker log
-        job_name = job.name()
-        logs = subprocess.check_output(["docker", "logs", job_name])
-        job_folder = results_folder / job.target.stem / job.fuzzer / ("trial-" + str(job.trial))
-        out_folder = job_folder / "default" if (job_folder / "default").is_dir() else job_folder
-        with open(out_folder / "docker.log", "w") as log_file:
-            log_file.write(logs.decode("utf-8"))
-
-        # Check exit code
-        exitcode = subprocess.check_output(
-            ["docker", "inspect", job_name, "--format='{{.State.ExitCode}}'"], encoding="utf-8"
-        ).strip("'\n")
-        if int(exitcode) == 0:
-            rm_ok = subprocess.call(["docker", "rm", job_name])
-            if rm_ok != 0:
-                logger.warning(f"{job_name}: Docker rm failed with exit code {rm_ok}.")
-        else:
-            logger.warning(f"{job_name}: container exited with code {exitcode}.")
-
-    # No more jobs or no more CPU/GPU, wait for someone to finish
-    if not jobs or not free_cpus or (config["use_gpu"] and not free_gpus):
-        time.sleep(10)
-        continue
-
-    # Launch one new job
-    job = jobs.pop(0)
+    return command
+
+
+exporter: Optional[MetricsExporter] = None
+if args.serve is not None:
+    # Serve the jobs to workers on other hosts instead of running them locally
+    coordinator = Coordinator(
+        jobs,
+        ledger,
+        results_folder,
+        job_command,
+        rerun_failed=config.get("rerun_failed", False),
+        heartbeat_timeout=config.get("heartbeat_timeout", 300),
+    )
+    if config.get("metrics_address"):
+        exporter = MetricsExporter(results_folder, coordinator.running_jobs, coordinator.gauges)
+        exporter.start(parse_address(config["metrics_address"]))
+    coordinator.run(parse_address(args.serve))
+    if exporter is not None:
+        exporter.stop()
+    ledger.close()
+    logger.info("All jobs finished. Exiting.")
+    sys.exit(0)
+
+# Resume the experiment from its job ledger: skip finished jobs and adopt running ones
+backend = backend_from_config(config)
+backend.start()
+scheduler = scheduler_from_config(backend, config)
+watchdog = watchdog_from_config(config)
+queued: List[Job] = []
+post_jobs: List[Job] = []  # Post-processing jobs ready to run, after all fuzzing jobs
+for job in jobs:
     job_name = job.name()
-    core_id = free_cpus.pop()
-    if config["use_gpu"] and job.fuzzer in [
-        Fuzzer.NEUZZ.name,
-        Fuzzer.NEUZZPP.name,
-        Fuzzer.PREFUZZ.name,
-    ]:
-        gpu_id = free_gpus.pop()
-        new_job = JobAssignment(job, core_id, gpu_id)
-    else:
-        new_job = JobAssignment(job, core_id, None)
-    job_folder = results_folder / job.target.stem / job.fuzzer / ("trial-" + str(job.trial))
-    try:
-        os.makedirs(job_folder, exist_ok=True)
-    except OSError:
-        logger.warning(f"Failed to create output folder {job_folder}. Skipping job.")
+    entry = ledger.get(job_name)
+    assert entry is not None
+    if entry.state == JobState.FINISHED:
         continue
+    if entry.state == JobState.FAILED and not config.get("rerun_failed", False):
+        logger.warning(f"{job_name} failed in a previous run with exit code {entry.exit_code}.")
+        continue
+    if entry.state == JobState.RUNNING:
+        if entry.handle is not None and scheduler.adopt(
+            job, entry.core_id, entry.gpu_id, entry.handle
+        ):
+            if watchdog is not None:
+                # Keep timing the trial from its actual launch
+                watchdog.adopt(job, entry.start_time)
+            continue
+        logger.warning(f"{job_name} was lost. Running it again.")
+    if entry.state != JobState.QUEUED:
+        # Discard what is left of the previous attempt
+        backend.cleanup(job_name)
+        shutil.rmtree(job.folder(results_folder), ignore_errors=True)
+        ledger.mark_queued(job_name)
+        if stage_graph is not None:
+            for stage_job in stage_graph.jobs(job):
+                ledger.mark_queued(stage_job.name())
+    queued.append(job)
+if stage_graph is not None:
+    for job in jobs:
+        for stage_job in stage_graph.jobs(job):
+            job_name = stage_job.name()
+            entry = ledger.get(job_name)
+            assert entry is not None
+            if entry.state == JobState.FINISHED:
+                continue
+            if entry.state == JobState.FAILED and not config.get("rerun_failed", False):
+                logger.warning(
+                    f"{job_name} failed in a previous run with exit code {entry.exit_code}."
+                )
+                continue
+            if entry.state == JobState.RUNNING:
+                if entry.handle is not None and scheduler.adopt(
+                    stage_job, entry.core_id, entry.gpu_id, entry.handle
+                ):
+                    continue
+                logger.warning(f"{job_name} was lost. Running it again.")
+            if entry.state != JobState.QUEUED:
+                backend.cleanup(job_name)
+                discard(stage_job, results_folder)
+                ledger.mark_queued(job_name)
+            predecessor = stage_graph.predecessor(stage_job)
+            assert predecessor is not None
+            predecessor_entry = ledger.get(predecessor.name())
+            if predecessor_entry is None or predecessor_entry.state != JobState.FINISHED:
+                continue  # Queued once its predecessor finished
+            if is_done(stage_job, results_folder):
+                ledger.mark_finished(job_name, 0)
+            else:
+                post_jobs.append(stage_job)
+n_adopted = len([job for job in scheduler.running.values() if job.job.stage == "fuzz"])
+logger.info(
+    f"{len(jobs) - len(queued) - n_adopted} jobs done in previous runs, "
+    f"{n_adopted} adopted, {len(queued)} to run."
+)
+if post_jobs:
+    logger.info(f"{len(post_jobs)} post-processing jobs of finished trials to run.")
+
+# Hold back the trials sharing a warmup until their warmup job finished
+held: Dict[str, List[Job]] = {}  # Trials waiting for each warmup job
+warmup_jobs: List[Job] = []
+for warmup_job, trials in warmups:
+    waiting = [job for job in trials if job in queued]
+    job_name = warmup_job.name()
+    entry = ledger.get(job_name)
+    assert entry is not None
+    if not waiting or entry.state in (JobState.FINISHED, JobState.FAILED):
+        continue  # Trials without a successful warmup job warm up themselves
+    held[job_name] = waiting
+    queued = [job for job in queued if job not in waiting]
+    if entry.state == JobState.RUNNING:
+        if entry.handle is not None and scheduler.adopt(
+            warmup_job, entry.core_id, entry.gpu_id, entry.handle
+        ):
+            continue
+        logger.warning(f"{job_name} was lost. Running it again.")
+    if entry.state != JobState.QUEUED:
+        backend.cleanup(job_name)
+        ledger.mark_queued(job_name)
+    warmup_jobs.append(warmup_job)
+if held:
+    logger.info(f"{len(held)} warmups to run for {sum(map(len, held.values()))} trials.")
+jobs = warmup_jobs + queued
+
+
+def release_successors(job: Job) -> None:
+    """Queue the post-processing jobs of a trial that can start once `job` finished."""
+    assert stage_graph is not None
+    for successor in stage_graph.successors(job):
+        if is_done(successor, results_folder):
+            logger.info(f"{successor.name()} was already done. Skipping it.")
+            ledger.mark_finished(successor.name(), 0)
+            release_successors(successor)
+        else:
+            post_jobs.append(successor)
+
+
+# Expose the progress of running trials for monitoring
+metrics: Optional[MetricsSnapshot] = None
+if config.get("metrics_address"):
+    metrics = MetricsSnapshot()
+    exporter = MetricsExporter(results_folder, metrics.trials, metrics.gauges)
+    exporter.start(parse_address(config["metrics_address"]))
+
+# Launch jobs and track them
+while jobs or post_jobs or scheduler.running:
+    # Fill all free CPUs and GPUs with pending jobs. Post-processing jobs have a lower priority:
+    # they only get the cores left free by fuzzing jobs.
+    for assignment, handle in scheduler.fill(jobs, job_command) + scheduler.fill(
+        post_jobs, job_command
+    ):
+        ledger.mark_running(assignment, handle)
+    if metrics is not None:
+        # The scheduler is only read here, never from the threads of the exporter
+        metrics.publish(
+            [
+                assignment.job
+                for assignment in scheduler.running.values()
+                if assignment.job.stage == "fuzz"
+            ],
+            {
+                **scheduler.gauges(),
+                "mlfuzz_queued_jobs": float(len(jobs) + sum(map(len, held.values()))),
+                "mlfuzz_queued_post_processing_jobs": float(len(post_jobs)),
+            },
+        )
 
-    cmd = new_job.command()
-    logger.info(f"Running experiment {job_name} on core {core_id}.")
-    launch_code = subprocess.call(cmd, shell=True)
-    if launch_code != 0:
-        logger.warning(f"{job_name}: {cmd} returned {launch_code}.")
-    else:
-        running.append(new_job)
-
+    if not scheduler.running:
+        if jobs or post_jobs:
+            logger.error(
+                f"Not enough CPUs, memory or GPUs to run the {len(jobs) + len(post_jobs)} "
+                "remaining jobs."
+            )
+        break
+
+    # Wait for running jobs to finish
+    for assignment, exitcode in scheduler.wait(config.get("monitor_interval", 10)):
+        job = assignment.job
+        job_name = job.name()
+        reason = watchdog.intervention(job_name) if watchdog is not None else None
+        if watchdog is None or reason is None:
+            ledger.mark_finished(job_name, exitcode)
+            if job.stage == "warmup":
+                # The trials restore the cached warmup, or warm up themselves if it failed
+                jobs[:0] = held.pop(job_name, [])
+            elif stage_graph is not None and exitcode == 0:
+                release_successors(job)
+        elif watchdog.retries(job) < watchdog.max_retries:
+            # Start the trial over from scratch, later
+            watchdog.record(job, reason, "requeued")
+            backend.cleanup(job_name)
+            watchdog.reset_trial_folder(job)
+            ledger.mark_queued(job_name)
+            jobs.append(job)
+            logger.warning(f"{job_name} was killed by the watchdog ({reason}). Queued it again.")
+        else:
+            watchdog.record(job, reason, "failed")
+            ledger.mark_finished(job_name, exitcode if exitcode else -1)
+            logger.error(f"{job_name} was killed by the watchdog ({reason}). Giving up.")
+
+    # Kill trials that stopped making progress
+    if watchdog is not None:
+        for job_name, reason in watchdog.check(
+            [
+                assignment.job
+                for assignment in scheduler.running.values()
+                if assignment.job.stage == "fuzz"
+            ]
+        ).items():
+            logger.warning(f"{job_name}: {reason}. Killing it.")
+            backend.kill(job_name)
+
+if exporter is not None:
+    exporter.stop()
+backend.stop()
+ledger.close()
 logger.info("All jobs finished. Exiting.")
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Script running a fuzzing job in local scratch space.
+
+The trial folder in the command of the job is replaced by a new folder in the scratch folder.
+While the job runs, its output is copied to the trial folder every `--sync_interval` seconds.
+Once the job exited, including its corpus replay, the remaining changes are copied and the
+script exits with the exit code of the job.
+
+Usage:
+
+    run_in_scratch.py [--scratch_folder DIR] [--sync_interval S] trial_folder -- command...
+"""
+import argparse
+import logging
+import signal
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Sequence
+
+from mlfuzz.scratch import ScratchSyncer
+
+# Configure console logger
+logging.basicConfig(
+    stream=sys.stdout,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    level=logging.INFO,
+)
+logger = logging.getLogger("neuzzpp")
+
+
+def main(argv: Sequence[str] = tuple(sys.argv)) -> None:
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        "--scratch_folder", help="folder for the scratch output", type=str, default="/scratch"
+    )
+    parser.add_argument(
+        "--sync_interval", help="seconds between copies to the trial folder", type=float, default=60
+    )
+    parser.add_argument("trial_folder", help="output folder of the job", type=str)
+    parser.add_argument("command", help="command running the job", nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv[1:])
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    if not command:
+        parser.error("missing job command")
+
+    Path(args.scratch_folder).mkdir(parents=True, exist_ok=True)
+    scratch = Path(tempfile.mkdtemp(prefix="trial-", dir=args.scratch_folder))
+    trial_folder = Path(args.trial_folder)
+    command = [str(scratch) if arg == str(trial_folder) else arg for arg in command]
+    logger.info(f"Running in {scratch}, copied to {trial_folder}.")
+
+    syncer = ScratchSyncer(scratch, trial_folder, args.sync_interval)
+    syncer.start()
+    proc = subprocess.Popen(command)
+
+    # Let the job stop cleanly when the container is stopped, then copy its output
+    def forward(signum: int, frame: Any) -> None:
+        proc.send_signal(signum)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    exitcode = proc.wait()
+    syncer.stop()
+    logger.info(f"Copied the output of the job to {trial_folder}.")
+    sys.exit(exitcode)
+
+
+if __name__ == "__main__":
+    main()
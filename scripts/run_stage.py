@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Script running one post-processing stage on the output of a finished fuzzing trial:
+
+  - `replay`: replay the corpus on the target to compute `replayed_plot_data`.
+  - `coverage`: summarize the replayed coverage in `coverage_summary.json`.
+  - `triage`: run the crashing inputs and deduplicate them by stack trace in
+    `crash_triage.json`.
+
+It is started by `run_experiments.py` as a separate job once the stage it depends on finished
+(see `post_processing` in `experiment_config.yaml`). Artifacts are only written once complete.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence, Set
+
+from mlfuzz.stages import output_folder, post_processing_stages, stages
+
+# Configure console logger
+logging.basicConfig(
+    stream=sys.stdout,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    level=logging.INFO,
+)
+logger = logging.getLogger("neuzzpp")
+
+
+def write_json(path: Path, data: Dict[str, Any]) -> None:
+    """Write a JSON artifact atomically, so that it is never seen partially written."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w") as out_file:
+        json.dump(data, out_file, indent=2)
+    os.replace(tmp_path, path)
+
+
+def replay(out_folder: Path, target: Path, coverage_cache: Optional[str]) -> None:
+    from mlfuzz.coverage_cache import open_cache
+    from mlfuzz.replay import replay_corpus
+
+    # The coverage file is only renamed into place once complete
+    replay_corpus(out_folder, target, cache=open_cache(coverage_cache))
+
+
+def summarize_coverage(out_folder: Path) -> None:
+    times, edges = [], []
+    with open(out_folder / stages["replay"].artifact, "r") as plot_file:
+        for line in plot_file:
+            if line.startswith("#") or not line.strip():
+                continue
+            relative_time, edges_found = line.split(",")[:2]
+            times.append(int(relative_time))
+            edges.append(int(edges_found))
+    final_edges = edges[-1] if edges else 0
+    summary = {
+        "edges_found": final_edges,
+        # Relative time of the first seed reaching the final coverage
+        "time_to_final_coverage": next(
+            (time for time, count in zip(times, edges) if count == final_edges), None
+        ),
+        "replayed_seeds": len(edges),
+    }
+    write_json(out_folder / stages["coverage"].artifact, summary)
+
+
+def triage_crashes(out_folder: Path, target: Path) -> None:
+    from analyze_crashes import test_crashes_folder
+
+    # Same sanitizer options as `analyze_crashes.py`: no leak detection under GDB
+    os.environ["ASAN_OPTIONS"] = "detect_leaks=0:abort_on_error=1"
+    n_files = 0
+    unique_errors: Set[str] = set()
+    if (out_folder / "crashes").is_dir():
+        n_files, unique_errors = test_crashes_folder(target, out_folder / "crashes")
+    triage = {
+        "crashing_inputs": n_files,
+        "unique_crashes": len(unique_errors),
+        "stack_traces": sorted(unique_errors),
+    }
+    write_json(out_folder / stages["triage"].artifact, triage)
+
+
+def main(argv: Sequence[str] = tuple(sys.argv)) -> None:
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("stage", help="stage to run", choices=post_processing_stages)
+    parser.add_argument("trial_folder", help="output folder of the fuzzing trial", type=str)
+    parser.add_argument("target_binary", help="fuzzed target", type=str)
+    parser.add_argument(
+        "--coverage_cache",
+        help="SQLite file caching the edges of seeds, used by the replay",
+        type=str,
+        default=None,
+    )
+    args = parser.parse_args(argv[1:])
+
+    out_folder = output_folder(Path(args.trial_folder))
+    target = Path(args.target_binary)
+    logger.info(f"Running stage {args.stage} on {out_folder}.")
+    if args.stage == "replay":
+        replay(out_folder, target, args.coverage_cache)
+    elif args.stage == "coverage":
+        summarize_coverage(out_folder)
+    else:
+        triage_crashes(out_folder, target)
+    logger.info(f"Stage {args.stage} done.")
+
+
+if __name__ == "__main__":
+    main()
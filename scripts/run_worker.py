@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+This script runs the jobs of a distributed experiment on the local host.
+
+The jobs are pulled from a coordinator started with `run_experiments.py --serve HOST:PORT`.
+The hardware and execution settings of the host (`n_cpus`, `n_gpus`, `use_gpu`, `backend`, ...)
+are read from the local `experiment_config.yaml`. All hosts must see the binaries, seeds and
+results folders at the same paths, e.g., on a shared file system.
+"""
+import argparse
+import logging
+import socket
+import sys
+from pathlib import Path
+from typing import Sequence
+
+import yaml
+
+from mlfuzz.backends import backend_from_config
+from mlfuzz.distributed import Worker, parse_address
+from mlfuzz.scheduler import scheduler_from_config
+
+
+def main(argv: Sequence[str] = tuple(sys.argv)) -> None:
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("coordinator", help="address of the coordinator as HOST:PORT", type=str)
+    parser.add_argument(
+        "--name", help="unique name of the worker", type=str, default=socket.gethostname()
+    )
+    parser.add_argument(
+        "--config",
+        help="experiment configuration of the host",
+        type=str,
+        default=str(Path(__file__).parent / "experiment_config.yaml"),
+    )
+    parser.add_argument("--n_cpus", help="override the number of jobs to run at a time", type=int)
+    parser.add_argument("--n_gpus", help="override the number of GPUs to use", type=int)
+    args = parser.parse_args(argv[1:])
+
+    logging.basicConfig(
+        stream=sys.stdout,
+        format=f"%(asctime)s - {args.name} - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+
+    with open(args.config, "r") as conf_file:
+        config = yaml.load(conf_file, Loader=yaml.FullLoader)
+
+    backend = backend_from_config(config)
+    backend.start()
+    scheduler = scheduler_from_config(backend, config, n_cpus=args.n_cpus, n_gpus=args.n_gpus)
+    worker = Worker(
+        parse_address(args.coordinator),
+        args.name,
+        scheduler,
+        heartbeat_interval=config.get("monitor_interval", 10),
+    )
+    try:
+        worker.run()
+    finally:
+        backend.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+This script predicts the makespan and utilization of an experiment for each job order,
+without running any job.
+
+The jobs and resources are read from `experiment_config.yaml`. The run time of the jobs is
+estimated from the finished jobs of the experiment ledger, if it exists, and of the ledgers
+listed in `cost_history`.
+"""
+import argparse
+import sys
+from pathlib import Path
+from typing import Sequence
+
+import yaml
+
+from mlfuzz.costs import cost_model_from_config, job_orders, order_jobs
+from mlfuzz.experiment import Job, gpu_fuzzers, jobs_from_config
+from mlfuzz.ledger import JobLedger
+from mlfuzz.resources import (
+    ResourceRequest,
+    job_request,
+    read_host_memory_mb,
+    resource_requests_from_config,
+)
+from mlfuzz.simulation import simulate
+
+
+def main(argv: Sequence[str] = tuple(sys.argv)) -> None:
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        "--config",
+        help="experiment configuration",
+        type=str,
+        default=str(Path(__file__).parent / "experiment_config.yaml"),
+    )
+    parser.add_argument("--n_cpus", help="override the number of jobs to run at a time", type=int)
+    parser.add_argument("--n_gpus", help="override the number of GPUs to use", type=int)
+    parser.add_argument(
+        "--orders", help="job orders to compare", nargs="+", choices=job_orders, default=job_orders
+    )
+    args = parser.parse_args(argv[1:])
+
+    with open(args.config, "r") as conf_file:
+        config = yaml.load(conf_file, Loader=yaml.FullLoader)
+    n_cpus = config["n_cpus"] if args.n_cpus is None else args.n_cpus
+    n_gpus = config["n_gpus"] if args.n_gpus is None else args.n_gpus
+    use_gpu = config["use_gpu"]
+
+    results_folder = Path(config["results_folder"])
+    ledger_file = Path(config.get("ledger_file") or str(results_folder) + ".jobs.sqlite")
+    ledger = JobLedger(ledger_file) if ledger_file.exists() else None
+    if ledger is not None and not ledger.matches(results_folder, config["duration"]):
+        print(f"Ignoring {ledger_file}, which belongs to another experiment.")
+        ledger.close()
+        ledger = None
+    costs = cost_model_from_config(config, ledger)
+    if ledger is not None:
+        ledger.close()
+
+    jobs = jobs_from_config(config)
+    requests = resource_requests_from_config(config, gpu_fuzzers)
+    n_gpus = n_gpus if use_gpu else 0
+    memory_mb = config.get("memory_mb") or read_host_memory_mb()
+
+    def request(job: Job) -> ResourceRequest:
+        return job_request(requests, job.fuzzer, use_gpu and job.fuzzer in gpu_fuzzers)
+
+    total = sum(costs.estimate(job) for job in jobs)
+    gpu_total = sum(costs.estimate(job) * request(job).gpu for job in jobs)
+    longest = max((costs.estimate(job) for job in jobs), default=0.0)
+    bound = max(total / n_cpus, gpu_total / n_gpus if n_gpus > 0 else 0.0, longest)
+    print(f"{len(jobs)} jobs on {n_cpus} cores and {n_gpus} GPUs.")
+    print(
+        f"Estimated job time: {total / 3600:.1f} core-hours, longest job {longest / 3600:.2f} h, "
+        f"makespan lower bound {bound / 3600:.2f} h."
+    )
+    print(f"{'order':<12} {'makespan':>10} {'CPU use':>8} {'GPU use':>8}")
+    for order in args.orders:
+        result = simulate(
+            order_jobs(jobs, order, costs),
+            costs.estimate,
+            request,
+            n_cpus,
+            n_gpus=n_gpus,
+            memory_mb=memory_mb,
+        )
+        print(
+            f"{order:<12} {result.makespan / 3600:>8.2f} h {result.cpu_utilization:>8.1%} "
+            f"{result.gpu_utilization:>8.1%}"
+        )
+        if result.unschedulable:
+            print(f"  {len(result.unschedulable)} jobs never fit the resources of the host.")
+
+
+if __name__ == "__main__":
+    main()
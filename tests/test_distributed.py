@@ -0,0 +1,137 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from mlfuzz.backends import ExecutionBackend
+from mlfuzz.distributed import Coordinator, Worker, parse_address, request
+from mlfuzz.experiment import Job, JobAssignment
+from mlfuzz.ledger import JobLedger, JobState
+from mlfuzz.scheduler import scheduler_from_config
+
+
+class FakeBackend(ExecutionBackend):
+    """Backend whose jobs succeed after a fixed run time, recording who launched them."""
+
+    def __init__(self, worker: str, launches: List[Tuple[str, str]], runtime: float) -> None:
+        self.worker = worker
+        self.launches = launches
+        self.runtime = runtime
+        self.end_times: Dict[str, float] = {}
+
+    def launch(self, assignment: JobAssignment, command: Sequence[str]) -> Optional[str]:
+        self.launches.append((assignment.job.name(), self.worker))
+        self.end_times[assignment.job.name()] = time.monotonic() + self.runtime
+        return assignment.job.name()
+
+    def adopt(self, name: str, handle: str) -> bool:
+        return False
+
+    def wait(self, timeout: float) -> Dict[str, Optional[int]]:
+        now = time.monotonic()
+        next_end = min(self.end_times.values(), default=now + timeout)
+        time.sleep(max(0.0, min(timeout, next_end - now)))
+        now = time.monotonic()
+        finished = [name for name, end_time in self.end_times.items() if end_time <= now]
+        for name in finished:
+            del self.end_times[name]
+        return {name: 0 for name in finished}
+
+    def kill(self, name: str) -> None:
+        self.end_times[name] = 0.0
+
+    def save_logs(self, name: str, log_path: Path) -> None:
+        log_path.write_text(f"{name} ran on {self.worker}\n")
+
+    def cleanup(self, name: str) -> None:
+        pass
+
+
+def start_coordinator(
+    tmp_path: Path, n_jobs: int, heartbeat_timeout: float
+) -> Tuple[Coordinator, JobLedger, List[Job], threading.Thread]:
+    jobs = [Job(Path("/targets/json"), "AFL", trial, trial, False) for trial in range(n_jobs)]
+    ledger = JobLedger(tmp_path / "jobs.sqlite")
+    ledger.register(jobs)
+    coordinator = Coordinator(
+        jobs,
+        ledger,
+        tmp_path / "results",
+        lambda job: ["fuzz", job.name()],
+        heartbeat_timeout=heartbeat_timeout,
+    )
+    thread = threading.Thread(target=coordinator.run, args=(("127.0.0.1", 0),), daemon=True)
+    thread.start()
+    while coordinator.address is None:
+        time.sleep(0.01)
+    return coordinator, ledger, jobs, thread
+
+
+def start_worker(
+    tmp_path: Path, coordinator: Coordinator, name: str, launches: List[Tuple[str, str]]
+) -> threading.Thread:
+    # Set up like `run_worker.py`, with a fake backend
+    config = {
+        "n_cpus": 2,
+        "n_gpus": 0,
+        "use_gpu": False,
+        "cpu_topology": False,
+        "results_folder": str(tmp_path / "results"),
+    }
+    scheduler = scheduler_from_config(FakeBackend(name, launches, runtime=0.1), config)
+    host, port = coordinator.address
+    worker = Worker(parse_address(f"{host}:{port}"), name, scheduler, heartbeat_interval=0.05)
+    thread = threading.Thread(target=worker.run, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_workers_run_each_job_once(tmp_path: Path) -> None:
+    coordinator, ledger, jobs, thread = start_coordinator(tmp_path, 10, heartbeat_timeout=30)
+    launches: List[Tuple[str, str]] = []
+    workers = [start_worker(tmp_path, coordinator, name, launches) for name in ("w1", "w2")]
+
+    for worker in workers:
+        worker.join(timeout=30)
+        assert not worker.is_alive()
+    thread.join(timeout=30)
+    assert not thread.is_alive()
+    assert sorted(name for name, _ in launches) == sorted(job.name() for job in jobs)
+    assert {worker for _, worker in launches} == {"w1", "w2"}
+    assert [entry.state for entry in ledger.entries()] == [JobState.FINISHED] * len(jobs)
+    for name, worker_name in launches:
+        assert ledger.get(name).handle == f"{worker_name}:{name}"
+    ledger.close()
+
+
+def test_jobs_of_silent_worker_are_requeued(tmp_path: Path) -> None:
+    coordinator, ledger, jobs, thread = start_coordinator(tmp_path, 4, heartbeat_timeout=0.5)
+    # A worker that takes two jobs, then never reports back
+    answer = request(
+        coordinator.address,
+        {"op": "pull", "worker": "lost", "running": [], "cpus": 2, "gpus": 0, "use_gpu": False},
+    )
+    lost_jobs = {item["job"]["trial"] for item in answer["jobs"]}
+    assert lost_jobs == {0, 1}
+
+    launches: List[Tuple[str, str]] = []
+    worker = start_worker(tmp_path, coordinator, "w1", launches)
+    worker.join(timeout=30)
+    thread.join(timeout=30)
+    assert not worker.is_alive() and not thread.is_alive()
+    assert sorted(name for name, _ in launches) == sorted(job.name() for job in jobs)
+    assert [entry.state for entry in ledger.entries()] == [JobState.FINISHED] * len(jobs)
+    ledger.close()
@@ -0,0 +1,251 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import json
+import struct
+from pathlib import Path
+from typing import Any, Dict, List, Sequence, Tuple, Union
+from urllib.parse import parse_qs
+
+import pytest
+
+from mlfuzz.docker_api import DockerApiError, DockerClient, LogDemuxer
+
+# Response of the fake daemon: raw bytes, or parts sent one at a time
+Response = Union[bytes, Sequence[bytes]]
+
+
+def json_response(content: Any, status: int = 200, close: bool = False) -> bytes:
+    body = json.dumps(content).encode()
+    head = (
+        f"HTTP/1.1 {status} Status\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+    )
+    if close:
+        head += "Connection: close\r\n"
+    return head.encode() + b"\r\n" + body
+
+
+def chunked_response(chunks: Sequence[bytes], content_type: str) -> List[bytes]:
+    head = f"HTTP/1.1 200 OK\r\nContent-Type: {content_type}\r\nTransfer-Encoding: chunked\r\n\r\n"
+    parts = [head.encode()]
+    parts += [f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n" for chunk in chunks]
+    parts.append(b"0\r\n\r\n")
+    return parts
+
+
+def log_frame(stream: int, data: bytes) -> bytes:
+    return struct.pack(">BxxxI", stream, len(data)) + data
+
+
+class FakeDaemon:
+    """Stand-in for the Docker daemon, answering requests on a Unix socket with canned responses."""
+
+    def __init__(self, socket_path: Path, routes: Dict[Tuple[str, str], Response]) -> None:
+        self.socket_path = socket_path
+        self.routes = routes
+        self.requests: List[Tuple[str, str, Dict[str, List[str]], bytes]] = []
+        self.n_connections = 0
+
+    async def __aenter__(self) -> "FakeDaemon":
+        self.server = await asyncio.start_unix_server(self._serve, str(self.socket_path))
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.n_connections += 1
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError:
+                    return  # Closed by the client
+                request_line, *header_lines = head.decode().split("\r\n")
+                method, target, _ = request_line.split()
+                headers = dict(line.lower().split(": ", 1) for line in header_lines if line)
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                path, _, query = target.partition("?")
+                self.requests.append((method, path, parse_qs(query), body))
+
+                response = self.routes.get(
+                    (method, path), json_response({"message": "page not found"}, 404)
+                )
+                parts = [response] if isinstance(response, bytes) else list(response)
+                for part in parts:
+                    writer.write(part)
+                    await writer.drain()
+                    await asyncio.sleep(0)  # Let the client read every part on its own
+                if b"connection: close" in parts[0].lower():
+                    return
+        finally:
+            writer.close()
+
+
+def container_info(name: str, status: str = "running", exit_code: int = 0) -> Dict[str, Any]:
+    return {
+        "Id": f"{name}-id",
+        "Name": f"/{name}",
+        "State": {"Status": status, "ExitCode": exit_code, "OOMKilled": False},
+    }
+
+
+def run_with_daemon(tmp_path: Path, routes: Dict[Tuple[str, str], Response], test: Any) -> Any:
+    """Run `test(client, daemon)` against a fake daemon, returning its result."""
+
+    async def main() -> Any:
+        async with FakeDaemon(tmp_path / "docker.sock", routes) as daemon:
+            client = DockerClient(str(daemon.socket_path))
+            try:
+                return await test(client, daemon)
+            finally:
+                await client.close()
+
+    return asyncio.run(main())
+
+
+def test_content_length_body_on_kept_alive_connection(tmp_path: Path) -> None:
+    routes: Dict[Tuple[str, str], Response] = {
+        ("GET", "/containers/trial-0/json"): json_response(container_info("trial-0")),
+        ("GET", "/containers/trial-1/json"): json_response(container_info("trial-1", "exited", 3)),
+    }
+
+    async def test(client: DockerClient, daemon: FakeDaemon) -> None:
+        first = await client.inspect_container("trial-0")
+        second = await client.inspect_container("trial-1")
+        assert (first.name, first.running) == ("trial-0", True)
+        assert (second.id, second.running, second.exit_code) == ("trial-1-id", False, 3)
+        assert daemon.n_connections == 1
+
+    run_with_daemon(tmp_path, routes, test)
+
+
+def test_new_connection_after_connection_close(tmp_path: Path) -> None:
+    routes: Dict[Tuple[str, str], Response] = {
+        ("GET", "/containers/trial-0/json"): json_response(container_info("trial-0"), close=True),
+    }
+
+    async def test(client: DockerClient, daemon: FakeDaemon) -> None:
+        for _ in range(2):
+            assert (await client.inspect_container("trial-0")).running
+        assert daemon.n_connections == 2
+
+    run_with_daemon(tmp_path, routes, test)
+
+
+def test_chunked_body(tmp_path: Path) -> None:
+    body = json.dumps(
+        [
+            {"Id": "a-id", "Names": ["/a"], "State": "running", "Status": "Up 2 hours"},
+            {"Id": "b-id", "Names": ["/b"], "State": "exited", "Status": "Exited (0)"},
+        ]
+    ).encode()
+    routes: Dict[Tuple[str, str], Response] = {
+        ("GET", "/containers/json"): chunked_response(
+            [body[:7], body[7:50], body[50:]], "application/json"
+        ),
+        ("GET", "/_ping"): json_response("OK"),
+    }
+
+    async def test(client: DockerClient, daemon: FakeDaemon) -> None:
+        containers = await client.list_containers()
+        assert [(container.name, container.state) for container in containers] == [
+            ("a", "running"),
+            ("b", "exited"),
+        ]
+        assert daemon.requests[0][2] == {"all": ["1"]}
+        # The connection is still usable after the end of the chunked body
+        assert await client.ping()
+        assert daemon.n_connections == 1
+
+    run_with_daemon(tmp_path, routes, test)
+
+
+def test_inspect_containers_missing(tmp_path: Path) -> None:
+    routes: Dict[Tuple[str, str], Response] = {
+        ("GET", "/containers/trial-0/json"): json_response(container_info("trial-0")),
+        ("GET", "/containers/trial-1/json"): json_response(
+            {"message": "No such container: trial-1"}, 404
+        ),
+        ("GET", "/containers/trial-2/json"): json_response({"message": "daemon error"}, 500),
+    }
+
+    async def test(client: DockerClient, daemon: FakeDaemon) -> None:
+        states = await client.inspect_containers(["trial-0", "trial-1"])
+        assert states["trial-0"] is not None and states["trial-0"].running
+        assert states["trial-1"] is None
+        with pytest.raises(DockerApiError) as error:
+            await client.inspect_containers(["trial-0", "trial-2"])
+        assert (error.value.status, error.value.message) == (500, "daemon error")
+
+    run_with_daemon(tmp_path, routes, test)
+
+
+def test_events_stream(tmp_path: Path) -> None:
+    events = [
+        {"Type": "container", "Action": "die", "Actor": {"Attributes": {"name": "trial-0"}}},
+        {"Type": "container", "Action": "die", "Actor": {"Attributes": {"name": "trial-1"}}},
+    ]
+    first, second = (json.dumps(event).encode() + b"\n" for event in events)
+    routes: Dict[Tuple[str, str], Response] = {
+        # Events split across chunks, and a chunk with only an empty line
+        ("GET", "/events"): chunked_response(
+            [first[:10], first[10:], b"\n", second[:20], second[20:]], "application/json"
+        ),
+    }
+    filters = {"type": ["container"], "event": ["die"]}
+
+    async def test(client: DockerClient, daemon: FakeDaemon) -> None:
+        received = [event async for event in client.events(filters)]
+        assert received == events
+        assert json.loads(daemon.requests[0][2]["filters"][0]) == filters
+
+    run_with_daemon(tmp_path, routes, test)
+
+
+def test_stream_logs(tmp_path: Path) -> None:
+    frames = log_frame(1, b"fuzzing\n") + log_frame(2, b"warning\n") + log_frame(1, b"done\n")
+    routes: Dict[Tuple[str, str], Response] = {
+        ("GET", "/containers/trial-0/logs"): chunked_response(
+            [frames[:3], frames[3:12], frames[12:]], "application/vnd.docker.raw-stream"
+        ),
+    }
+
+    async def test(client: DockerClient, daemon: FakeDaemon) -> None:
+        output = b"".join([data async for data in client.stream_logs("trial-0", follow=False)])
+        assert output == b"fuzzing\nwarning\ndone\n"
+        assert daemon.requests[0][2]["follow"] == ["0"]
+        with pytest.raises(DockerApiError) as error:
+            async for _ in client.stream_logs("trial-1"):
+                pass
+        assert error.value.status == 404
+
+    run_with_daemon(tmp_path, routes, test)
+
+
+def test_log_demuxer_frames() -> None:
+    data = log_frame(1, b"out\n") + log_frame(2, b"") + log_frame(2, b"err\n" * 100)
+    for step in (1, 3, 8, 13, len(data)):
+        demuxer = LogDemuxer()
+        output = b"".join(demuxer.feed(data[i : i + step]) for i in range(0, len(data), step))
+        assert output == b"out\n" + b"err\n" * 100
+
+
+def test_log_demuxer_raw_output() -> None:
+    demuxer = LogDemuxer()
+    assert demuxer.feed(b"ab") == b""  # Not enough bytes to tell whether the output is framed
+    assert demuxer.feed(b"c: tty output\n") == b"abc: tty output\n"
+    assert demuxer.feed(b"\x01\x00\x00\x00") == b"\x01\x00\x00\x00"
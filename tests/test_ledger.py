@@ -0,0 +1,36 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from pathlib import Path
+
+import pytest
+
+from mlfuzz.ledger import JobLedger
+
+
+def test_ledger_belongs_to_one_experiment(tmp_path: Path) -> None:
+    ledger = JobLedger(tmp_path / "jobs.sqlite")
+    assert ledger.experiment() == {}
+    ledger.bind(tmp_path / "results", 600)
+    ledger.close()
+
+    # Reopened for the same experiment
+    ledger = JobLedger(tmp_path / "jobs.sqlite")
+    ledger.bind(tmp_path / "results", 600.0)
+    assert ledger.matches(tmp_path / "results", 600)
+    for results_folder, duration in [(tmp_path / "other", 600), (tmp_path / "results", 86400)]:
+        assert not ledger.matches(results_folder, duration)
+        with pytest.raises(ValueError):
+            ledger.bind(results_folder, duration)
+    assert ledger.experiment()["duration"] == 600
+    ledger.close()
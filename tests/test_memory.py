@@ -0,0 +1,49 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from pathlib import Path
+from typing import List, Tuple
+
+from mlfuzz.experiment import Job
+from mlfuzz.memory import MemoryGuard
+
+
+def afl_job(target: str, trial: int) -> Job:
+    return Job(Path("/targets") / target, "AFL", trial, trial, False)
+
+
+def test_jobs_launched_in_a_round_count_with_the_floor() -> None:
+    # Not sampled yet: the host counts as empty, and no job has a request or history
+    guard = MemoryGuard(4096, floor_mb=1024)
+    running: List[Tuple[Job, int]] = []
+    for trial in range(6):
+        job = afl_job("json", trial)
+        if not guard.admits(job, 0, running):
+            break
+        running.append((job, 0))
+    assert len(running) == 4
+
+
+def test_expected_memory_from_earlier_trials() -> None:
+    guard = MemoryGuard(1 << 30, floor_mb=1024)
+    guard.update({afl_job("json", 0).name(): 300, afl_job("json", 1).name(): 100})
+    guard.update({afl_job("json", 0).name(): 200})
+    guard.finished(afl_job("json", 0))
+    guard.finished(afl_job("json", 1))
+    guard.finished(afl_job("json", 2))  # Never measured
+
+    assert guard.expected_mb(afl_job("json", 3), 0) == 300
+    assert guard.expected_mb(afl_job("json", 3), 512) == 512
+    # The fuzzer was measured on another target
+    assert guard.expected_mb(afl_job("libpng", 0), 0) == 300
+    assert guard.expected_mb(Job(Path("/targets/json"), "NEUZZPP", 0, 0, False), 0) == 1024
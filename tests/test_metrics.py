@@ -0,0 +1,40 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from pathlib import Path
+
+from mlfuzz.experiment import Job
+from mlfuzz.metrics import MetricsExporter, MetricsSnapshot
+
+
+def test_exporter_serves_published_snapshot(tmp_path: Path) -> None:
+    job = Job(Path("/targets/json"), "AFL", 0, 0, False)
+    job.folder(tmp_path).mkdir(parents=True)
+    (job.folder(tmp_path) / "fuzzer_stats").write_text("execs_done : 1000\nexecs_per_sec : 50.5\n")
+    metrics = MetricsSnapshot()
+    exporter = MetricsExporter(tmp_path, metrics.trials, metrics.gauges)
+    running = [job]
+    gauges = {"mlfuzz_running_jobs": 1.0}
+    metrics.publish(running, gauges)
+
+    # Later changes of the scheduler state are only visible once published
+    running.clear()
+    gauges["mlfuzz_running_jobs"] = 0.0
+    lines = exporter.render().splitlines()
+    assert "mlfuzz_running_jobs 1" in lines
+    assert any(line.endswith(" 50.5") and 'target="json"' in line for line in lines)
+
+    metrics.publish(running, gauges)
+    lines = exporter.render().splitlines()
+    assert "mlfuzz_running_jobs 0" in lines
+    assert not any('target="json"' in line for line in lines)
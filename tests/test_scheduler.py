@@ -0,0 +1,82 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from mlfuzz.backends import ExecutionBackend
+from mlfuzz.experiment import Job, JobAssignment
+from mlfuzz.resources import ResourcePool, ResourceRequest
+from mlfuzz.scheduler import JobScheduler
+from mlfuzz.topology import CoreAllocator, CpuTopology
+
+
+class FakeBackend(ExecutionBackend):
+    """Backend whose jobs run until the test ends them."""
+
+    def __init__(self) -> None:
+        self.launched: Dict[str, JobAssignment] = {}
+        self.exit_codes: Dict[str, Optional[int]] = {}
+
+    def launch(self, assignment: JobAssignment, command: Sequence[str]) -> Optional[str]:
+        self.launched[assignment.job.name()] = assignment
+        return assignment.job.name()
+
+    def adopt(self, name: str, handle: str) -> bool:
+        return False
+
+    def wait(self, timeout: float) -> Dict[str, Optional[int]]:
+        finished, self.exit_codes = self.exit_codes, {}
+        return finished
+
+    def kill(self, name: str) -> None:
+        self.exit_codes[name] = None
+
+    def save_logs(self, name: str, log_path: Path) -> None:
+        log_path.write_text("")
+
+    def cleanup(self, name: str) -> None:
+        pass
+
+
+def ml_jobs(n_jobs: int) -> List[Job]:
+    return [Job(Path("/targets/json"), "NEUZZPP", trial, trial, False) for trial in range(n_jobs)]
+
+
+def test_gpu_fractions_share_a_gpu(tmp_path: Path) -> None:
+    backend = FakeBackend()
+    scheduler = JobScheduler(
+        backend,
+        tmp_path,
+        CoreAllocator(CpuTopology.flat(8), range(8)),
+        ResourcePool(None, range(1)),
+        use_gpu=True,
+        requests={"NEUZZPP": ResourceRequest(gpu=0.25)},
+    )
+    jobs = ml_jobs(5)
+
+    launched = scheduler.fill(jobs, lambda job: ["fuzz"])
+    assert [assignment.gpu_id for assignment, _ in launched] == [0, 0, 0, 0]
+    assert len({assignment.core_id for assignment, _ in launched}) == 4
+    # The fifth job waits for a GPU share, although cores are free
+    assert jobs == ml_jobs(5)[4:]
+    assert scheduler.cores.available() == 4
+    assert scheduler.fill(jobs, lambda job: ["fuzz"]) == []
+
+    backend.exit_codes[launched[0][0].job.name()] = 0
+    assert len(scheduler.wait(0)) == 1
+    launched = scheduler.fill(jobs, lambda job: ["fuzz"])
+    assert [(assignment.job, assignment.gpu_id) for assignment, _ in launched] == [
+        (ml_jobs(5)[4], 0)
+    ]
+    assert jobs == []
@@ -0,0 +1,86 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+from pathlib import Path
+from typing import Dict, Set
+
+from mlfuzz.scratch import ScratchSyncer
+
+
+def read_tree(folder: Path) -> Dict[str, bytes]:
+    return {
+        str(path.relative_to(folder)): path.read_bytes()
+        for path in folder.rglob("*")
+        if path.is_file()
+    }
+
+
+def list_folders(folder: Path) -> Set[str]:
+    return {str(path.relative_to(folder)) for path in folder.rglob("*") if path.is_dir()}
+
+
+def test_sync_copies_changes(tmp_path: Path) -> None:
+    scratch, trial = tmp_path / "scratch", tmp_path / "trial"
+    (scratch / "queue").mkdir(parents=True)
+    (scratch / "queue" / "id:000000").write_bytes(b"seed")
+    (scratch / "fuzzer_stats").write_text("execs_done : 1\n")
+    (scratch / ".cur_input").write_bytes(b"volatile")
+    syncer = ScratchSyncer(scratch, trial)
+
+    assert syncer.sync() == 2
+    assert read_tree(trial) == {"queue/id:000000": b"seed", "fuzzer_stats": b"execs_done : 1\n"}
+    assert syncer.sync() == 0
+
+    (scratch / "fuzzer_stats").write_text("execs_done : 1000\n")
+    os.utime(scratch / "fuzzer_stats", ns=(0, 10**9))
+    assert syncer.sync() == 1
+    assert (trial / "fuzzer_stats").read_text() == "execs_done : 1000\n"
+    assert (trial / "fuzzer_stats").stat().st_mtime_ns == 10**9
+
+
+def test_sync_follows_renamed_folder(tmp_path: Path) -> None:
+    scratch, trial = tmp_path / "scratch", tmp_path / "trial"
+    (scratch / "queue" / ".state").mkdir(parents=True)
+    for index in range(3):
+        (scratch / "queue" / f"id:{index:06d}").write_bytes(bytes([index]))
+    (scratch / "queue" / ".state" / "auto_extras").write_bytes(b"extras")
+    syncer = ScratchSyncer(scratch, trial)
+    syncer.sync()
+
+    # NEUZZ and PreFuzz turn the queue of their AFL warmup into their input folder
+    (scratch / "queue").rename(scratch / "neuzz_in")
+    (scratch / "queue").mkdir()
+    (scratch / "queue" / "id_0").write_bytes(b"ml seed")
+    syncer.sync()
+
+    assert read_tree(trial) == read_tree(scratch)
+    assert list_folders(trial) == list_folders(scratch)
+
+
+def test_sync_keeps_foreign_files(tmp_path: Path) -> None:
+    scratch, trial = tmp_path / "scratch", tmp_path / "trial"
+    (scratch / "crashes").mkdir(parents=True)
+    (scratch / "crashes" / "id:000000").write_bytes(b"crash")
+    (scratch / "plot_data").write_text("# header\n")
+    syncer = ScratchSyncer(scratch, trial)
+    syncer.sync()
+    (trial / "docker.log").write_text("log")
+    (trial / "crashes" / "README.txt").write_text("notes")
+
+    (scratch / "crashes" / "id:000000").unlink()
+    (scratch / "crashes").rmdir()
+    (scratch / "plot_data").unlink()
+    syncer.stop()
+
+    assert read_tree(trial) == {"docker.log": b"log", "crashes/README.txt": b"notes"}
@@ -0,0 +1,59 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, Dict
+
+import yaml
+
+repo = Path(__file__).parents[1]
+
+
+def simulate_schedule(tmp_path: Path, config: Dict[str, Any]) -> str:
+    config_file = tmp_path / "experiment_config.yaml"
+    config_file.write_text(yaml.dump(config))
+    env = {**os.environ, "PYTHONPATH": str(repo)}
+    return subprocess.run(
+        [sys.executable, str(repo / "scripts" / "simulate_schedule.py"), "--config", config_file],
+        env=env,
+        stdout=subprocess.PIPE,
+        check=True,
+        text=True,
+    ).stdout
+
+
+def default_config(tmp_path: Path) -> Dict[str, Any]:
+    with open(repo / "scripts" / "experiment_config.yaml.default") as conf_file:
+        config = yaml.load(conf_file, Loader=yaml.FullLoader)
+    config["results_folder"] = str(tmp_path / "results")
+    return config
+
+
+def test_default_config(tmp_path: Path) -> None:
+    output = simulate_schedule(tmp_path, default_config(tmp_path))
+    lines = output.splitlines()
+    assert lines[0] == "207 jobs on 23 cores and 0 GPUs."
+    assert [line.split()[0] for line in lines[3:]] == ["fifo", "lpt", "trial_major"]
+    assert "never fit" not in output
+
+
+def test_host_memory_by_default(tmp_path: Path) -> None:
+    # `memory_mb: 0` stands for the memory of the host, not for a host without memory
+    config = default_config(tmp_path)
+    config["job_resources"]["default"] = {"memory_mb": 1}
+    output = simulate_schedule(tmp_path, config)
+    assert "never fit" not in output
+    assert "100.0%" in output
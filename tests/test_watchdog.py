@@ -0,0 +1,53 @@
+# Copyright (c) 2023 Robert Bosch GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import time
+from pathlib import Path
+from typing import Optional
+
+from mlfuzz.experiment import Job
+from mlfuzz.watchdog import Watchdog
+
+
+def started_trial(results_folder: Path, runtime: float, replay_time: Optional[float]) -> Job:
+    """A trial running for `runtime` seconds, replaying its corpus for the last `replay_time`."""
+    job = Job(Path("/targets/json"), "AFL", 0, 0, False)
+    folder = job.folder(results_folder)
+    folder.mkdir(parents=True)
+    now = time.time()
+    phases = [{"phase": "fuzzing", "start": now - runtime, "end": None}]
+    if replay_time is not None:
+        phases[0]["end"] = now - replay_time
+        phases.append({"phase": "replay", "start": now - replay_time, "end": None})
+    (folder / "phases.json").write_text(json.dumps({"phases": phases}))
+    return job
+
+
+def test_replay_is_timed_separately(tmp_path: Path) -> None:
+    # Long replays of large corpora are no stragglers
+    job = started_trial(tmp_path, runtime=7200, replay_time=6000)
+    watchdog = Watchdog(tmp_path, duration=1200)
+    watchdog.adopt(job, time.time() - 7200)
+    assert watchdog.check([job]) == {}
+
+    watchdog = Watchdog(tmp_path, duration=1200, max_replay_time=3600)
+    watchdog.adopt(job, time.time() - 7200)
+    assert watchdog.check([job]) == {job.name(): "straggler, replaying its corpus for 6000s"}
+
+
+def test_straggler_before_replay(tmp_path: Path) -> None:
+    job = started_trial(tmp_path, runtime=2500, replay_time=None)
+    watchdog = Watchdog(tmp_path, duration=1200, max_replay_time=3600)
+    watchdog.adopt(job, time.time() - 2500)
+    assert watchdog.check([job]) == {job.name(): "straggler, running for 2500s"}